@@ -0,0 +1,198 @@
+"""Per-subcommand import-time and startup benchmark for the odv-demo CLI.
+
+Each subcommand is resolved in a fresh interpreter started with
+``-X importtime``: the arguments are parsed and ``main.prepare`` imports
+whatever the subcommand needs, but nothing is sent to the network. Commands
+that complete offline (help and contract addresses) are also timed end to end.
+
+Usage:
+    python benchmarks/import_time.py [--repeat N] [--output FILE]
+                                     [--baseline FILE] [--threshold PCT]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BACKEND = ["blockfrost", "preprod"]
+
+SUBCOMMANDS = {
+    "help": ["--help"],
+    "swap-contract --address": [*BACKEND, "swap-contract", "--address"],
+    "oracle-contract --address": [*BACKEND, "oracle-contract", "--address"],
+    "user --address": [*BACKEND, "user", "--address"],
+    "user --liquidity": [*BACKEND, "user", "--liquidity"],
+    "swap-contract --liquidity": [*BACKEND, "swap-contract", "--liquidity"],
+    "oracle-contract --feed": [*BACKEND, "oracle-contract", "--feed"],
+    "trade tADA": [*BACKEND, "trade", "tADA", "--amount", "1"],
+    "send-odv-request": [*BACKEND, "send-odv-request"],
+    "serve": [*BACKEND, "serve"],
+}
+
+# Commands that run to completion without a chain backend.
+OFFLINE = ("help", "swap-contract --address", "oracle-contract --address")
+
+# Heavy packages reported separately when a subcommand imports them.
+TRACKED_PACKAGES = ("pycardano", "blockfrost", "cbor2", "yaml", "aiohttp")
+
+RESOLVE_SNIPPET = """
+import sys
+from swap_demo_contract.main import create_parser, prepare
+argv = sys.argv[1:]
+if argv != ["--help"]:
+    prepare(create_parser().parse_args(argv))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Summarize ``-X importtime`` output.
+
+    Returns:
+        dict: total self time in microseconds, module count and the cumulative
+        time of each tracked top-level package that was imported.
+    """
+    total_us = 0
+    modules = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (
+            part.strip() for part in line.replace("import time:", "|").split("|")
+        )
+        total_us += int(self_us)
+        modules += 1
+        if name in TRACKED_PACKAGES:
+            packages[name] = int(cumulative_us)
+    return {"import_us": total_us, "modules": modules, "packages": packages}
+
+
+def run_python(args, cwd, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, *args],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return time.perf_counter() - start, proc
+
+
+def bench(repeat: int) -> dict:
+    """Run every subcommand ``repeat`` times and keep the medians."""
+    workdir = tempfile.mkdtemp(prefix="odv-demo-bench-")
+    shutil.copy(
+        os.path.join(REPO_ROOT, "config.sample.yaml"),
+        os.path.join(workdir, "config.yaml"),
+    )
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+
+    baseline_ms = statistics.median(
+        run_python(["-c", "pass"], workdir, env)[0] * 1000 for _ in range(repeat)
+    )
+
+    results = {}
+    try:
+        for name, argv in SUBCOMMANDS.items():
+            samples = []
+            for _ in range(repeat):
+                _, proc = run_python(
+                    ["-X", "importtime", "-c", RESOLVE_SNIPPET, *argv], workdir, env
+                )
+                if proc.returncode != 0:
+                    raise RuntimeError(f"{name} failed to resolve:\n{proc.stderr}")
+                samples.append(parse_importtime(proc.stderr))
+            entry = {
+                "import_ms": statistics.median(s["import_us"] for s in samples) / 1000,
+                "modules": samples[-1]["modules"],
+                "packages_ms": {
+                    package: cumulative / 1000
+                    for package, cumulative in samples[-1]["packages"].items()
+                },
+            }
+            if name in OFFLINE:
+                entry["wall_ms"] = statistics.median(
+                    run_python(["-m", "swap_demo_contract.main", *argv], workdir, env)[
+                        0
+                    ]
+                    * 1000
+                    for _ in range(repeat)
+                )
+            results[name] = entry
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "python": sys.version.split()[0],
+        "interpreter_startup_ms": baseline_ms,
+        "subcommands": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """List the subcommands whose import or wall time grew past ``threshold``%."""
+    regressions = []
+    for name, entry in current["subcommands"].items():
+        previous = baseline.get("subcommands", {}).get(name)
+        if previous is None:
+            continue
+        for metric in ("import_ms", "wall_ms"):
+            if metric in entry and metric in previous and previous[metric] > 0:
+                change = (entry[metric] - previous[metric]) / previous[metric] * 100
+                if change > threshold:
+                    regressions.append(
+                        f"{name}: {metric} {previous[metric]:.1f} -> "
+                        f"{entry[metric]:.1f} (+{change:.0f}%)"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Previous results file to compare with.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        help="Percentage increase reported as a regression (default: 20).",
+    )
+    args = parser.parse_args()
+
+    results = bench(args.repeat)
+
+    print(f"interpreter startup: {results['interpreter_startup_ms']:.1f} ms")
+    for name, entry in results["subcommands"].items():
+        wall = f"  wall {entry['wall_ms']:7.1f} ms" if "wall_ms" in entry else ""
+        packages = ", ".join(sorted(entry["packages_ms"])) or "-"
+        print(
+            f"{name:28} imports {entry['import_ms']:7.1f} ms "
+            f"({entry['modules']:4} modules){wall}  [{packages}]"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="UTF-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,677 @@
+"""Benchmark suite for the swap, liquidity, mint and ODV flows.
+
+Every flow runs against the in-process ledger simulator, seeded afresh for
+each case, and Kupo parsing runs against a local Kupo stand-in served over
+HTTP, so nothing leaves the machine. For each case the suite records the
+median wall and CPU time, the peak and net memory allocated during one traced
+run, and the number of chain queries, evaluations, submissions and HTTP
+requests per run.
+
+Usage:
+    python benchmarks/suite.py [--repeat N] [--only SUBSTRING] [--output FILE]
+                               [--baseline FILE] [--threshold PCT]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# pylint: disable=wrong-import-position
+from aiohttp import web
+from pycardano import (
+    Address,
+    Asset,
+    AssetName,
+    HDWallet,
+    LargestFirstSelector,
+    MultiAsset,
+    Network,
+    RawCBOR,
+    ScriptHash,
+    TransactionBody,
+    TransactionBuilder,
+    TransactionId,
+    TransactionInput,
+    TransactionOutput,
+    UTxO,
+    Value,
+)
+
+from swap_demo_contract.lib.build_pool import MODES, BuildExecutor
+from swap_demo_contract.lib.coin_selection import STRATEGIES, CoinSelector, UTxOIndex
+from swap_demo_contract.lib.datums import AggDatum, GenericData, PriceData
+from swap_demo_contract.lib.kupo import KupoContext
+from swap_demo_contract.lib.quotes import Ladder
+from swap_demo_contract.lib.scripts import default_registry
+from swap_demo_contract.mint import Mint
+from swap_demo_contract.runtime import Runtime
+
+UTXO_COUNTS = (10, 1000, 10000)
+WALLET_UTXOS = 10000
+DATUM_DECODES = 1000
+BATCH_BUILDS = 16
+LADDER_SIZES = 100
+
+# Metrics compared against a baseline as a percentage change.
+TIMED_METRICS = ("wall_ms", "cpu_ms", "alloc_peak_kib")
+
+
+class KupoStandIn:
+    """Local HTTP server answering the Kupo endpoints the client uses.
+
+    ``/matches/<address>`` returns the outputs registered with
+    ``set_matches``; ``/datums/<hash>`` and ``/scripts/<hash>`` return what
+    was registered with ``add_datum`` and ``add_script``. Requests are
+    counted per endpoint in ``requests``.
+    """
+
+    def __init__(self) -> None:
+        self.requests: Counter = Counter()
+        self._matches = {}
+        self._datums = {}
+        self._scripts = {}
+        self._runner = None
+        self.url = None
+
+    def set_matches(self, address: str, results: list) -> None:
+        self._matches[address] = json.dumps(results).encode()
+
+    def add_datum(self, datum_hash: str, cbor: bytes) -> None:
+        self._datums[datum_hash] = cbor.hex()
+
+    def add_script(self, script_hash: str, language: str, script: bytes) -> None:
+        self._scripts[script_hash] = {"language": language, "script": script.hex()}
+
+    async def _matches_handler(self, request: web.Request) -> web.Response:
+        self.requests["matches"] += 1
+        body = self._matches.get(request.match_info["pattern"], b"[]")
+        return web.Response(body=body, content_type="application/json")
+
+    async def _datum_handler(self, request: web.Request) -> web.Response:
+        self.requests["datums"] += 1
+        datum = self._datums.get(request.match_info["hash"])
+        return web.json_response({"datum": datum} if datum else None)
+
+    async def _script_handler(self, request: web.Request) -> web.Response:
+        self.requests["scripts"] += 1
+        return web.json_response(self._scripts.get(request.match_info["hash"]))
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/matches/{pattern}", self._matches_handler)
+        app.router.add_get("/datums/{hash}", self._datum_handler)
+        app.router.add_get("/scripts/{hash}", self._script_handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        sockets = site._server.sockets  # pylint: disable=protected-access
+        port = sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+def kupo_results(count: int, address: str, policy: str, datums: list) -> list:
+    """``count`` Kupo match objects: mostly ADA, some tokens, a few datums."""
+    results = []
+    for i in range(count):
+        result = {
+            "transaction_index": 0,
+            "transaction_id": f"{i:064x}",
+            "output_index": i % 4,
+            "address": address,
+            "value": {"coins": 2000000 + i, "assets": {}},
+            "datum_hash": None,
+            "datum_type": None,
+            "script_hash": None,
+            "created_at": {"slot_no": 40000000 + i, "header_hash": f"{i:064x}"},
+            "spent_at": None,
+        }
+        if i % 4 == 1:
+            result["value"]["assets"] = {
+                f"{policy}.{b'USDT'.hex()}": 10 + i,
+                f"{policy}.{b'SWAP'.hex()}": 1,
+            }
+        if i % 20 == 2:
+            result["datum_hash"] = datums[(i // 20) % len(datums)]
+            result["datum_type"] = "inline"
+        results.append(result)
+    return results
+
+
+def wallet_utxos(count: int, address: Address, policy: str) -> list:
+    """``count`` wallet UTxOs of 1 to 50 ADA, a quarter also holding tUSDT."""
+    unit = (ScriptHash.from_primitive(policy), AssetName(b"USDT"))
+    utxos = []
+    for i in range(count):
+        multi_asset = MultiAsset()
+        if i % 4 == 1:
+            multi_asset = MultiAsset({unit[0]: Asset({unit[1]: 10 + i % 90})})
+        utxos.append(
+            UTxO(
+                TransactionInput(TransactionId(i.to_bytes(32, "big")), i % 4),
+                TransactionOutput(
+                    address, Value(1000000 + (i * 7919) % 49000000, multi_asset)
+                ),
+            )
+        )
+    return utxos
+
+
+def selection_tx_bytes(inputs: list, target: Value, address: Address) -> int:
+    """Size of a transaction paying ``target`` from ``inputs``, with change."""
+    total = Value()
+    for utxo in inputs:
+        total += utxo.output.amount
+    change = total - target
+    change.multi_asset = change.multi_asset.filter(lambda p, n, v: v > 0)
+    body = TransactionBody(
+        inputs=[utxo.input for utxo in inputs],
+        outputs=[
+            TransactionOutput(address, target),
+            TransactionOutput(address, change),
+        ],
+        fee=200000,
+    )
+    return len(body.to_cbor())
+
+
+def demo_config(mnemonic: str) -> dict:
+    with open(os.path.join(REPO_ROOT, "config.sample.yaml"), encoding="UTF-8") as f:
+        configyaml = yaml.safe_load(f)
+    configyaml["MNEMONIC_24"] = mnemonic
+    configyaml["simulator"] = {"block_time": 0, "price": 2500000}
+    return configyaml
+
+
+def simulated_runtime(configyaml) -> Runtime:
+    """A runtime over a freshly seeded ledger, with keys and scripts loaded."""
+    args = argparse.Namespace(connection="simulator", environment="preprod")
+    runtime = Runtime(args, configyaml)
+    _ = (
+        runtime.chain_query,
+        runtime.user_address,
+        runtime.extended_payment_skey,
+        runtime.swap_script,
+        runtime.swap_contract,
+    )
+    return runtime
+
+
+async def measure(run, repeat: int, counters) -> dict:
+    """Time ``run`` and count the requests it makes.
+
+    Args:
+        run: Coroutine function executing one iteration.
+        repeat: Number of timed iterations (after one warm-up).
+        counters: Callable returning the current request counters.
+
+    Returns:
+        dict: Median wall/CPU time, allocations and requests per iteration.
+    """
+    devnull = open(os.devnull, "w", encoding="UTF-8")
+    with devnull, contextlib.redirect_stdout(devnull):
+        await run()
+
+        walls, cpus = [], []
+        before = counters()
+        for _ in range(repeat):
+            wall, cpu = time.perf_counter(), time.process_time()
+            await run()
+            walls.append((time.perf_counter() - wall) * 1000)
+            cpus.append((time.process_time() - cpu) * 1000)
+        after = counters()
+
+        tracemalloc.start()
+        await run()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "wall_ms": statistics.median(walls),
+        "cpu_ms": statistics.median(cpus),
+        "alloc_peak_kib": peak / 1024,
+        "alloc_net_kib": current / 1024,
+        "requests": {
+            name: (after[name] - before[name]) / repeat
+            for name in sorted(after)
+            if after[name] - before[name]
+        },
+    }
+
+
+def flow_cases(configyaml):
+    """(name, setup) pairs; setup returns the runtime and one iteration."""
+
+    def swap_b():
+        runtime = simulated_runtime(configyaml)
+
+        async def run():
+            await runtime.swap_contract.swap_B(
+                10,
+                runtime.user_address,
+                runtime.swap_address,
+                runtime.swap_script,
+                runtime.extended_payment_skey,
+            )
+
+        return runtime, run
+
+    def swap_a():
+        runtime = simulated_runtime(configyaml)
+
+        async def run():
+            await runtime.swap_contract.swap_A(
+                10,
+                runtime.user_address,
+                runtime.swap_address,
+                runtime.swap_script,
+                runtime.extended_payment_skey,
+            )
+
+        return runtime, run
+
+    def add_liquidity():
+        runtime = simulated_runtime(configyaml)
+
+        async def run():
+            await runtime.swap_contract.add_liquidity(
+                100,
+                5,
+                runtime.user_address,
+                runtime.swap_address,
+                runtime.swap_script,
+                runtime.extended_payment_skey,
+            )
+
+        return runtime, run
+
+    def mint():
+        runtime = simulated_runtime(configyaml)
+        minter = Mint(
+            runtime.chain_query,
+            runtime.extended_payment_skey,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.mint_script,
+            policy_id=runtime.script_registry["mint_script"].hash,
+        )
+        return runtime, minter.mint_nft_with_script
+
+    def send_odv_request():
+        runtime = simulated_runtime(configyaml)
+        oracle_user = runtime.oracle_user()
+
+        async def run():
+            funds = await oracle_user.calc_recommended_funds_amount()
+            await oracle_user.send_odv_request(funds)
+
+        return runtime, run
+
+    return [
+        ("swap_B", swap_b),
+        ("swap_A", swap_a),
+        ("add_liquidity", add_liquidity),
+        ("mint_nft_with_script", mint),
+        ("send_odv_request", send_odv_request),
+    ]
+
+
+async def bench(repeat: int, only: str = None) -> dict:
+    configyaml = demo_config(HDWallet.generate_mnemonic(strength=256))
+    results = {}
+
+    def selected(name):
+        return only is None or only in name
+
+    for name, setup in flow_cases(configyaml):
+        if not selected(name):
+            continue
+        runtime, run = setup()
+        ledger = runtime.chain_query.context
+        results[name] = await measure(run, repeat, lambda: Counter(ledger.stats))
+        print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+    kupo = KupoStandIn()
+    await kupo.start()
+    try:
+        swap_entry = default_registry()["swap"]
+        address = str(swap_entry.address(Network.TESTNET))
+        policy = "c6f192a236596e2bbaac5900d67e9700dec7c77d9da626c98e0ab2ac"
+        nft_name = b"OracleFeed".hex()
+        datums = []
+        for i in range(4):
+            datum = GenericData(PriceData({0: 2500000 + i, 1: 0, 2: 3600000}))
+            datum_hash = f"{i:064x}"
+            kupo.add_datum(datum_hash, datum.to_cbor())
+            datums.append(datum_hash)
+
+        for count in UTXO_COUNTS:
+            name = f"kupo._unpack_outputs[{count}]"
+            response = kupo_results(count, address, policy, datums)
+            if selected(name):
+
+                async def unpack(response=response):
+                    context = KupoContext(kupo.url, script_registry=default_registry())
+                    await context._unpack_outputs(  # pylint: disable=protected-access
+                        address, response
+                    )
+
+                results[name] = await measure(
+                    unpack,
+                    max(1, repeat // (count // 1000 + 1)),
+                    lambda: Counter(kupo.requests),
+                )
+                print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+            name = f"kupo.utxos_kupo[{count}]"
+            if selected(name):
+                kupo.set_matches(address, response)
+
+                async def query():
+                    context = KupoContext(kupo.url, script_registry=default_registry())
+                    await context.utxos_kupo(address)
+
+                results[name] = await measure(
+                    query,
+                    max(1, repeat // (count // 1000 + 1)),
+                    lambda: Counter(kupo.requests),
+                )
+                print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+            name = f"kupo.utxo_table_kupo[{count}]"
+            if selected(name):
+                kupo.set_matches(address, response)
+
+                async def tabulate():
+                    context = KupoContext(kupo.url, script_registry=default_registry())
+                    await context.utxo_table_kupo(address)
+
+                results[name] = await measure(
+                    tabulate,
+                    max(1, repeat // (count // 1000 + 1)),
+                    lambda: Counter(kupo.requests),
+                )
+                print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+            # One NFT at the end of the response, found by streaming.
+            name = f"kupo.find_utxo_kupo[{count}]"
+            if selected(name):
+                (nft_output,) = kupo_results(1, address, policy, datums)
+                nft_output["transaction_id"] = "f" * 64
+                nft_output["value"]["assets"] = {f"{policy}.{nft_name}": 1}
+                kupo.set_matches(address, response + [nft_output])
+
+                async def find():
+                    context = KupoContext(kupo.url, script_registry=default_registry())
+                    utxo = await context.find_utxo_kupo(address, policy, nft_name)
+                    assert utxo is not None
+
+                results[name] = await measure(
+                    find,
+                    max(1, repeat // (count // 1000 + 1)),
+                    lambda: Counter(kupo.requests),
+                )
+                print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+    finally:
+        await kupo.stop()
+
+    # Inputs for a 300 tADA and 500 tUSDT payment from a large wallet.
+    runtime = simulated_runtime(configyaml) if selected("coin_selection") else None
+    for strategy in ("pycardano", *STRATEGIES):
+        name = f"coin_selection.{strategy}[{WALLET_UTXOS}]"
+        if not selected(name):
+            continue
+        address = runtime.user_address
+        utxos = wallet_utxos(WALLET_UTXOS, address, policy)
+        usdt = MultiAsset(
+            {ScriptHash.from_primitive(policy): Asset({AssetName(b"USDT"): 500})}
+        )
+        target = Value(300000000, usdt)
+        index = UTxOIndex(str(address), utxos)
+        picked = []
+
+        async def select(strategy=strategy, utxos=utxos, index=index, picked=picked):
+            if strategy == "pycardano":
+                # pycardano's random-improve recurses once per candidate and
+                # overflows the stack on a wallet this size.
+                inputs, _ = LargestFirstSelector().select(
+                    utxos,
+                    [TransactionOutput(address, target)],
+                    runtime.chain_query.context,
+                )
+            else:
+                inputs = CoinSelector(strategy, seed=0).select(index, target).inputs
+            picked[:] = inputs
+
+        results[name] = await measure(select, repeat, Counter)
+        results[name]["inputs"] = len(picked)
+        results[name]["tx_bytes"] = selection_tx_bytes(picked, target, address)
+        print(
+            f"{name:34} {results[name]['wall_ms']:9.1f} ms"
+            f"  {len(picked)} inputs, {results[name]['tx_bytes']} bytes",
+            file=sys.stderr,
+        )
+
+    # Independent 20-input transactions built at once, and the longest the
+    # event loop went without running meanwhile.
+    for mode in ("to_thread", *MODES):
+        name = f"build_pool.{mode}[x{BATCH_BUILDS}]"
+        if not selected(name):
+            continue
+        runtime = simulated_runtime(configyaml)
+        chain_query = runtime.chain_query
+        chain_query.build_executor = (
+            None if mode == "to_thread" else BuildExecutor(mode)
+        )
+        utxos = wallet_utxos(BATCH_BUILDS * 20, runtime.user_address, policy)
+        lags = []
+
+        async def build_batch(runtime=runtime, utxos=utxos, lags=lags):
+            chain_query = runtime.chain_query
+            builders = []
+            for i in range(BATCH_BUILDS):
+                builder = TransactionBuilder(chain_query.context)
+                for utxo in utxos[i * 20 : (i + 1) * 20]:
+                    builder.add_input(utxo)
+                builders.append(builder)
+
+            async def ticker(worst=0.0):
+                last = time.perf_counter()
+                try:
+                    while True:
+                        await asyncio.sleep(0.001)
+                        now = time.perf_counter()
+                        worst = max(worst, now - last - 0.001)
+                        last = now
+                finally:
+                    lags.append(worst * 1000)
+
+            ticking = asyncio.create_task(ticker())
+            await asyncio.gather(
+                *(
+                    chain_query.build_and_sign(
+                        builder, runtime.extended_payment_skey, runtime.user_address
+                    )
+                    for builder in builders
+                )
+            )
+            ticking.cancel()
+            await asyncio.gather(ticking, return_exceptions=True)
+
+        try:
+            results[name] = await measure(build_batch, repeat, Counter)
+        finally:
+            if chain_query.build_executor is not None:
+                chain_query.build_executor.shutdown()
+        results[name]["loop_lag_ms"] = statistics.median(lags)
+        print(
+            f"{name:34} {results[name]['wall_ms']:9.1f} ms"
+            f"  loop lag {results[name]['loop_lag_ms']:.1f} ms",
+            file=sys.stderr,
+        )
+
+    # A ladder of trade sizes, one quote at a time and from one market state.
+    if selected("quote_ladder"):
+        runtime = simulated_runtime(configyaml)
+        ledger = runtime.chain_query.context
+        swap_contract = runtime.swap_contract
+        sizes = list(range(10, 10 * (LADDER_SIZES + 1), 10))
+
+        async def one_by_one():
+            for size in sizes:
+                await swap_contract.swap_b_with_a(size)
+
+        async def vectorized():
+            state = await runtime.quote_engine.state(force=True)
+            Ladder.price(state, "tADA", sizes)
+
+        for name, run in (
+            (f"quote_ladder.swap_b_with_a[x{LADDER_SIZES}]", one_by_one),
+            (f"quote_ladder.engine[x{LADDER_SIZES}]", vectorized),
+        ):
+            results[name] = await measure(run, repeat, lambda: Counter(ledger.stats))
+            print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+    if selected("datum_decode"):
+        runtime = simulated_runtime(configyaml)
+        ledger = runtime.chain_query.context
+        oracle_utxos = ledger.utxos(runtime.oracle_address)
+        feed_cbor = next(
+            u.output.datum.cbor
+            for u in oracle_utxos
+            if u.output.amount.multi_asset == runtime.swap_contract.oracle_nft
+        )
+        aggstate_cbor = next(
+            u.output.datum.cbor
+            for u in oracle_utxos
+            if isinstance(u.output.datum, RawCBOR) and u.output.datum.cbor != feed_cbor
+        )
+
+        async def decode_feed():
+            for _ in range(DATUM_DECODES):
+                GenericData.from_cbor(feed_cbor)
+
+        async def decode_aggstate():
+            for _ in range(DATUM_DECODES):
+                AggDatum.from_cbor(aggstate_cbor)
+
+        for name, run in (
+            (f"datum_decode.GenericData[x{DATUM_DECODES}]", decode_feed),
+            (f"datum_decode.AggDatum[x{DATUM_DECODES}]", decode_aggstate),
+        ):
+            results[name] = await measure(run, repeat, Counter)
+            print(f"{name:34} {results[name]['wall_ms']:9.1f} ms", file=sys.stderr)
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """List the cases that got slower, bigger or chattier than ``baseline``.
+
+    Times and allocations regress when they grow by more than ``threshold``
+    percent; request counts regress on any increase.
+    """
+    regressions = []
+    for name, entry in current["cases"].items():
+        previous = baseline.get("cases", {}).get(name)
+        if previous is None:
+            continue
+        for metric in TIMED_METRICS:
+            if previous.get(metric, 0) > 0:
+                change = (entry[metric] - previous[metric]) / previous[metric] * 100
+                if change > threshold:
+                    regressions.append(
+                        f"{name}: {metric} {previous[metric]:.1f} -> "
+                        f"{entry[metric]:.1f} (+{change:.0f}%)"
+                    )
+        for request, count in entry["requests"].items():
+            before = previous.get("requests", {}).get(request, 0)
+            if count > before:
+                regressions.append(
+                    f"{name}: {request} requests {before:g} -> {count:g}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="Run only the cases containing this text.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Previous results file to compare with.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        help="Percentage increase reported as a regression (default: 20).",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "cases": asyncio.run(bench(args.repeat, args.only)),
+    }
+
+    for name, entry in results["cases"].items():
+        requests = ", ".join(f"{k} {v:g}" for k, v in entry["requests"].items())
+        print(
+            f"{name:34} wall {entry['wall_ms']:9.1f} ms  cpu {entry['cpu_ms']:9.1f} ms"
+            f"  peak {entry['alloc_peak_kib']:9.0f} KiB  [{requests or '-'}]"
+            + (
+                f"  {entry['inputs']} inputs, {entry['tx_bytes']} bytes"
+                if "tx_bytes" in entry
+                else ""
+            )
+            + (
+                f"  loop lag {entry['loop_lag_ms']:.1f} ms"
+                if "loop_lag_ms" in entry
+                else ""
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="UTF-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
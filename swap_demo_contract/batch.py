@@ -0,0 +1,509 @@
+"""Bulk trade runner that pipelines orders read from a CSV or JSONL file"""
+
+import asyncio
+import csv
+import json
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import pycardano as pyc
+
+from .lib.contention import (
+    ContentionPolicy,
+    SlippageExceeded,
+    check_slippage,
+    is_contention_error,
+    names_utxo,
+    replacement,
+)
+from .lib.metrics import metrics
+from .runtime import Runtime
+
+ASSETS = ("tADA", "tUSDT")
+
+
+class OrderRejected(Exception):
+    """The order cannot be executed against the current swap state."""
+
+
+@dataclass
+class Order:
+    """One trade: sell ``amount`` of ``asset`` to the swap contract.
+
+    ``error`` is set instead when the line of the order is malformed.
+    """
+
+    order_id: str
+    asset: str
+    amount: int
+    error: Optional[str] = None
+
+
+@dataclass
+class OrderResult:
+    """Outcome and per-stage timings (seconds) of an order."""
+
+    order_id: str
+    asset: str
+    amount: int
+    amount_out: Optional[int] = None
+    status: str = "pending"
+    tx_id: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    latency: Optional[float] = None
+    started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def to_record(self) -> dict:
+        return {
+            "id": self.order_id,
+            "asset": self.asset,
+            "amount": self.amount,
+            "amount_out": self.amount_out,
+            "status": self.status,
+            "tx_id": self.tx_id,
+            "error": self.error,
+            "latency": self.latency,
+            "timings": self.timings,
+        }
+
+
+def _parse_amount(value) -> Optional[int]:
+    """``value`` as an integer, None unless it is one (``"1.5"``, ``1.5``)."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def _make_order(record, line_no: int) -> Order:
+    if not isinstance(record, dict):
+        return Order(str(line_no), "", 0, f"line {line_no}: expected an object")
+    order_id = str(record.get("id") or line_no)
+    asset = record.get("asset")
+    amount = _parse_amount(record.get("amount"))
+    error = None
+    if asset not in ASSETS:
+        error = f"line {line_no}: asset must be one of {', '.join(ASSETS)}"
+    elif amount is None:
+        error = f"line {line_no}: amount must be an integer"
+    elif amount <= 0:
+        error = f"line {line_no}: amount must be positive"
+    return Order(order_id, str(asset or ""), amount or 0, error)
+
+
+def read_orders(path: str) -> Iterator[Order]:
+    """Stream orders from a file without loading it whole.
+
+    ``.jsonl`` files hold one ``{"asset": ..., "amount": ..., "id": ...}``
+    object per line. Anything else is read as CSV with an
+    ``asset,amount[,id]`` header. The id defaults to the line number.
+
+    Malformed lines are yielded as orders with an ``error``, so that the
+    rest of the file still runs.
+    """
+    with open(path, "r", encoding="UTF-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as err:
+                    yield Order(str(line_no), "", 0, f"line {line_no}: {err}")
+                    continue
+                yield _make_order(record, line_no)
+        else:
+            for line_no, record in enumerate(csv.DictReader(f), 2):
+                yield _make_order(record, line_no)
+
+
+class TradeBatchRunner:
+    """Run orders through quote, build/sign, submit and confirm stages.
+
+    Every trade spends the single swap UTxO, so building and submitting stay
+    in order: each trade is built on the swap output of the previous one,
+    before that one is confirmed. Confirmations overlap, with at most
+    ``concurrency`` submitted trades unconfirmed at any time. Chained
+    transactions cannot be evaluated against the chain, so they reuse the
+    execution units of the last evaluated trade of the same kind.
+
+    After a failed submission or confirmation the runner waits for the
+    in-flight trades to settle and reloads the swap UTxO from the chain. An
+    order the wallet cannot fund until the pending trades return their
+    change waits for them, and an order losing the swap UTxO or the oracle
+    feed to another party is retried under the swap contract's
+    ``contention`` policy.
+
+    Attributes:
+        runtime: Chain context, keys, scripts and swap contract client.
+        concurrency: Maximum number of submitted, unconfirmed trades.
+        quote_ttl: Seconds an oracle feed is reused before it is fetched again.
+        report_path: Optional JSONL file receiving one record per order.
+    """
+
+    def __init__(
+        self,
+        runtime: Runtime,
+        concurrency: int = 4,
+        quote_ttl: float = 30.0,
+        report_path: Optional[str] = None,
+    ) -> None:
+        self.runtime = runtime
+        self.swap_contract = runtime.swap_contract
+        self.chain_query = runtime.chain_query
+        self.concurrency = concurrency
+        self.quote_ttl = quote_ttl
+        self.report_path = report_path
+        self.results: List[OrderResult] = []
+
+        self._window = asyncio.Semaphore(concurrency)
+        self._settled = asyncio.Condition()
+        self._pending_tx_ids: Set[pyc.TransactionId] = set()
+        self._resync = True
+        self._swap_utxo: Optional[pyc.UTxO] = None
+        self._oracle_utxo: Optional[pyc.UTxO] = None
+        self._price: Optional[int] = None
+        self._price_fetched_at = 0.0
+        self._ex_units: Dict[str, pyc.ExecutionUnits] = {}
+        self._report = None
+
+    async def run(self, orders: Iterable[Order]) -> dict:
+        """Execute ``orders`` and return the batch summary."""
+        started = time.perf_counter()
+        quoted: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+        confirmations: Set[asyncio.Task] = set()
+        if self.report_path:
+            self._report = open(self.report_path, "w", encoding="UTF-8")
+
+        quoting = asyncio.create_task(self._quote_stage(orders, quoted))
+        try:
+            await self._submit_stage(quoted, confirmations)
+            await quoting
+        finally:
+            quoting.cancel()
+            # Submitted trades are confirmed and reported whatever happened.
+            if confirmations:
+                await asyncio.gather(*confirmations, return_exceptions=True)
+            if self._report:
+                self._report.close()
+
+        summary = self.summarize(time.perf_counter() - started)
+        print(
+            f"{summary['orders']} orders: {summary['succeeded']} succeeded, "
+            f"{summary['failed']} failed, {summary['rejected']} rejected "
+            f"in {summary['wall_seconds']:.1f}s "
+            f"({summary['throughput_per_minute']:.2f} trades/min)"
+        )
+        if summary["latency_p50"] is not None:
+            print(
+                f"latency p50 {summary['latency_p50']:.1f}s, "
+                f"p95 {summary['latency_p95']:.1f}s, max {summary['latency_max']:.1f}s"
+            )
+        return summary
+
+    def summarize(self, wall_seconds: float) -> dict:
+        latencies = sorted(
+            r.latency for r in self.results if r.status == "success" and r.latency
+        )
+        succeeded = len(latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "orders": len(self.results),
+            "succeeded": succeeded,
+            "rejected": sum(r.status == "rejected" for r in self.results),
+            "failed": sum(
+                r.status not in ("success", "rejected") for r in self.results
+            ),
+            "wall_seconds": wall_seconds,
+            "throughput_per_minute": (
+                succeeded / wall_seconds * 60 if wall_seconds else 0.0
+            ),
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None,
+            "latency_mean": statistics.fmean(latencies) if latencies else None,
+        }
+
+    async def _refresh_oracle(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if (
+            force
+            or self._price is None
+            or now - self._price_fetched_at > self.quote_ttl
+        ):
+            self._oracle_utxo = await self.swap_contract.get_oracle_utxo()
+            self._price = self.swap_contract.oracle_price(self._oracle_utxo)
+            self._price_fetched_at = now
+
+    def _quote(self, order: Order) -> int:
+        if order.asset == "tADA":
+            return self.swap_contract.b_to_a(order.amount, self._price)
+        return self.swap_contract.a_to_b(order.amount, self._price)
+
+    async def _quote_stage(self, orders: Iterable[Order], quoted: asyncio.Queue):
+        try:
+            for order in orders:
+                result = OrderResult(order.order_id, order.asset, order.amount)
+                if order.error:
+                    result.status = "rejected"
+                    result.error = order.error
+                    self._finish(result)
+                    continue
+                start = time.perf_counter()
+                try:
+                    await self._refresh_oracle()
+                except Exception as err:  # pylint: disable=broad-except
+                    result.status = "failed"
+                    result.error = f"oracle feed: {err}"
+                    self._finish(result)
+                    continue
+                result.amount_out = self._quote(order)
+                result.timings["quote"] = time.perf_counter() - start
+                await quoted.put((order, result))
+        finally:
+            await quoted.put(None)
+
+    async def _submit_stage(
+        self, quoted: asyncio.Queue, confirmations: Set[asyncio.Task]
+    ) -> None:
+        while True:
+            item = await quoted.get()
+            if item is None:
+                return
+            order, result = item
+
+            await self._window.acquire()
+            try:
+                tx = await self._build_and_submit(order, result)
+            except OrderRejected as err:
+                self._window.release()
+                result.status = "rejected"
+                result.error = str(err)
+                self._finish(result)
+                continue
+            except Exception as err:  # pylint: disable=broad-except
+                self._window.release()
+                result.status = "failed"
+                result.error = str(err)
+                self._resync = True
+                self._finish(result)
+                continue
+
+            task = asyncio.create_task(self._confirm(result, tx))
+            confirmations.add(task)
+            task.add_done_callback(confirmations.discard)
+
+    async def _wait_settled(self) -> None:
+        async with self._settled:
+            await self._settled.wait_for(lambda: not self._pending_tx_ids)
+
+    async def _resync_state(self) -> None:
+        await self._wait_settled()
+        self._swap_utxo = await self.swap_contract.get_swap_utxo()
+        await self._refresh_oracle(force=True)
+        self._resync = False
+
+    async def _build_and_submit(
+        self, order: Order, result: OrderResult
+    ) -> pyc.Transaction:
+        """Build and submit ``order`` on the latest swap output.
+
+        An order the wallet cannot fund yet waits for the pending trades to
+        return their change, once. An order losing the swap UTxO or the
+        oracle feed to another party is rebuilt like ``execute_trade``
+        does, re-quoted within ``contention.slippage`` of its quote.
+        """
+        policy = self.swap_contract.contention
+        await self._check_wallet(order)
+        quoted = None
+        funded = False
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            if self._resync:
+                await self._resync_state()
+            swap_utxo = self._swap_utxo
+            oracle_utxo = self._oracle_utxo
+            try:
+                tx = await self._build(order, result, quoted)
+                result.timings["build"] = time.perf_counter() - start
+                start = time.perf_counter()
+                await self.chain_query.submit_tx(tx)
+                break
+            except (pyc.InsufficientUTxOBalanceException, pyc.UTxOSelectionException):
+                if funded or not self._pending_tx_ids:
+                    raise
+                # The wallet's UTxOs are spent by pending trades of the batch.
+                funded = True
+                self._resync = True
+            except Exception as err:  # pylint: disable=broad-except
+                if not is_contention_error(err) or attempt == policy.max_retries:
+                    raise
+                attempt += 1
+                metrics.inc("trade_retries", side="B" if order.asset == "tADA" else "A")
+                quoted = result.amount_out
+                await self._recover(err, swap_utxo, oracle_utxo, policy)
+        result.timings["submit"] = time.perf_counter() - start
+        result.tx_id = str(tx.id)
+
+        self._pending_tx_ids.add(tx.id)
+        self._swap_utxo = self.swap_contract.find_swap_output(tx)
+        return tx
+
+    async def _wallet_amount(self, asset: str) -> int:
+        balances = await self.swap_contract.user_balances(self.runtime.user_address)
+        if asset == "tADA":
+            return balances.lovelace // 1000000
+        return balances.quantity(*self.swap_contract.coin_a_ids())
+
+    async def _check_wallet(self, order: Order) -> None:
+        """Reject ``order`` if the wallet holds less than it sells.
+
+        UTxOs spent by pending trades are not counted, so a short wallet
+        waits for them to settle before the order is rejected.
+        """
+        available = await self._wallet_amount(order.asset)
+        if available < order.amount and self._pending_tx_ids:
+            await self._wait_settled()
+            available = await self._wallet_amount(order.asset)
+        if available < order.amount:
+            raise OrderRejected(f"the wallet holds {available} {order.asset}")
+
+    async def _recover(
+        self,
+        err: Exception,
+        swap_utxo: pyc.UTxO,
+        oracle_utxo: pyc.UTxO,
+        policy: ContentionPolicy,
+    ) -> None:
+        """Reload the UTxOs named by a contention error, as ``execute_trade``."""
+        # The pending trades were chained on the lost UTxO too.
+        await self._wait_settled()
+        oracle_spent = names_utxo(err, oracle_utxo)
+        fresh = None
+        if names_utxo(err, swap_utxo):
+            fresh = await replacement(
+                self.swap_contract.get_swap_utxo, swap_utxo, policy
+            )
+        if fresh is None and not oracle_spent:
+            # A wallet input went stale.
+            self.chain_query.drop_indexes()
+        self._swap_utxo = fresh or await self.swap_contract.get_swap_utxo()
+        await self._refresh_oracle(force=oracle_spent)
+        self._resync = False
+
+    async def _build(
+        self,
+        order: Order,
+        result: OrderResult,
+        quoted: Optional[int],
+    ) -> pyc.Transaction:
+        """Quote ``order`` again and build it on ``_swap_utxo``.
+
+        Args:
+            quoted: Amount out of the attempt a retry must stay within
+                slippage of, None for the first attempt.
+        """
+        runtime = self.runtime
+        kind = "SwapB" if order.asset == "tADA" else "SwapA"
+        chained = self._swap_utxo.input.transaction_id in self._pending_tx_ids
+        if chained and kind not in self._ex_units:
+            # Nothing to reuse: let the chain catch up so the script is evaluated.
+            await self._resync_state()
+            chained = False
+        await self._refresh_oracle()
+
+        # The oracle feed may have moved since the order was quoted.
+        result.amount_out = self._quote(order)
+        if quoted is not None:
+            try:
+                check_slippage(
+                    quoted, result.amount_out, self.swap_contract.contention.slippage
+                )
+            except SlippageExceeded as err:
+                raise OrderRejected(str(err)) from err
+        swap_utxo = self._swap_utxo
+        if result.amount_out < 1:
+            raise OrderRejected(f"{order.amount} {order.asset} buys nothing")
+        if kind == "SwapB":
+            available = self.swap_contract.swap_token_amount(swap_utxo)
+            builder_fn = self.swap_contract.build_swap_b_tx
+        else:
+            available = swap_utxo.output.amount.coin // 1000000
+            builder_fn = self.swap_contract.build_swap_a_tx
+        if result.amount_out > available:
+            raise OrderRejected(f"swap liquidity is {available}")
+
+        builder = builder_fn(
+            order.amount,
+            result.amount_out,
+            swap_utxo,
+            self._oracle_utxo,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.swap_script,
+            ex_units=self._ex_units[kind] if chained else None,
+        )
+        tx = await self.chain_query.build_tx(
+            builder, runtime.extended_payment_skey, runtime.user_address
+        )
+        if not chained:
+            ex_units = self._spend_ex_units(tx)
+            if ex_units is not None:
+                self._ex_units[kind] = ex_units
+        return tx
+
+    @staticmethod
+    def _spend_ex_units(tx: pyc.Transaction) -> Optional[pyc.ExecutionUnits]:
+        redeemers = tx.transaction_witness_set.redeemer
+        if not redeemers:
+            return None
+        if isinstance(redeemers, pyc.RedeemerMap):
+            return next(iter(redeemers.values())).ex_units
+        return redeemers[0].ex_units
+
+    async def _confirm(self, result: OrderResult, tx: pyc.Transaction) -> None:
+        start = time.perf_counter()
+        try:
+            status, _ = await self.chain_query.wait_for_tx(str(tx.id))
+        except Exception as err:  # pylint: disable=broad-except
+            status = f"error: {err}"
+        result.timings["confirm"] = time.perf_counter() - start
+        result.status = status
+        if status != "success":
+            self._resync = True
+
+        self.chain_query.release_inputs(tx)
+        async with self._settled:
+            self._pending_tx_ids.discard(tx.id)
+            self._settled.notify_all()
+        self._window.release()
+        self._finish(result)
+
+    def _finish(self, result: OrderResult) -> None:
+        result.latency = time.perf_counter() - result.started
+        self.results.append(result)
+        stages = ", ".join(f"{k} {v:.1f}s" for k, v in result.timings.items())
+        out_asset = "tUSDT" if result.asset == "tADA" else "tADA"
+        detail = f"tx {result.tx_id}" if result.tx_id else result.error
+        print(
+            f"[{result.order_id}] {result.amount} {result.asset} -> "
+            f"{result.amount_out} {out_asset}: {result.status} "
+            f"in {result.latency:.1f}s ({stages}) {detail or ''}".rstrip()
+        )
+        if self._report:
+            self._report.write(json.dumps(result.to_record()) + "\n")
+            self._report.flush()
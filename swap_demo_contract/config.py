@@ -0,0 +1,27 @@
+"""Configuration file loading.
+
+Kept free of pycardano imports so that commands answered from the
+configuration alone start quickly.
+"""
+
+import sys
+
+import yaml
+
+
+def load_config():
+    """Loads the YAML configuration file."""
+    try:
+        with open("config.yaml", "r", encoding="UTF-8") as config_yaml:
+            return yaml.load(config_yaml, Loader=yaml.FullLoader)
+    except FileNotFoundError:
+        print("Configuration file not found.")
+        sys.exit(1)
+
+
+def validate_config(config, connection, required_keys):
+    """Validates that all required keys exist for a connection configuration."""
+    if connection not in config or not all(
+        key in config[connection] for key in required_keys
+    ):
+        raise ValueError(f"Context for {connection} not found or is incomplete.")
@@ -1,11 +1,19 @@
 """Main Api abstract class and a response class to keep the information"""
 
+import codecs
+import json
 import logging
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional
 
 import aiohttp
 
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from .cassette import Cassette
+
 logger = logging.getLogger("api")
 
 
@@ -23,18 +31,73 @@ class ApiResponse:
         self._resp = resp
         self.status = self._resp.status
         self.json: Optional[Dict[str, Any]] = None
+        self.size = 0
         self.is_ok = 200 <= self.status < 300
         self.headers = self._resp.headers
 
     async def get_info(self) -> None:
         """Load async information from the response object"""
+        self.size = len(await self._resp.read())
         self.json = await self._resp.json()
 
 
+class JsonArrayDecoder:
+    """Incremental decoder of a JSON array, fed with chunks of its bytes.
+
+    ``feed`` returns the elements completed by each chunk, so a large array
+    can be processed while it is still being received. Elements must be
+    objects or arrays, which cannot be mistaken for complete values while
+    only partly received.
+    """
+
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self) -> None:
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self.done = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Add ``chunk`` and return the array elements it completed."""
+        self._buffer += self._text.decode(chunk)
+        items = []
+        pos = 0
+        while not self.done:
+            while pos < len(self._buffer) and self._buffer[pos] in self._WHITESPACE:
+                pos += 1
+            if pos == len(self._buffer):
+                break
+            char = self._buffer[pos]
+            if not self._started:
+                if char != "[":
+                    raise ValueError(f"Expected a JSON array, got {char!r}")
+                self._started = True
+                pos += 1
+            elif char == ",":
+                pos += 1
+            elif char == "]":
+                self.done = True
+                pos += 1
+            else:
+                try:
+                    item, pos = self._decoder.raw_decode(self._buffer, pos)
+                except json.JSONDecodeError:
+                    break  # the element is not complete yet
+                items.append(item)
+        self._buffer = self._buffer[pos:]
+        return items
+
+
 class Api:
     """Abstract class to make an agnostic implementation of HTTP requests."""
 
     api_url: Optional[str] = None
+    # Name of the service in recorded cassettes, and the cassette recording
+    # this client's traffic, if any.
+    service = "api"
+    cassette: Optional["Cassette"] = None
     _header = {"Content-type": "application/json", "Accepts": "application/json"}
 
     async def _request(
@@ -67,7 +130,8 @@ class Api:
         async with aiohttp.ClientSession(
             # connector=aiohttp.TCPConnector(ssl=False) # TESTING
         ) as session:
-            logger.debug("Request to %s%s with data: %s", self.api_url, path, str(data))
+            logger.debug("Request to %s%s with data: %s", self.api_url, path, data)
+            start = time.perf_counter()
             async with session.request(
                 method,
                 f"{self.api_url}{path}",
@@ -75,12 +139,86 @@ class Api:
                 headers=headers,
                 timeout=timeout,
             ) as resp:
+                metrics.inc("http_requests", service=self.service, status=resp.status)
                 if not resp.ok:
+                    elapsed = time.perf_counter() - start
+                    metrics.observe("http.request", elapsed, service=self.service)
+                    if self.cassette is not None:
+                        self.cassette.record(
+                            self.service, method, path, resp.status, None, elapsed, data
+                        )
                     raise UnsuccessfulResponse(resp.status)
                 pars = ApiResponse(resp)
                 await pars.get_info()
+                elapsed = time.perf_counter() - start
+                metrics.observe("http.request", elapsed, service=self.service)
+                metrics.inc("http_response_bytes", pars.size, service=self.service)
+                if self.cassette is not None:
+                    self.cassette.record(
+                        self.service,
+                        method,
+                        path,
+                        pars.status,
+                        pars.json,
+                        elapsed,
+                        data,
+                    )
                 return pars
 
+    async def _stream(
+        self,
+        path: str,
+        chunk_size: int = 64 * 1024,
+        read_timeout_seconds: int = 10,
+    ) -> AsyncIterator[Any]:
+        """Send a GET request and yield the elements of the JSON array it
+        returns while the response is received.
+
+        Breaking out of the iteration closes the connection. Cassettes
+        record the complete response once it has been read to the end.
+
+        Args:
+            path (str): URL path of the endpoint.
+            chunk_size (int): Bytes read from the response at a time.
+            read_timeout_seconds (int): Longest wait for the next chunk.
+
+        Yields:
+            The elements of the response array.
+        """
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=read_timeout_seconds)
+        async with aiohttp.ClientSession() as session:
+            logger.debug("Streaming request to %s%s", self.api_url, path)
+            start = time.perf_counter()
+            async with session.get(
+                f"{self.api_url}{path}", headers=self._header, timeout=timeout
+            ) as resp:
+                metrics.inc("http_requests", service=self.service, status=resp.status)
+                if not resp.ok:
+                    elapsed = time.perf_counter() - start
+                    metrics.observe("http.request", elapsed, service=self.service)
+                    if self.cassette is not None:
+                        self.cassette.record(
+                            self.service, "GET", path, resp.status, None, elapsed
+                        )
+                    raise UnsuccessfulResponse(resp.status)
+                decoder = JsonArrayDecoder()
+                recorded: Optional[List[Any]] = [] if self.cassette else None
+                size = 0
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    size += len(chunk)
+                    items = decoder.feed(chunk)
+                    if recorded is not None:
+                        recorded.extend(items)
+                    for item in items:
+                        yield item
+                elapsed = time.perf_counter() - start
+                metrics.observe("http.request", elapsed, service=self.service)
+                metrics.inc("http_response_bytes", size, service=self.service)
+                if recorded is not None:
+                    self.cassette.record(
+                        self.service, "GET", path, resp.status, recorded, elapsed
+                    )
+
     async def _get(
         self,
         path: str,
@@ -0,0 +1,313 @@
+"""Pool of chain backends with hedged reads and broadcast submissions.
+
+Each backend (Blockfrost, Ogmios with Kupo, the simulator) is wrapped in a
+``Backend`` exposing the three operations the flows need: the UTxOs of an
+address, transaction submission and confirmation status. ``BackendPool``
+routes reads to the best backend by health and latency score, sends the
+read to the next one when the first has not answered after ``hedge_after``
+seconds, and takes whichever answer arrives first. Submissions go to every
+available backend at once.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from blockfrost import ApiError
+from pycardano import (
+    BlockFrostChainContext,
+    OgmiosV6ChainContext,
+    TransactionFailedException,
+    TransactionId,
+    UTxO,
+)
+
+from .metrics import metrics
+from .pagination import address_utxos
+from .simulator import LedgerSimulator
+
+
+class NoBackendAvailable(Exception):
+    """Every backend of the pool failed the operation."""
+
+
+@dataclass
+class Backend:
+    """One chain backend and its health record.
+
+    Attributes:
+        name: Name used in logs, metrics and the pool's health report.
+        utxos: Coroutine function returning the UTxOs of an address.
+        submit: Coroutine function submitting a transaction's CBOR.
+        tx_status: Coroutine function telling whether a transaction is
+            on chain.
+        latency: Moving average of the response time, in seconds.
+        failures: Number of consecutive failed calls.
+        down_until: ``time.monotonic()`` before which the backend is only
+            used when no other one is available.
+    """
+
+    name: str
+    utxos: Callable[[str], Awaitable[List[UTxO]]]
+    submit: Callable[[bytes], Awaitable[Any]]
+    tx_status: Callable[[TransactionId], Awaitable[bool]]
+    latency: float = 0.0
+    failures: int = 0
+    down_until: float = 0.0
+    calls: Dict[str, int] = field(default_factory=dict)
+
+    def available(self, now: float) -> bool:
+        return now >= self.down_until
+
+    @property
+    def score(self) -> float:
+        """Lower is better: latency plus a second per recent failure."""
+        return self.latency + self.failures
+
+
+def blockfrost_backend(context: BlockFrostChainContext) -> Backend:
+    async def tx_status(tx_id: TransactionId) -> bool:
+        try:
+            return bool(await asyncio.to_thread(context.api.transaction, str(tx_id)))
+        except ApiError as err:
+            if err.status_code == 404:
+                return False
+            raise
+
+    return Backend(
+        "blockfrost",
+        utxos=lambda address: address_utxos(
+            context, address, resolve_script=context._get_script
+        ),
+        submit=lambda cbor: asyncio.to_thread(context.submit_tx, cbor),
+        tx_status=tx_status,
+    )
+
+
+def ogmios_backend(context: OgmiosV6ChainContext, kupo_context) -> Backend:
+    async def tx_status(tx_id: TransactionId) -> bool:
+        response = await asyncio.to_thread(context._query_utxos_by_tx_id, tx_id, 0)
+        return response != []
+
+    return Backend(
+        "ogmios",
+        utxos=kupo_context.utxos_kupo,
+        submit=lambda cbor: asyncio.to_thread(context.submit_tx, cbor),
+        tx_status=tx_status,
+    )
+
+
+def simulator_backend(ledger: LedgerSimulator) -> Backend:
+    async def utxos(address: str) -> List[UTxO]:
+        return ledger.utxos(address)
+
+    async def submit(cbor: bytes):
+        return ledger.submit_tx(cbor)
+
+    async def tx_status(tx_id: TransactionId) -> bool:
+        return ledger.is_confirmed(tx_id)
+
+    return Backend("simulator", utxos=utxos, submit=submit, tx_status=tx_status)
+
+
+class BackendPool:
+    """Routes reads and submissions across several backends.
+
+    A backend that fails ``max_failures`` calls in a row is taken out of
+    rotation for ``cooldown`` seconds, doubling on every further failure.
+    A rejected submission only counts against a backend when another one
+    accepted the same transaction; otherwise the transaction was at fault.
+
+    Attributes:
+        backends: The pooled backends, in configuration order.
+        hedge_after: Seconds to wait for a read before also sending it to
+            the next backend.
+        alpha: Weight of the newest sample in the latency moving average.
+        max_failures: Consecutive failures before a backend is benched.
+        cooldown: Seconds a backend is benched after ``max_failures``.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        hedge_after: float = 0.5,
+        alpha: float = 0.2,
+        max_failures: int = 3,
+        cooldown: float = 30.0,
+    ) -> None:
+        if not backends:
+            raise ValueError("A backend pool needs at least one backend.")
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._background: Set[asyncio.Task] = set()
+
+    @property
+    def primary(self) -> Backend:
+        return self.ranked()[0]
+
+    def ranked(self) -> List[Backend]:
+        """Available backends by score, then benched ones by bench expiry."""
+        now = time.monotonic()
+        available = [b for b in self.backends if b.available(now)]
+        benched = [b for b in self.backends if not b.available(now)]
+        return sorted(available, key=lambda b: b.score) + sorted(
+            benched, key=lambda b: b.down_until
+        )
+
+    def health(self) -> List[dict]:
+        """Per-backend health report, best backend first."""
+        now = time.monotonic()
+        return [
+            {
+                "name": b.name,
+                "available": b.available(now),
+                "latency_ms": round(b.latency * 1000, 1),
+                "failures": b.failures,
+                "calls": dict(b.calls),
+            }
+            for b in self.ranked()
+        ]
+
+    def _succeeded(self, backend: Backend, op: str, elapsed: float) -> None:
+        backend.calls[op] = backend.calls.get(op, 0) + 1
+        if backend.latency == 0.0:
+            backend.latency = elapsed
+        else:
+            backend.latency += self.alpha * (elapsed - backend.latency)
+        backend.failures = 0
+        backend.down_until = 0.0
+
+    def _failed(self, backend: Backend, op: str) -> None:
+        backend.calls[op] = backend.calls.get(op, 0) + 1
+        backend.failures += 1
+        metrics.inc("backend_failures", backend=backend.name, op=op)
+        if backend.failures >= self.max_failures:
+            extra = min(backend.failures - self.max_failures, 5)
+            backend.down_until = time.monotonic() + self.cooldown * 2**extra
+
+    def _outpaced(self, backend: Backend, elapsed: float) -> None:
+        # A backend that lost a race took at least ``elapsed``.
+        if elapsed > backend.latency:
+            backend.latency += self.alpha * (elapsed - backend.latency)
+
+    async def _timed(self, backend: Backend, op: str, *args):
+        start = time.perf_counter()
+        with metrics.span("backend.call", backend=backend.name, op=op):
+            result = await getattr(backend, op)(*args)
+        return result, time.perf_counter() - start
+
+    async def read(self, op: str, *args):
+        """Run a read on the best backend, hedging to the next ones.
+
+        Args:
+            op: ``"utxos"`` or ``"tx_status"``.
+            *args: Arguments of the operation.
+
+        Returns:
+            The first successful answer.
+
+        Raises:
+            NoBackendAvailable: Every backend failed.
+        """
+        candidates = self.ranked()
+        running: Dict[asyncio.Task, Backend] = {}
+        errors: List[Exception] = []
+        start = time.perf_counter()
+        launch = True
+        try:
+            while True:
+                if candidates and (launch or not running):
+                    backend = candidates.pop(0)
+                    task = asyncio.create_task(self._timed(backend, op, *args))
+                    running[task] = backend
+                    if len(running) > 1:
+                        metrics.inc("backend_hedges", op=op)
+                if not running:
+                    break
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=self.hedge_after if candidates else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                # Nothing back in time, or a failure: bring in the next backend.
+                launch = not done
+                for task in done:
+                    backend = running.pop(task)
+                    try:
+                        result, elapsed = task.result()
+                    except Exception as err:  # pylint: disable=broad-except
+                        self._failed(backend, op)
+                        errors.append(err)
+                        launch = True
+                        continue
+                    self._succeeded(backend, op, elapsed)
+                    metrics.inc("backend_wins", backend=backend.name, op=op)
+                    for other in running.values():
+                        self._outpaced(other, time.perf_counter() - start)
+                    return result
+        finally:
+            for task in running:
+                task.cancel()
+        raise NoBackendAvailable(
+            f"{op} failed on every backend: " + "; ".join(str(e) for e in errors)
+        )
+
+    async def broadcast(self, op: str, *args):
+        """Run ``op`` (a submission) on every available backend at once.
+
+        Returns as soon as one backend accepts; the slower ones finish in the
+        background and still update their health records.
+
+        Returns:
+            The first successful answer.
+
+        Raises:
+            The first error when every backend failed.
+        """
+        now = time.monotonic()
+        backends = [b for b in self.backends if b.available(now)] or self.ranked()
+        tasks = {asyncio.create_task(self._timed(b, op, *args)): b for b in backends}
+        rejections: List[Tuple[Backend, Exception]] = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            accepted = None
+            for task in done:
+                backend = tasks[task]
+                try:
+                    result, elapsed = task.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    rejections.append((backend, err))
+                    continue
+                self._succeeded(backend, op, elapsed)
+                if accepted is None:
+                    accepted = (result,)
+            if accepted is not None:
+                for backend, _ in rejections:
+                    self._failed(backend, op)
+                for task in pending:
+                    self._background.add(task)
+                    task.add_done_callback(partial(self._settle, tasks[task], op))
+                return accepted[0]
+
+        for backend, err in rejections:
+            if not isinstance(err, TransactionFailedException):
+                self._failed(backend, op)
+        raise rejections[0][1]
+
+    def _settle(self, backend: Backend, op: str, task: asyncio.Task) -> None:
+        """Record a background submission after another backend accepted it."""
+        self._background.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self._failed(backend, op)
+        else:
+            self._succeeded(backend, op, task.result()[1])
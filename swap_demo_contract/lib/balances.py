@@ -0,0 +1,141 @@
+"""Wallet balances indexed in one pass and kept up to date from UTxO deltas."""
+
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from pycardano import AssetName, ScriptHash, TransactionInput, UTxO
+
+Unit = Tuple[ScriptHash, AssetName]
+
+# Smallest pure-ADA output counted as usable collateral (5 ADA).
+MIN_COLLATERAL = 5000000
+
+
+@dataclass(frozen=True)
+class _Entry:
+    """What one UTxO contributes to the balances."""
+
+    coin: int
+    assets: Tuple[Tuple[Unit, int], ...]
+    collateral: bool
+
+
+class BalanceIndex:
+    """Balances of one address, per asset and per kind of lovelace.
+
+    Attributes:
+        address: The indexed address.
+        lovelace: Total lovelace.
+        pure_lovelace: Lovelace in outputs holding nothing else.
+        locked_lovelace: Lovelace in outputs that also hold tokens.
+        collateral_lovelace: Lovelace in pure-ADA outputs without datum or
+            reference script holding at least ``min_collateral``.
+        assets: Total quantity per ``(policy_id, asset_name)``.
+        built_at: ``time.monotonic()`` when the index was built.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        utxos: Iterable[UTxO] = (),
+        min_collateral: int = MIN_COLLATERAL,
+    ) -> None:
+        self.address = address
+        self.min_collateral = min_collateral
+        self.lovelace = 0
+        self.pure_lovelace = 0
+        self.locked_lovelace = 0
+        self.collateral_lovelace = 0
+        self.assets: Dict[Unit, int] = defaultdict(int)
+        self.built_at = time.monotonic()
+        self._entries: Dict[TransactionInput, _Entry] = {}
+        for utxo in utxos:
+            self._add(utxo)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tx_in: TransactionInput) -> bool:
+        return tx_in in self._entries
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+    def quantity(self, policy_id: ScriptHash, asset_name: AssetName) -> int:
+        """Total quantity held of one asset."""
+        return self.assets.get((policy_id, asset_name), 0)
+
+    def apply(
+        self,
+        spent: Iterable[TransactionInput] = (),
+        created: Iterable[UTxO] = (),
+    ) -> None:
+        """Update the balances with spent and newly created UTxOs.
+
+        Spent inputs that are not indexed, and created UTxOs of other
+        addresses, are ignored.
+        """
+        for tx_in in spent:
+            self._remove(tx_in)
+        for utxo in created:
+            if str(utxo.output.address) == self.address:
+                self._add(utxo)
+
+    def to_dict(self) -> Dict[str, object]:
+        """The balances with assets keyed by ``policy_id.asset_name`` (hex)."""
+        return {
+            "utxos": len(self),
+            "lovelace": self.lovelace,
+            "pure_lovelace": self.pure_lovelace,
+            "locked_lovelace": self.locked_lovelace,
+            "collateral_lovelace": self.collateral_lovelace,
+            "assets": {
+                f"{policy_id.payload.hex()}.{asset_name.payload.hex()}": quantity
+                for (policy_id, asset_name), quantity in self.assets.items()
+            },
+        }
+
+    def _add(self, utxo: UTxO) -> None:
+        if utxo.input in self._entries:
+            return
+        output = utxo.output
+        coin = output.amount.coin
+        assets = tuple(
+            ((policy_id, asset_name), quantity)
+            for policy_id, asset in output.amount.multi_asset.items()
+            for asset_name, quantity in asset.items()
+            if quantity
+        )
+        entry = _Entry(
+            coin,
+            assets,
+            collateral=not assets
+            and output.datum is None
+            and output.datum_hash is None
+            and output.script is None
+            and coin >= self.min_collateral,
+        )
+        self._entries[utxo.input] = entry
+        self._count(entry, 1)
+
+    def _remove(self, tx_in: TransactionInput) -> Optional[_Entry]:
+        entry = self._entries.pop(tx_in, None)
+        if entry is not None:
+            self._count(entry, -1)
+        return entry
+
+    def _count(self, entry: _Entry, sign: int) -> None:
+        self.lovelace += sign * entry.coin
+        if entry.assets:
+            self.locked_lovelace += sign * entry.coin
+        else:
+            self.pure_lovelace += sign * entry.coin
+        if entry.collateral:
+            self.collateral_lovelace += sign * entry.coin
+        for unit, quantity in entry.assets:
+            self.assets[unit] += sign * quantity
+            if not self.assets[unit]:
+                del self.assets[unit]
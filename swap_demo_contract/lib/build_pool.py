@@ -0,0 +1,372 @@
+"""Build and sign transactions in a thread or process pool.
+
+Balancing a builder (fee iteration and CBOR serialization), signing and
+hashing are CPU work that holds the GIL, so many independent transactions
+built with ``asyncio.to_thread`` still run one at a time and stall the event
+loop. ``BuildExecutor`` runs that stage in a pool of its own:
+
+* ``thread``: a bounded thread pool building with the live chain context.
+* ``process``: a pool of worker processes. Each job is a picklable
+  ``BuildSpec``, a copy of the builder bound to a ``SnapshotContext`` holding
+  the protocol parameters, the tip slot, the UTxOs of the input addresses
+  (only when the inputs may not cover the outputs) and an evaluator for the
+  execution units of scripts. The worker sends the signed transaction
+  back pickled.
+
+The event loop only prepares the snapshots and awaits the results, so
+throughput scales with the number of cores when many transactions are built
+at once, as consolidation does.
+"""
+
+import asyncio
+import copy
+import copyreg
+import io
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from pycardano import (
+    Address,
+    BlockFrostChainContext,
+    ChainContext,
+    ExecutionUnits,
+    ExtendedSigningKey,
+    GenesisParameters,
+    Network,
+    OgmiosV6ChainContext,
+    PaymentSigningKey,
+    ProtocolParameters,
+    Transaction,
+    TransactionBuilder,
+    UTxO,
+    VerificationKeyWitness,
+)
+from pycardano.serialization import DictCBORSerializable
+
+from .metrics import metrics
+from .simulator import DEFAULT_EXECUTION_UNITS, LedgerSimulator
+
+MODES = ("thread", "process")
+
+Evaluator = Callable[[str], Dict[str, ExecutionUnits]]
+
+
+def build_and_sign(
+    builder: TransactionBuilder,
+    signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+    address: Address,
+) -> Tuple[Transaction, float, float]:
+    """``builder.build_and_sign`` for one key.
+
+    Returns:
+        Tuple[Transaction, float, float]: The signed transaction and the
+        seconds spent building and signing it.
+    """
+    start = time.perf_counter()
+    tx_body = builder.build(
+        change_address=address,
+        auto_validity_start_offset=0,
+        auto_ttl_offset=120,
+    )
+    built = time.perf_counter()
+    witness_set = builder.build_witness_set(True)
+    witness_set.vkey_witnesses = [
+        VerificationKeyWitness(
+            signing_key.to_verification_key(), signing_key.sign(tx_body.hash())
+        )
+    ]
+    tx = Transaction(tx_body, witness_set, auxiliary_data=builder.auxiliary_data)
+    return tx, built - start, time.perf_counter() - built
+
+
+class StaticEvaluator:
+    """Fixed execution units per redeemer tag, as the ledger simulator reports."""
+
+    def __init__(self, execution_units: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.execution_units = dict(execution_units or DEFAULT_EXECUTION_UNITS)
+
+    def __call__(self, cbor: str) -> Dict[str, ExecutionUnits]:
+        tx = Transaction.from_cbor(cbor)
+        result = {}
+        for tag, index in LedgerSimulator._redeemer_keys(tx):
+            name = tag.name.lower()
+            mem, steps = self.execution_units.get(
+                name, DEFAULT_EXECUTION_UNITS["spend"]
+            )
+            result[f"{name}:{index}"] = ExecutionUnits(mem, steps)
+        return result
+
+
+class BlockfrostEvaluator:
+    """Evaluates with Blockfrost, connecting on first use in the worker."""
+
+    def __init__(self, project_id: str, base_url: str) -> None:
+        self.project_id = project_id
+        self.base_url = base_url
+        self._context = None
+
+    def __getstate__(self):
+        return {"project_id": self.project_id, "base_url": self.base_url}
+
+    def __setstate__(self, state) -> None:
+        self.__init__(**state)
+
+    def __call__(self, cbor: str) -> Dict[str, ExecutionUnits]:
+        if self._context is None:
+            # Only ``api`` is used to evaluate; the constructor would also
+            # query the latest epoch.
+            # pylint: disable=import-outside-toplevel
+            from blockfrost import BlockFrostApi
+
+            context = BlockFrostChainContext.__new__(BlockFrostChainContext)
+            context.api = BlockFrostApi(
+                project_id=self.project_id, base_url=self.base_url
+            )
+            self._context = context
+        return self._context.evaluate_tx_cbor(cbor)
+
+
+class OgmiosEvaluator:
+    """Evaluates with Ogmios, opening a connection per evaluation."""
+
+    def __init__(self, host: str, port: int, secure: bool = False) -> None:
+        self.host = host
+        self.port = port
+        self.secure = secure
+
+    def __call__(self, cbor: str) -> Dict[str, ExecutionUnits]:
+        context = OgmiosV6ChainContext.__new__(OgmiosV6ChainContext)
+        context.host, context.port, context.secure = self.host, self.port, self.secure
+        return context.evaluate_tx_cbor(cbor)
+
+
+def evaluator_for(context: ChainContext) -> Evaluator:
+    """Picklable evaluator equivalent to ``context.evaluate_tx_cbor``."""
+    if isinstance(context, LedgerSimulator):
+        return StaticEvaluator(context.execution_units)
+    if isinstance(context, BlockFrostChainContext):
+        # pylint: disable=protected-access
+        return BlockfrostEvaluator(context._project_id, context._base_url)
+    if isinstance(context, OgmiosV6ChainContext):
+        return OgmiosEvaluator(context.host, context.port, context.secure)
+    raise ValueError(f"No process-safe evaluator for {type(context).__name__}")
+
+
+@dataclass
+class SnapshotContext(ChainContext):
+    """Chain state a builder needs, frozen so it can be sent to a process.
+
+    Attributes:
+        protocol_parameters: Protocol parameters of the current epoch.
+        genesis_parameters: Genesis parameters.
+        network_id: Network of the addresses.
+        tip_slot: Slot the validity interval starts at.
+        epoch_number: Current epoch.
+        evaluator: Computes the execution units of a transaction's scripts.
+        address_utxos: UTxOs by address (bech32) for balancing.
+    """
+
+    protocol_parameters: ProtocolParameters
+    genesis_parameters: GenesisParameters
+    network_id: Network
+    tip_slot: int
+    epoch_number: int
+    evaluator: Evaluator
+    address_utxos: Dict[str, List[UTxO]] = field(default_factory=dict)
+
+    @classmethod
+    def capture(
+        cls,
+        context: ChainContext,
+        address_utxos: Optional[Dict[str, List[UTxO]]] = None,
+    ) -> "SnapshotContext":
+        """Snapshot of ``context``; reading its parameters may query it."""
+        return cls(
+            protocol_parameters=context.protocol_param,
+            genesis_parameters=context.genesis_param,
+            network_id=context.network,
+            tip_slot=context.last_block_slot,
+            epoch_number=context.epoch,
+            evaluator=evaluator_for(context),
+            address_utxos=address_utxos or {},
+        )
+
+    @property
+    def protocol_param(self) -> ProtocolParameters:
+        return self.protocol_parameters
+
+    @property
+    def genesis_param(self) -> GenesisParameters:
+        return self.genesis_parameters
+
+    @property
+    def network(self) -> Network:
+        return self.network_id
+
+    @property
+    def epoch(self) -> int:
+        return self.epoch_number
+
+    @property
+    def last_block_slot(self) -> int:
+        return self.tip_slot
+
+    def _utxos(self, address: str) -> List[UTxO]:
+        return list(self.address_utxos.get(address, ()))
+
+    def submit_tx_cbor(self, cbor: Union[bytes, str]):
+        raise NotImplementedError("A snapshot context cannot submit transactions.")
+
+    def evaluate_tx_cbor(self, cbor: Union[bytes, str]) -> Dict[str, ExecutionUnits]:
+        if isinstance(cbor, bytes):
+            cbor = cbor.hex()
+        return self.evaluator(cbor)
+
+
+def _reduce_dict(obj: DictCBORSerializable):
+    return type(obj), (dict(obj.data),)
+
+
+def dumps(obj) -> bytes:
+    """Pickle ``obj``, which may hold dict-like pycardano types.
+
+    ``MultiAsset`` and the other ``DictCBORSerializable`` types pickle, but
+    unpickling them recurses in their ``__getattr__`` before ``data`` is
+    set, so they are rebuilt from their items instead.
+    """
+    table = copyreg.dispatch_table.copy()
+    pending = [DictCBORSerializable]
+    while pending:
+        cls = pending.pop()
+        table[cls] = _reduce_dict
+        pending.extend(cls.__subclasses__())
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = table
+    pickler.dump(obj)
+    return buffer.getvalue()
+
+
+@dataclass
+class BuildSpec:
+    """A build-and-sign job that can be sent to a worker process.
+
+    Attributes:
+        builder: Copy of the transaction builder bound to a
+            ``SnapshotContext``.
+        signing_key: Key signing the transaction.
+        change_address: Address receiving the change.
+    """
+
+    builder: TransactionBuilder
+    signing_key: Union[PaymentSigningKey, ExtendedSigningKey]
+    change_address: Address
+
+    @classmethod
+    def from_builder(
+        cls,
+        builder: TransactionBuilder,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        change_address: Address,
+        context: SnapshotContext,
+    ) -> "BuildSpec":
+        snapshot = copy.copy(builder)
+        snapshot.context = context
+        return cls(snapshot, signing_key, change_address)
+
+    def __reduce__(self):
+        return _load_spec, (
+            dumps((self.builder, self.signing_key, self.change_address)),
+        )
+
+
+def _load_spec(data: bytes) -> BuildSpec:
+    return BuildSpec(*pickle.loads(data))
+
+
+def run_spec(spec: BuildSpec) -> bytes:
+    """Worker entry point: the pickled result of ``build_and_sign``.
+
+    The transaction is pickled rather than returned as CBOR, as decoding
+    the CBOR again may not reproduce it byte for byte, and the fee is
+    computed from its size.
+    """
+    return dumps(build_and_sign(spec.builder, spec.signing_key, spec.change_address))
+
+
+class BuildExecutor:
+    """Pool the build-and-sign stage runs in.
+
+    Process workers are started with ``spawn``, so they do not inherit the
+    event loop or open connections of the parent, and are created on the
+    first build.
+
+    Attributes:
+        mode: ``thread`` or ``process``.
+        max_workers: Pool size, by default the number of CPUs.
+    """
+
+    def __init__(self, mode: str = "process", max_workers: Optional[int] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown build pool mode {mode!r}, expected {MODES}")
+        self.mode = mode
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self._pool: Optional[Executor] = None
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._pool = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="build"
+                )
+        return self._pool
+
+    async def run(
+        self,
+        builder: TransactionBuilder,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        address: Address,
+        context: Optional[SnapshotContext] = None,
+    ) -> Transaction:
+        """Balance and sign ``builder`` in the pool.
+
+        Args:
+            builder (TransactionBuilder): transaction builder with its inputs
+        set
+            signing_key (Union[PaymentSigningKey, ExtendedSigningKey]):
+        signing key
+            address (Address): change address
+            context (SnapshotContext): chain state the builder is balanced
+        against, required in process mode
+
+        Returns:
+            Transaction: The signed transaction.
+        """
+        loop = asyncio.get_running_loop()
+        if self.mode == "process":
+            if context is None:
+                raise ValueError("Process builds need a snapshot context.")
+            spec = BuildSpec.from_builder(builder, signing_key, address, context)
+            result = await loop.run_in_executor(self.pool, run_spec, spec)
+            tx, build_seconds, sign_seconds = pickle.loads(result)
+        else:
+            tx, build_seconds, sign_seconds = await loop.run_in_executor(
+                self.pool, build_and_sign, builder, signing_key, address
+            )
+        metrics.observe("tx.build", build_seconds, pool=self.mode)
+        metrics.observe("tx.sign", sign_seconds, pool=self.mode)
+        return tx
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,251 @@
+"""Record and replay HTTP traffic to Kupo and Blockfrost.
+
+A cassette holds request/response pairs with the time each response took.
+Kupo requests are recorded by ``Api._request``. Blockfrost requests are made
+by blockfrost-python through ``requests``, so they are recorded by routing
+them through a local ``CassetteServer`` that forwards them upstream.
+
+On replay the same server answers from the cassette, optionally sleeping for
+the recorded (or a fixed) latency, so commands run against real responses
+without reaching a live service.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger("cassette")
+
+CASSETTE_VERSION = 1
+
+# Transaction ids, script hashes and policy ids in request paths.
+_HASH = re.compile(r"[0-9a-f]{56,}")
+
+# Request headers passed on to the upstream service when recording.
+_FORWARDED_HEADERS = ("project_id", "Content-Type", "Accept", "User-Agent")
+
+
+def path_shape(path: str) -> str:
+    """The path with its hashes blanked out, used when no exact match exists."""
+    return _HASH.sub("*", path)
+
+
+class Cassette:
+    """Ordered request/response pairs of one or more services.
+
+    Each interaction is a dict with ``service``, ``method``, ``path``,
+    ``status``, ``response`` (the decoded JSON body) and ``elapsed``
+    (seconds), plus ``body`` for requests that carried one. Recording is
+    thread-safe, since Blockfrost requests are made from worker threads.
+    """
+
+    def __init__(self, interactions: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.interactions: List[Dict[str, Any]] = list(interactions or [])
+        self._lock = threading.Lock()
+        self._replay: Optional[Dict[Tuple[str, str, str], Deque[dict]]] = None
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        """Read a cassette written by ``save``."""
+        with gzip.open(path, "rt", encoding="UTF-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{path}: unsupported cassette version")
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def save(self, path: str) -> None:
+        """Write the cassette as gzip-compressed JSON lines."""
+        with self._lock:
+            interactions = list(self.interactions)
+        with gzip.open(path, "wt", encoding="UTF-8") as f:
+            f.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+            for interaction in interactions:
+                f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+        logger.info("Saved %d interactions to %s", len(interactions), path)
+
+    def record(
+        self,
+        service: str,
+        method: str,
+        path: str,
+        status: int,
+        response: Any,
+        elapsed: float,
+        body: Any = None,
+    ) -> None:
+        interaction = {
+            "service": service,
+            "method": method,
+            "path": path,
+            "status": status,
+            "response": response,
+            "elapsed": round(elapsed, 6),
+        }
+        if body is not None:
+            interaction["body"] = body
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def next_response(self, service: str, method: str, path: str) -> Optional[dict]:
+        """The recorded interaction answering a request, if any.
+
+        Repeated requests get the recorded responses in order, and the last
+        one once they run out, so polling replays the way it was recorded. A
+        request with no exact match gets the responses recorded for the same
+        path with different hashes (a transaction status for a new tx id).
+        """
+        with self._lock:
+            if self._replay is None:
+                self._replay = {}
+                for interaction in self.interactions:
+                    key = (interaction["service"], interaction["method"])
+                    path_ = interaction["path"]
+                    for k in (key + (path_,), key + ("shape", path_shape(path_))):
+                        self._replay.setdefault(k, deque()).append(interaction)
+            queue = self._replay.get((service, method, path)) or self._replay.get(
+                (service, method, "shape", path_shape(path))
+            )
+            if not queue:
+                return None
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+
+class CassetteServer:
+    """Local HTTP stand-in serving ``/<service>/<path>`` from a cassette.
+
+    Services listed in ``upstreams`` are forwarded to their upstream URL and
+    recorded instead. The server runs its own event loop in a daemon thread,
+    so synchronous clients (blockfrost-python) can use it from any thread,
+    including the one running the caller's event loop.
+
+    Attributes:
+        cassette: Cassette replayed from, or recorded into.
+        upstreams: Upstream base URL per recorded service.
+        latency: Seconds to wait before each replayed response; ``None``
+            waits for the recorded time.
+        url: Base URL of the server once started.
+    """
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        upstreams: Optional[Dict[str, str]] = None,
+        latency: Optional[float] = 0.0,
+    ) -> None:
+        self.cassette = cassette
+        self.upstreams = upstreams or {}
+        self.latency = latency
+        self.url: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def start(self) -> str:
+        """Start serving on an ephemeral local port and return the base URL."""
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(ready,), name="cassette-server", daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+        return self.url
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join()
+            self._loop = None
+
+    def _run(self, ready: threading.Event) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve(ready))
+        self._loop.close()
+
+    async def _serve(self, ready: threading.Event) -> None:
+        self._stop = asyncio.Event()
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/{service}/{tail:.*}", self._handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint: disable=W0212
+        self.url = f"http://127.0.0.1:{port}"
+        if self.upstreams:
+            self._session = aiohttp.ClientSession()
+        ready.set()
+        try:
+            await self._stop.wait()
+        finally:
+            if self._session is not None:
+                await self._session.close()
+            await runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        service = request.match_info["service"]
+        path = "/" + request.match_info["tail"]
+        if request.query_string:
+            path += "?" + request.query_string
+        if service in self.upstreams:
+            return await self._forward(service, path, request)
+
+        interaction = self.cassette.next_response(service, request.method, path)
+        if interaction is None:
+            logger.warning(
+                "No recorded response for %s %s%s", request.method, service, path
+            )
+            return web.json_response(
+                {
+                    "status_code": 404,
+                    "error": "Not Found",
+                    "message": f"No recorded response for {request.method} {path}",
+                },
+                status=404,
+            )
+        latency = interaction["elapsed"] if self.latency is None else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        return web.json_response(interaction["response"], status=interaction["status"])
+
+    async def _forward(
+        self, service: str, path: str, request: web.Request
+    ) -> web.Response:
+        body = await request.read()
+        headers = {
+            k: request.headers[k] for k in _FORWARDED_HEADERS if k in request.headers
+        }
+        start = time.perf_counter()
+        async with self._session.request(
+            request.method,
+            self.upstreams[service] + path,
+            data=body or None,
+            headers=headers,
+        ) as resp:
+            payload = await resp.read()
+            elapsed = time.perf_counter() - start
+            content_type = resp.content_type
+
+        try:
+            response = json.loads(payload) if payload else None
+        except ValueError:
+            response = payload.decode("UTF-8", "replace")
+        self.cassette.record(
+            service,
+            request.method,
+            path,
+            resp.status,
+            response,
+            elapsed,
+            body=body.hex() if body else None,
+        )
+        return web.Response(body=payload, status=resp.status, content_type=content_type)
@@ -1,7 +1,20 @@
 """This module contains the ChainQuery class, which is used to query the blockchain."""
 
 import asyncio
-from typing import List, Optional, Tuple, Union
+import logging
+from contextlib import aclosing
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import cbor2
 from blockfrost import ApiError
@@ -10,6 +23,7 @@ from pycardano import (
     BlockFrostChainContext,
     ExtendedSigningKey,
     InsufficientUTxOBalanceException,
+    MultiAsset,
     OgmiosV6ChainContext,
     PaymentSigningKey,
     PlutusV2Script,
@@ -24,12 +38,34 @@ from pycardano import (
     plutus_script_hash,
 )
 
+from .backends import BackendPool
+from .balances import BalanceIndex
+from .build_pool import BuildExecutor, SnapshotContext, build_and_sign
+from .coin_selection import CoinSelectionError, CoinSelector, UTxOIndex, shortfall
+from .metrics import metrics
+from .pagination import address_utxos, stream_address_pages, stream_address_utxos
+from .ratelimit import RateLimitedBlockFrostApi, request_budget
+from .scripts import ScriptRegistry
+from .simulator import LedgerSimulator
+
+if TYPE_CHECKING:
+    from .utxo_table import UTxOTable
+
+logger = logging.getLogger("chain_query")
+
 
 class KupoContext:
     async def utxos_kupo(self, _: str) -> List[UTxO]:
         pass
 
 
+def _asset_unit(holding: MultiAsset) -> Tuple[str, str]:
+    """Policy id and asset name (hex) of a single-asset ``MultiAsset``."""
+    ((policy_id, assets),) = holding.items()
+    ((asset_name, _),) = assets.items()
+    return policy_id.payload.hex(), asset_name.payload.hex()
+
+
 class ChainQuery:
     """chainQuery methods"""
 
@@ -40,19 +76,61 @@ class ChainQuery:
         kupo_context: Optional[KupoContext] = None,
         oracle_address: str = None,
         is_local_testnet: bool = False,
+        script_registry: Optional[ScriptRegistry] = None,
+        simulator_context: Optional[LedgerSimulator] = None,
+        backend_pool: Optional[BackendPool] = None,
+        coin_selector: Optional[CoinSelector] = None,
+        build_executor: Optional[BuildExecutor] = None,
     ):
-        if blockfrost_context is None and ogmios_context is None:
+        if (
+            blockfrost_context is None
+            and ogmios_context is None
+            and simulator_context is None
+        ):
             raise ValueError("At least one of the chain contexts must be provided.")
 
         self.blockfrost_context = blockfrost_context
         self.ogmios_context = ogmios_context
         self.kupo_context = kupo_context
         self.oracle_address = oracle_address
-        self.context = blockfrost_context if blockfrost_context else ogmios_context
+        self.simulator_context = simulator_context
+        # When set, reads are hedged and submissions broadcast across the
+        # pooled backends; ``context`` still balances and evaluates.
+        self.backend_pool = backend_pool
+        # Picks balancing inputs from a sorted index of the wallet instead of
+        # handing the whole address to pycardano's selectors.
+        self.coin_selector = coin_selector
+        # Pool that balances and signs transactions off the event loop
+        # thread; ``asyncio.to_thread`` when not set.
+        self.build_executor = build_executor
+        self.context = blockfrost_context or ogmios_context or simulator_context
         self.is_local_testnet = is_local_testnet
+        self.script_registry = script_registry
+        # Inputs spent by transactions submitted from this process that are
+        # not confirmed yet. They still show up in address queries, so they
+        # are kept out of balancing and collateral selection.
+        self.in_flight_inputs: Set[TransactionInput] = set()
+        # Balance indexes by address, rebuilt when older than
+        # ``balance_max_age`` seconds, and the outputs of submitted
+        # transactions that are added to them once confirmed.
+        self.balance_max_age = 30.0
+        self._balances: Dict[str, BalanceIndex] = {}
+        self._utxo_indexes: Dict[str, UTxOIndex] = {}
+        self._pending_outputs: Dict[str, List[UTxO]] = {}
 
         self._datum_cache = {}
 
+    @property
+    def backend(self) -> str:
+        """Name of the service answering queries, used to label metrics."""
+        if self.backend_pool is not None:
+            return "pool"
+        if self.blockfrost_context is not None:
+            return "blockfrost"
+        if self.ogmios_context is not None:
+            return "ogmios"
+        return "simulator"
+
     async def get_utxos(self, address: Union[str, Address, None] = None) -> List[UTxO]:
         """
         get utxos from oracle address.
@@ -65,12 +143,243 @@ class ChainQuery:
         """
         if address is None:
             address = self.oracle_address
-        if self.blockfrost_context is not None:
-            print("Getting utxos from blockfrost")
-            return self.blockfrost_context.utxos(str(address))
-        if self.ogmios_context is not None:
-            print("Getting utxos from ogmios")
-            return await self.kupo_context.utxos_kupo(str(address))
+        logger.debug("Getting utxos of %s from %s", address, self.backend)
+        with metrics.span("backend.utxos", backend=self.backend):
+            if self.backend_pool is not None:
+                utxos = await self.backend_pool.read("utxos", str(address))
+            elif self.blockfrost_context is not None:
+                utxos = await address_utxos(
+                    self.blockfrost_context,
+                    str(address),
+                    resolve_script=self._reference_script,
+                )
+            elif self.ogmios_context is not None:
+                utxos = await self.kupo_context.utxos_kupo(str(address))
+            else:
+                utxos = self.simulator_context.utxos(str(address))
+        metrics.inc("backend_requests", backend=self.backend, call="utxos")
+        metrics.inc("utxos_fetched", len(utxos), backend=self.backend)
+        return utxos
+
+    async def balance_index(
+        self, address: Union[str, Address], max_age: Optional[float] = None
+    ) -> BalanceIndex:
+        """Balances of an address, from one query and kept up to date.
+
+        The index is built from a single ``get_utxos`` call, leaving out the
+        inputs of unconfirmed transactions. Transactions submitted through
+        this object remove their inputs from it straight away and add their
+        outputs once confirmed, so repeated balance checks cost no query.
+
+        Args:
+            address (str, Address): The address.
+            max_age (float, optional): Rebuild an index older than this many
+                seconds. Defaults to ``balance_max_age``.
+
+        Returns:
+            BalanceIndex: The balances.
+        """
+        key = str(address)
+        max_age = self.balance_max_age if max_age is None else max_age
+        index = self._balances.get(key)
+        if index is not None and index.age <= max_age:
+            metrics.inc("cache_hits", cache="balance_index")
+            return index
+        metrics.inc("cache_misses", cache="balance_index")
+        utxos = await self.get_utxos(key)
+        index = BalanceIndex(
+            key, (utxo for utxo in utxos if utxo.input not in self.in_flight_inputs)
+        )
+        self._balances[key] = index
+        return index
+
+    async def utxo_index(
+        self, address: Union[str, Address], max_age: Optional[float] = None
+    ) -> UTxOIndex:
+        """UTxOs of an address sorted for coin selection, kept up to date.
+
+        Built and maintained like ``balance_index``.
+
+        Args:
+            address (str, Address): The address.
+            max_age (float, optional): Rebuild an index older than this many
+                seconds. Defaults to ``balance_max_age``.
+
+        Returns:
+            UTxOIndex: The sorted UTxOs.
+        """
+        key = str(address)
+        max_age = self.balance_max_age if max_age is None else max_age
+        index = self._utxo_indexes.get(key)
+        if index is not None and index.age <= max_age:
+            metrics.inc("cache_hits", cache="utxo_index")
+            return index
+        metrics.inc("cache_misses", cache="utxo_index")
+        utxos = await self.get_utxos(key)
+        index = UTxOIndex(
+            key, (utxo for utxo in utxos if utxo.input not in self.in_flight_inputs)
+        )
+        self._utxo_indexes[key] = index
+        return index
+
+    def _indexes(self) -> List[Union[BalanceIndex, UTxOIndex]]:
+        return [*self._balances.values(), *self._utxo_indexes.values()]
+
+    def _track_submitted(self, tx: Transaction) -> None:
+        """Apply a submitted transaction to the balance and UTxO indexes."""
+        indexes = self._indexes()
+        if not indexes:
+            return
+        body = tx.transaction_body
+        for index in indexes:
+            index.apply(spent=body.inputs)
+        addresses = {index.address for index in indexes}
+        self._pending_outputs[str(tx.id)] = [
+            UTxO(TransactionInput(tx.id, i), output)
+            for i, output in enumerate(body.outputs)
+            if str(output.address) in addresses
+        ]
+
+    def _settle_submitted(self, tx_id: str, confirmed: bool) -> None:
+        """Add a confirmed transaction's outputs to the indexes.
+
+        An unconfirmed transaction may or may not have spent its inputs, so
+        the indexes are dropped and rebuilt on next use.
+        """
+        created = self._pending_outputs.pop(tx_id, None)
+        if not confirmed:
+            self.drop_indexes()
+            return
+        for index in self._indexes():
+            index.apply(created=created or ())
+
+    def drop_indexes(self) -> None:
+        """Forget the balance and UTxO indexes, rebuilt on next use."""
+        self._balances.clear()
+        self._utxo_indexes.clear()
+
+    async def get_utxo_table(self, address: Union[str, Address]) -> "UTxOTable":
+        """Get the UTxOs of an address as a compact ``UTxOTable``.
+
+        Blockfrost pages and Kupo responses are written into the table as
+        they arrive, without building pycardano objects. Other backends
+        convert the result of ``get_utxos``.
+
+        Args:
+            address (str, Address): The address to get the utxos from.
+
+        Returns:
+            UTxOTable: The utxos.
+        """
+        # numpy is only imported by the commands that need tables.
+        from .utxo_table import (  # pylint: disable=C0415
+            UTxOTableBuilder,
+            table_from_utxos,
+        )
+
+        address = str(address)
+        with metrics.span("backend.utxo_table", backend=self.backend):
+            if self.backend_pool is None and self.blockfrost_context is not None:
+                builder = UTxOTableBuilder()
+                async for page in stream_address_pages(
+                    self.blockfrost_context, address
+                ):
+                    for result in page:
+                        builder.add_blockfrost(result, address)
+                table = builder.build()
+            elif self.backend_pool is None and self.ogmios_context is not None:
+                table = await self.kupo_context.utxo_table_kupo(address)
+            else:
+                table = table_from_utxos(await self.get_utxos(address))
+        metrics.inc("utxos_fetched", len(table), backend=self.backend)
+        return table
+
+    async def iter_utxos(
+        self,
+        address: Union[str, Address],
+        reference_scripts: bool = True,
+        holding: Optional[MultiAsset] = None,
+    ) -> AsyncIterator[UTxO]:
+        """Yield the UTxOs of an address as they are fetched.
+
+        With Blockfrost, large addresses are fetched several pages at a time
+        and the UTxOs of each page are yielded as soon as it arrives. With
+        ``holding``, Blockfrost and Kupo only return the UTxOs holding the
+        token, and Kupo's answer is decoded one UTxO at a time as it is
+        read. Other backends yield the result of ``get_utxos``.
+
+        Args:
+            address (str, Address): The address to get the utxos from.
+            reference_scripts (bool): Resolve the reference scripts of the
+                UTxOs. Skipping them saves Blockfrost two requests per script
+                that is not in the local script registry.
+            holding (MultiAsset, optional): Only yield UTxOs holding this
+                token, e.g. an NFT. It must name a single asset.
+        """
+        unit = _asset_unit(holding) if holding is not None else None
+        if self.backend_pool is None and self.blockfrost_context is not None:
+            with metrics.span("backend.utxos", backend=self.backend):
+                async for utxo in stream_address_utxos(
+                    self.blockfrost_context,
+                    str(address),
+                    resolve_script=(
+                        self._reference_script if reference_scripts else None
+                    ),
+                    asset=unit and unit[0] + unit[1],
+                ):
+                    yield utxo
+            metrics.inc("backend_requests", backend=self.backend, call="utxos")
+        elif self.backend_pool is None and self.ogmios_context is not None and unit:
+            with metrics.span("backend.utxos", backend=self.backend):
+                async for output in self.kupo_context.iter_utxos_kupo(
+                    str(address), *unit
+                ):
+                    yield await output.to_utxo()
+            metrics.inc("backend_requests", backend=self.backend, call="utxos")
+        else:
+            for utxo in await self.get_utxos(address):
+                if holding is None or utxo.output.amount.multi_asset >= holding:
+                    yield utxo
+
+    async def find_utxo(
+        self,
+        address: Union[str, Address],
+        predicate: Callable[[UTxO], bool],
+        reference_scripts: bool = True,
+        holding: Optional[MultiAsset] = None,
+    ) -> Optional[UTxO]:
+        """Return the first UTxO of ``address`` matching ``predicate``.
+
+        Pages or responses that have not been read when a match is found are
+        not requested, and only the candidates are decoded.
+
+        Args:
+            address (str, Address): The address to search.
+            predicate (Callable[[UTxO], bool]): The match condition.
+            reference_scripts (bool): See ``iter_utxos``.
+            holding (MultiAsset, optional): A token every candidate holds,
+                see ``iter_utxos``.
+
+        Returns:
+            Optional[UTxO]: The matching utxo, None if there is none.
+        """
+        async with aclosing(
+            self.iter_utxos(address, reference_scripts, holding)
+        ) as utxos:
+            async for utxo in utxos:
+                if predicate(utxo):
+                    return utxo
+        return None
+
+    def _reference_script(self, script_hash: str):
+        """Script of a Blockfrost reference script hash, local copy first."""
+        if self.script_registry is not None:
+            script = self.script_registry.by_hash(
+                ScriptHash.from_primitive(script_hash)
+            )
+            if script is not None:
+                return script
+        return self.blockfrost_context._get_script(script_hash)
 
     async def get_reference_script_utxo(
         self,
@@ -87,14 +396,16 @@ class ChainQuery:
         Returns:
             UTxO: utxo with plutus script
         """
-        utxos = await self.get_utxos(oracle_addr)
-        if len(utxos) > 0:
-            for utxo in utxos:
-                if utxo.input == reference_script_input:
-                    if isinstance(self.context, BlockFrostChainContext):
-                        script = await self.get_plutus_script(oracle_script_hash)
-                        utxo.output.script = script
-                    return utxo
+        utxo = await self.find_utxo(
+            oracle_addr,
+            lambda utxo: utxo.input == reference_script_input,
+            reference_scripts=False,
+        )
+        if utxo is not None:
+            if isinstance(self.context, BlockFrostChainContext):
+                script = await self.get_plutus_script(oracle_script_hash)
+                utxo.output.script = script
+            return utxo
 
     async def get_plutus_script(self, scripthash: ScriptHash) -> PlutusV2Script:
         """
@@ -107,6 +418,11 @@ class ChainQuery:
             PlutusV2Script: plutus script if script hash matches else None
 
         """
+        if self.script_registry is not None:
+            plutus_script = self.script_registry.by_hash(scripthash)
+            if plutus_script is not None:
+                return plutus_script
+
         if isinstance(self.context, BlockFrostChainContext):
             plutus_script = self.context._get_script(str(scripthash))
             if plutus_script_hash(plutus_script) != scripthash:
@@ -142,22 +458,8 @@ class ChainQuery:
             Tuple[str, Transaction]: The status of the transaction and the
             transaction object.
         """
-        # The minimum suggested amount is 15 ADA for the Aggregate transaction,
-        # but ~1.3 ADA is commonly used for covering fees.
-        # The aggregate tx is considered the most costly transaction.
-
-        if user_defined_expense > 0:
-            builder = await self.process_common_inputs(
-                builder, address, signing_key, user_defined_expense
-            )
-        else:
-            builder = await self.process_common_inputs(builder, address, signing_key)
-
-        signed_tx = builder.build_and_sign(
-            [signing_key],
-            change_address=address,
-            auto_validity_start_offset=0,
-            auto_ttl_offset=120,
+        signed_tx = await self.build_tx(
+            builder, signing_key, address, user_defined_expense
         )
 
         try:
@@ -172,6 +474,120 @@ class ChainQuery:
             print("Error submitting transaction: {str(err)}")
             return "error", signed_tx
 
+    async def build_tx(
+        self,
+        builder: TransactionBuilder,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        address: Address,
+        user_defined_expense: int = 0,
+    ) -> Transaction:
+        """adds collateral and signers to tx, then balances and signs it.
+
+        Args:
+            builder (TransactionBuilder): transaction builder
+            signing_key (Union[PaymentSigningKey, ExtendedSigningKey]):
+        signing key
+            address (Address): address belonging to signing_key, used for
+        balancing, collateral and change
+            user_defined_expense: When not equal to 0, a UTxO with the specified
+        ADA amount is searched for to cover blockchain fees.
+
+        Returns:
+            Transaction: The signed transaction.
+        """
+        # The minimum suggested amount is 15 ADA for the Aggregate transaction,
+        # but ~1.3 ADA is commonly used for covering fees.
+        # The aggregate tx is considered the most costly transaction.
+
+        if user_defined_expense > 0:
+            builder = await self.process_common_inputs(
+                builder, address, signing_key, user_defined_expense
+            )
+        else:
+            builder = await self.process_common_inputs(builder, address, signing_key)
+
+        return await self.build_and_sign(builder, signing_key, address)
+
+    async def build_and_sign(
+        self,
+        builder: TransactionBuilder,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        address: Address,
+    ) -> Transaction:
+        """Balance a builder whose inputs are set, and sign it.
+
+        Args:
+            builder (TransactionBuilder): transaction builder
+            signing_key (Union[PaymentSigningKey, ExtendedSigningKey]):
+        signing key
+            address (Address): change address
+
+        Returns:
+            Transaction: The signed transaction.
+        """
+        try:
+            if self.build_executor is None:
+                # Balancing queries the backend and evaluates scripts
+                # synchronously.
+                return await asyncio.to_thread(
+                    self._build_and_sign, builder, signing_key, address
+                )
+            snapshot = None
+            if self.build_executor.mode == "process":
+                snapshot = await self.snapshot_context(builder)
+            return await self.build_executor.run(
+                builder, signing_key, address, snapshot
+            )
+        except Exception:
+            if self.coin_selector is not None:
+                self.coin_selector.release(utxo.input for utxo in builder.inputs)
+            raise
+
+    @staticmethod
+    def _build_and_sign(
+        builder: TransactionBuilder,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        address: Address,
+    ) -> Transaction:
+        """``builder.build_and_sign`` for one key, with build and sign timed apart."""
+        tx, build_seconds, sign_seconds = build_and_sign(builder, signing_key, address)
+        metrics.observe("tx.build", build_seconds)
+        metrics.observe("tx.sign", sign_seconds)
+        return tx
+
+    async def snapshot_context(self, builder: TransactionBuilder) -> SnapshotContext:
+        """Chain state for balancing ``builder`` in another process.
+
+        The UTxOs of the builder's input addresses are only fetched when its
+        inputs may fall short of its outputs and the fee, as pycardano
+        queries them in that case only. With Blockfrost, a script
+        evaluation takes a token of the shared rate limit here, since the
+        worker's requests bypass it.
+
+        Args:
+            builder (TransactionBuilder): transaction builder
+
+        Returns:
+            SnapshotContext: picklable stand-in for ``context``
+        """
+        margin = self.coin_selector.margin if self.coin_selector else 5000000
+        target = shortfall(builder, margin)
+        address_utxos = {}
+        if target.coin or target.multi_asset:
+            excluded = {utxo.input for utxo in builder.excluded_inputs}
+            for address in builder.input_addresses:
+                address_utxos[str(address)] = [
+                    utxo
+                    for utxo in await self.get_utxos(address)
+                    if utxo.input not in excluded
+                ]
+        api = getattr(self.context, "api", None)
+        if isinstance(api, RateLimitedBlockFrostApi) and builder.redeemers():
+            await asyncio.to_thread(api.bucket.acquire)
+        return await asyncio.to_thread(
+            SnapshotContext.capture, self.context, address_utxos
+        )
+
     async def process_common_inputs(
         self,
         builder: TransactionBuilder,
@@ -202,9 +618,6 @@ class ChainQuery:
             builder.required_signers = [address.payment_part]
             return builder
         else:
-            # this could include any address utxos and spend them for tx fees
-            builder.add_input_address(address)
-
             # Fresh output for convenience of using for collateral in future
             # **NOTE** This value should align with the user_defined_expenses in the
             # aggregation transaction, as the node executes the aggregation, so the
@@ -217,6 +630,9 @@ class ChainQuery:
             non_nft_utxo = await self.get_or_create_collateral(address, signing_key)
 
             if non_nft_utxo is not None:
+                # Selected after the collateral, which may have to be created
+                # from the same UTxOs.
+                await self.select_inputs(builder, address, exclude=[non_nft_utxo])
                 builder.collaterals.append(non_nft_utxo)
                 builder.required_signers = [address.payment_part]
 
@@ -224,6 +640,62 @@ class ChainQuery:
 
         raise Exception("Unable to find or create collateral.")
 
+    async def select_inputs(
+        self,
+        builder: TransactionBuilder,
+        address: Address,
+        exclude: Iterable[UTxO] = (),
+    ) -> None:
+        """Add the inputs covering the builder's outputs from the wallet.
+
+        With a coin selector, the inputs are picked from the address's
+        ``utxo_index`` and reserved until the transaction is submitted. The
+        address stays an input address of the builder, so pycardano only
+        queries it when the selection margin falls short of the fee.
+
+        Args:
+            builder (TransactionBuilder): transaction builder
+            address (Address): the address whose UTxOs are used for balancing
+            exclude (Iterable[UTxO]): UTxOs to leave alone, e.g. the collateral
+        """
+        if not any(str(a) == str(address) for a in builder.input_addresses):
+            builder.add_input_address(address)
+        await self.exclude_in_flight_inputs(builder, address)
+        if self.coin_selector is None:
+            return
+
+        target = shortfall(builder, self.coin_selector.margin)
+        if not target.coin and not target.multi_asset:
+            return
+        index = await self.utxo_index(address)
+        unavailable = set(self.in_flight_inputs)
+        unavailable.update(utxo.input for utxo in builder.inputs)
+        unavailable.update(utxo.input for utxo in exclude)
+        try:
+            selection = self.coin_selector.select(index, target, exclude=unavailable)
+        except CoinSelectionError as err:
+            logger.info("Coin selection failed, balancing from the address: %s", err)
+            return
+        self.coin_selector.reserve(utxo.input for utxo in selection.inputs)
+        for utxo in selection.inputs:
+            builder.add_input(utxo)
+
+    async def exclude_in_flight_inputs(
+        self, builder: TransactionBuilder, address: Address
+    ) -> None:
+        """Keep the UTxOs spent by unconfirmed transactions out of balancing.
+
+        Args:
+            builder (TransactionBuilder): transaction builder
+            address (Address): the address whose UTxOs are used for balancing
+        """
+        if self.in_flight_inputs:
+            builder.excluded_inputs = [
+                utxo
+                for utxo in await self.get_utxos(address)
+                if utxo.input in self.in_flight_inputs
+            ]
+
     async def get_or_create_collateral(
         self,
         address: Address,
@@ -271,6 +743,8 @@ class ChainQuery:
         try:
             utxos = await self.get_utxos(address=target_address)
             for utxo in utxos:
+                if utxo.input in self.in_flight_inputs:
+                    continue
                 # A collateral should contain no multi asset
                 if not utxo.output.amount.multi_asset:
                     if utxo.output.amount < (required_amount + 10000000):
@@ -309,6 +783,7 @@ class ChainQuery:
         collateral_builder = TransactionBuilder(self.context)
 
         collateral_builder.add_input_address(target_address)
+        await self.exclude_in_flight_inputs(collateral_builder, target_address)
         collateral_builder.add_output(
             TransactionOutput(target_address, required_amount)
         )
@@ -324,7 +799,8 @@ class ChainQuery:
 
     async def submit_tx_with_print(self, tx: Transaction) -> Tuple[str, Transaction]:
         """
-        This method submits a transaction to the chain and prints the transaction ID.
+        This method submits a transaction to the chain, prints the transaction ID
+        and waits for its confirmation.
 
         Args:
             tx: The transaction to submit.
@@ -332,18 +808,54 @@ class ChainQuery:
         Returns:
             Tuple[str, Transaction]: The status of the transaction and the transaction object.
         """
-        print(f"Submitting transaction: {str(tx.id)}")
-        print(f"tx: {tx}")
+        await self.submit_tx(tx)
+        try:
+            status, _ = await self.wait_for_tx(str(tx.id))
+        finally:
+            self.release_inputs(tx)
+        return status, tx
 
-        if self.ogmios_context is not None:
-            print("Submitting tx with ogmios")
-            self.ogmios_context.submit_tx(tx.to_cbor())
-        elif self.blockfrost_context is not None:
-            print("Submitting tx with blockfrost")
-            self.blockfrost_context.submit_tx(tx.to_cbor())
+    async def submit_tx(self, tx: Transaction) -> None:
+        """
+        Submit a transaction without waiting for its confirmation.
 
-        status, _ = await self.wait_for_tx(str(tx.id))
-        return status, tx
+        The inputs it spends are recorded in ``in_flight_inputs`` until
+        ``release_inputs`` is called for it.
+
+        Args:
+            tx: The transaction to submit.
+        """
+        print(f"Submitting transaction: {str(tx.id)}")
+        logger.debug("tx: %s", tx)
+
+        tx_cbor = tx.to_cbor()
+        logger.debug("Submitting tx with %s", self.backend)
+        try:
+            with metrics.span("tx.submit", backend=self.backend):
+                if self.backend_pool is not None:
+                    await self.backend_pool.broadcast("submit", tx_cbor)
+                elif self.ogmios_context is not None:
+                    await asyncio.to_thread(self.ogmios_context.submit_tx, tx_cbor)
+                elif self.blockfrost_context is not None:
+                    await asyncio.to_thread(self.blockfrost_context.submit_tx, tx_cbor)
+                elif self.simulator_context is not None:
+                    self.simulator_context.submit_tx(tx_cbor)
+        except Exception:
+            # A rejected transaction gives its selected inputs back.
+            if self.coin_selector is not None:
+                self.coin_selector.release(tx.transaction_body.inputs)
+            raise
+        metrics.inc("backend_requests", backend=self.backend, call="submit")
+        metrics.inc("tx_submitted_bytes", len(tx_cbor), backend=self.backend)
+
+        self.in_flight_inputs.update(tx.transaction_body.inputs)
+        if self.coin_selector is not None:
+            self.coin_selector.release(tx.transaction_body.inputs)
+        self._track_submitted(tx)
+
+    def release_inputs(self, tx: Transaction) -> None:
+        """Forget the in-flight inputs of a confirmed or abandoned transaction."""
+        self.in_flight_inputs.difference_update(tx.transaction_body.inputs)
 
     async def wait_for_tx(
         self, tx_id: TransactionId
@@ -367,6 +879,8 @@ class ChainQuery:
             check_fn: callable,
             retries: int = 0,
             max_retries: int = 10,
+            wait_time: float = 20,
+            first_wait: float = 0,
         ) -> Tuple[str, Optional[Transaction]]:
             """Wait for a transaction to be confirmed.
 
@@ -376,14 +890,21 @@ class ChainQuery:
                 check_fn (callable): The function to use to check if the transaction is confirmed.
                 retries (int, optional): The number of retries. Defaults to 0.
                 max_retries (int, optional): The maximum number of retries. Defaults to 10.
+                wait_time (float, optional): Seconds between retries. Defaults to 20.
+                first_wait (float, optional): Seconds before the first check. Defaults to 0.
 
             Returns:
                 The transaction object if found, None otherwise.
             """
             status = "initiated"
             transaction = None
+            if first_wait:
+                await asyncio.sleep(first_wait)
             while retries < max_retries:
                 try:
+                    metrics.inc(
+                        "backend_requests", backend=self.backend, call="tx_status"
+                    )
                     transaction = await check_fn(context, tx_id)
                     if transaction:
                         print(f"Transaction submitted with tx_id: {str(tx_id)}")
@@ -401,7 +922,6 @@ class ChainQuery:
                     status = "error: " + str(err)
                     return status, None
 
-                wait_time = 20
                 print(
                     f"Waiting for transaction confirmation: {str(tx_id)}. Retrying in {wait_time} seconds",
                 )
@@ -424,7 +944,7 @@ class ChainQuery:
             Returns:
                 The transaction object if found, None otherwise.
             """
-            return context.api.transaction(tx_id)
+            return await asyncio.to_thread(context.api.transaction, tx_id)
 
         async def check_ogmios(
             context: OgmiosV6ChainContext, tx_id: TransactionId
@@ -439,10 +959,54 @@ class ChainQuery:
             Returns:
                 The transaction object if found, None otherwise.
             """
-            response = context._query_utxos_by_tx_id(tx_id, 0)
+            response = await asyncio.to_thread(context._query_utxos_by_tx_id, tx_id, 0)
             return response if response != [] else None
 
-        if self.ogmios_context:
-            return await _wait_for_tx(self.ogmios_context, tx_id, check_ogmios)
-        if self.blockfrost_context:
-            return await _wait_for_tx(self.blockfrost_context, tx_id, check_blockfrost)
+        async def check_simulator(
+            context: LedgerSimulator, tx_id: TransactionId
+        ) -> bool:
+            """Check if the simulated chain has confirmed the transaction."""
+            return context.is_confirmed(tx_id)
+
+        async def check_pool(pool: BackendPool, tx_id: TransactionId) -> bool:
+            """Ask the pooled backends whether the transaction is on chain."""
+            return await pool.read("tx_status", tx_id)
+
+        # Polling yields to other operations when Blockfrost tokens run low.
+        result = ("error: no backend", None)
+        try:
+            with metrics.span("tx.confirm", backend=self.backend), request_budget(
+                "confirm", background=True
+            ):
+                if self.backend_pool is not None:
+                    result = await _wait_for_tx(
+                        self.backend_pool,
+                        tx_id,
+                        check_pool,
+                        wait_time=(
+                            self.simulator_context.block_time / 2
+                            if self.simulator_context
+                            else 20
+                        ),
+                    )
+                elif self.simulator_context:
+                    result = await _wait_for_tx(
+                        self.simulator_context,
+                        tx_id,
+                        check_simulator,
+                        wait_time=self.simulator_context.block_time / 2,
+                    )
+                elif self.ogmios_context:
+                    result = await _wait_for_tx(
+                        self.ogmios_context, tx_id, check_ogmios
+                    )
+                elif self.blockfrost_context:
+                    # A transaction is not in a block for a few seconds after
+                    # submission; checking straight away only costs a 404.
+                    result = await _wait_for_tx(
+                        self.blockfrost_context, tx_id, check_blockfrost, first_wait=10
+                    )
+        finally:
+            # A wait cut short leaves the transaction's fate unknown.
+            self._settle_submitted(str(tx_id), result[0] == "success")
+        return result
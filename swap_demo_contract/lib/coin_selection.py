@@ -0,0 +1,538 @@
+"""Coin selection over a sorted index of wallet UTxOs.
+
+pycardano balances a transaction by handing every UTxO of its input address
+to its selectors, which go through the whole set for every transaction.
+``UTxOIndex`` keeps the UTxOs of a wallet sorted by lovelace and, per asset,
+by quantity, and is kept current from submitted transactions like a
+``BalanceIndex``. ``CoinSelector`` picks the inputs covering a target value
+from it with one of three strategies:
+
+- ``largest-first``: the largest holders of each asset, then the outputs
+  with the most lovelace, which gives few inputs.
+- ``random-improve``: CIP-2 random-improve. Random outputs are picked until
+  each amount is covered, then more are added while that brings the amount
+  closer to twice the target, which leaves change the size of a payment.
+- ``branch-and-bound``: assets are covered largest-first, then a bounded
+  depth-first search over the outputs whose lovelace is closest to what is
+  missing finds the selection that best meets the ``goal``: the fewest
+  inputs (``min-inputs``), the smallest transaction (``min-fee``) or the
+  least change (``min-change``).
+
+Inputs chosen for a transaction being built are reserved until it is
+submitted, when ``ChainQuery.in_flight_inputs`` takes over, or for
+``reservation_ttl`` seconds, so that concurrent builds pick different ones.
+"""
+
+import bisect
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pycardano import (
+    Asset,
+    MultiAsset,
+    TransactionBuilder,
+    TransactionInput,
+    UTxO,
+    UTxOSelectionException,
+    Value,
+)
+
+from .balances import Unit
+from .metrics import metrics
+
+STRATEGIES = ("largest-first", "random-improve", "branch-and-bound")
+GOALS = ("min-inputs", "min-fee", "min-change")
+
+# Approximate serialized sizes used to compare selections by fee: an input,
+# and an asset carried over to the change output.
+INPUT_BYTES = 37
+ASSET_BYTES = 44
+
+_Ref = Tuple[bytes, int]
+# Sort key: largest amount first, then by output reference.
+_Key = Tuple[int, bytes, int]
+
+
+class CoinSelectionError(UTxOSelectionException):
+    """The indexed UTxOs cannot cover the target."""
+
+
+def _ref(tx_in: TransactionInput) -> _Ref:
+    return tx_in.transaction_id.payload, tx_in.index
+
+
+def _amount(utxo: UTxO, unit: Optional[Unit]) -> int:
+    """Lovelace of a UTxO when ``unit`` is None, else its quantity of it."""
+    if unit is None:
+        return utxo.output.amount.coin
+    policy_id, asset_name = unit
+    return utxo.output.amount.multi_asset.get(policy_id, {}).get(asset_name, 0)
+
+
+def _units(utxo: UTxO) -> List[Unit]:
+    return [
+        (policy_id, asset_name)
+        for policy_id, asset in utxo.output.amount.multi_asset.items()
+        for asset_name, quantity in asset.items()
+        if quantity
+    ]
+
+
+class UTxOIndex:
+    """UTxOs of one address sorted by lovelace and by asset quantity.
+
+    Attributes:
+        address: The indexed address.
+        built_at: ``time.monotonic()`` when the index was built.
+    """
+
+    def __init__(self, address: str, utxos: Iterable[UTxO] = ()) -> None:
+        self.address = address
+        self.built_at = time.monotonic()
+        self._utxos: Dict[_Ref, UTxO] = {}
+        self._by_coin: List[_Key] = []
+        self._by_unit: Dict[Unit, List[_Key]] = {}
+        for utxo in utxos:
+            ref = _ref(utxo.input)
+            if ref in self._utxos:
+                continue
+            self._utxos[ref] = utxo
+            self._by_coin.append((-utxo.output.amount.coin, *ref))
+            for unit in _units(utxo):
+                self._by_unit.setdefault(unit, []).append((-_amount(utxo, unit), *ref))
+        self._by_coin.sort()
+        for keys in self._by_unit.values():
+            keys.sort()
+
+    def __len__(self) -> int:
+        return len(self._utxos)
+
+    def __contains__(self, tx_in: TransactionInput) -> bool:
+        return _ref(tx_in) in self._utxos
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+    def add(self, utxo: UTxO) -> None:
+        ref = _ref(utxo.input)
+        if ref in self._utxos:
+            return
+        self._utxos[ref] = utxo
+        bisect.insort(self._by_coin, (-utxo.output.amount.coin, *ref))
+        for unit in _units(utxo):
+            bisect.insort(
+                self._by_unit.setdefault(unit, []), (-_amount(utxo, unit), *ref)
+            )
+
+    def remove(self, tx_in: TransactionInput) -> Optional[UTxO]:
+        ref = _ref(tx_in)
+        utxo = self._utxos.pop(ref, None)
+        if utxo is None:
+            return None
+        self._discard(self._by_coin, (-utxo.output.amount.coin, *ref))
+        for unit in _units(utxo):
+            keys = self._by_unit[unit]
+            self._discard(keys, (-_amount(utxo, unit), *ref))
+            if not keys:
+                del self._by_unit[unit]
+        return utxo
+
+    @staticmethod
+    def _discard(keys: List[_Key], key: _Key) -> None:
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    def apply(
+        self,
+        spent: Iterable[TransactionInput] = (),
+        created: Iterable[UTxO] = (),
+    ) -> None:
+        """Update the index with spent and newly created UTxOs.
+
+        Spent inputs that are not indexed, and created UTxOs of other
+        addresses, are ignored.
+        """
+        for tx_in in spent:
+            self.remove(tx_in)
+        for utxo in created:
+            if str(utxo.output.address) == self.address:
+                self.add(utxo)
+
+    def largest(self, unit: Optional[Unit] = None) -> Iterator[UTxO]:
+        """UTxOs by decreasing lovelace, or decreasing quantity of ``unit``."""
+        keys = self._by_coin if unit is None else self._by_unit.get(unit, [])
+        for _, tx_id, index in keys:
+            yield self._utxos[tx_id, index]
+
+    def count(self, unit: Optional[Unit] = None) -> int:
+        """Number of UTxOs, or of UTxOs holding ``unit``."""
+        return len(self._by_coin if unit is None else self._by_unit.get(unit, ()))
+
+    def at(self, position: int, unit: Optional[Unit] = None) -> UTxO:
+        """The UTxO at ``position`` in the order of ``largest(unit)``."""
+        keys = self._by_coin if unit is None else self._by_unit[unit]
+        _, tx_id, index = keys[position]
+        return self._utxos[tx_id, index]
+
+    def near(self, coin: int, above: int, below: int) -> List[UTxO]:
+        """The UTxOs whose lovelace is closest to ``coin``.
+
+        Args:
+            coin: The lovelace to get close to.
+            above: How many of the smallest UTxOs holding at least ``coin``.
+            below: How many of the largest UTxOs holding less.
+
+        Returns:
+            List[UTxO]: The UTxOs, by decreasing lovelace.
+        """
+        split = bisect.bisect_right(self._by_coin, (-coin, b"\xff" * 33, 1 << 32))
+        keys = self._by_coin[max(0, split - above) : split + below]
+        return [self._utxos[tx_id, index] for _, tx_id, index in keys]
+
+
+class _RandomPool:
+    """Draws the UTxOs of an index at random, each at most once.
+
+    Positions are drawn lazily, so a selection that needs a few inputs does
+    not go through the whole index. Once half of it has been drawn, the rest
+    is listed and drawn from directly.
+    """
+
+    def __init__(
+        self, index: UTxOIndex, unit: Optional[Unit], rng: random.Random
+    ) -> None:
+        self.index = index
+        self.unit = unit
+        self.rng = rng
+        self.size = index.count(unit)
+        self.drawn: Set[int] = set()
+        self.rest: Optional[List[int]] = None
+
+    def draw(self) -> Optional[UTxO]:
+        if self.rest is None and 2 * len(self.drawn) >= self.size:
+            self.rest = [i for i in range(self.size) if i not in self.drawn]
+        if self.rest is not None:
+            if not self.rest:
+                return None
+            i = self.rng.randrange(len(self.rest))
+            self.rest[i], self.rest[-1] = self.rest[-1], self.rest[i]
+            return self.index.at(self.rest.pop(), self.unit)
+        while True:
+            position = self.rng.randrange(self.size)
+            if position not in self.drawn:
+                self.drawn.add(position)
+                return self.index.at(position, self.unit)
+
+
+@dataclass
+class Selection:
+    """Inputs picked by a ``CoinSelector`` and the value they hold."""
+
+    inputs: List[UTxO]
+    amount: Value
+
+
+def shortfall(builder: TransactionBuilder, margin: int = 0) -> Value:
+    """Value a builder's outputs need beyond its inputs and minted tokens.
+
+    Args:
+        builder: The transaction builder.
+        margin: Lovelace added to cover the fee and the change output.
+
+    Returns:
+        Value: The missing lovelace and assets, never negative.
+    """
+    provided = Value()
+    for utxo in builder.inputs:
+        provided += utxo.output.amount
+    requested = Value(margin)
+    for output in builder.outputs:
+        requested += output.amount
+    for policy_id, asset in (builder.mint or {}).items():
+        for asset_name, quantity in asset.items():
+            minted = Value(
+                0, MultiAsset({policy_id: Asset({asset_name: abs(quantity)})})
+            )
+            if quantity > 0:
+                provided += minted
+            else:
+                requested += minted
+    missing = requested.multi_asset - provided.multi_asset
+    return Value(
+        max(0, requested.coin - provided.coin),
+        missing.filter(lambda policy_id, asset_name, quantity: quantity > 0),
+    )
+
+
+class CoinSelector:
+    """Picks transaction inputs from a ``UTxOIndex``.
+
+    Attributes:
+        strategy: Default strategy, one of ``STRATEGIES``.
+        goal: What branch-and-bound minimises, one of ``GOALS``.
+        margin: Lovelace selected beyond the outputs for the fee and change.
+        max_inputs: Most inputs a selection may have.
+        reservation_ttl: Seconds a reservation lasts unless released.
+        bnb_candidates: UTxOs branch-and-bound searches through.
+        bnb_tries: Branches branch-and-bound explores before settling.
+    """
+
+    def __init__(
+        self,
+        strategy: str = "random-improve",
+        goal: str = "min-fee",
+        margin: int = 5000000,
+        max_inputs: int = 100,
+        reservation_ttl: float = 120.0,
+        bnb_candidates: int = 64,
+        bnb_tries: int = 20000,
+        seed: Optional[int] = None,
+    ) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown coin selection strategy: {strategy}")
+        if goal not in GOALS:
+            raise ValueError(f"Unknown coin selection goal: {goal}")
+        self.strategy = strategy
+        self.goal = goal
+        self.margin = margin
+        self.max_inputs = max_inputs
+        self.reservation_ttl = reservation_ttl
+        self.bnb_candidates = bnb_candidates
+        self.bnb_tries = bnb_tries
+        self._random = random.Random(seed)
+        self._reserved: Dict[TransactionInput, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, inputs: Iterable[TransactionInput]) -> None:
+        """Keep ``inputs`` out of other selections for ``reservation_ttl``."""
+        expires = time.monotonic() + self.reservation_ttl
+        with self._lock:
+            for tx_in in inputs:
+                self._reserved[tx_in] = expires
+
+    def release(self, inputs: Iterable[TransactionInput]) -> None:
+        """End the reservation of ``inputs``."""
+        with self._lock:
+            for tx_in in inputs:
+                self._reserved.pop(tx_in, None)
+
+    def reserved(self) -> Set[TransactionInput]:
+        """The inputs currently reserved."""
+        now = time.monotonic()
+        with self._lock:
+            for tx_in in [i for i, expires in self._reserved.items() if expires <= now]:
+                del self._reserved[tx_in]
+            return set(self._reserved)
+
+    def select(
+        self,
+        index: UTxOIndex,
+        target: Value,
+        exclude: Iterable[TransactionInput] = (),
+        strategy: Optional[str] = None,
+        goal: Optional[str] = None,
+    ) -> Selection:
+        """Pick UTxOs from ``index`` holding at least ``target``.
+
+        Args:
+            index: The wallet's UTxOs.
+            target: Lovelace and assets to cover.
+            exclude: Inputs that must not be picked, besides reserved ones.
+            strategy: Overrides the default strategy.
+            goal: Overrides the default branch-and-bound goal.
+
+        Returns:
+            Selection: The picked UTxOs, which are not reserved yet.
+
+        Raises:
+            CoinSelectionError: The target cannot be covered within
+                ``max_inputs`` inputs.
+        """
+        strategy = strategy or self.strategy
+        unavailable = self.reserved()
+        unavailable.update(exclude)
+        select = {
+            "largest-first": self._largest_first,
+            "random-improve": self._random_improve,
+            "branch-and-bound": self._branch_and_bound,
+        }[strategy]
+        with metrics.span("coin_selection", strategy=strategy):
+            selected = select(index, target, unavailable, goal or self.goal)
+        amount = Value()
+        for utxo in selected.values():
+            amount += utxo.output.amount
+        metrics.inc("coin_selection_inputs", len(selected), strategy=strategy)
+        return Selection(list(selected.values()), amount)
+
+    @staticmethod
+    def _requirements(target: Value) -> List[Tuple[Optional[Unit], int]]:
+        """Amounts to cover, assets first since their holders bring lovelace."""
+        requirements: List[Tuple[Optional[Unit], int]] = [
+            ((policy_id, asset_name), quantity)
+            for policy_id, asset in target.multi_asset.items()
+            for asset_name, quantity in asset.items()
+            if quantity > 0
+        ]
+        requirements.append((None, target.coin))
+        return requirements
+
+    def _add(self, selected: Dict[_Ref, UTxO], utxo: UTxO) -> None:
+        if len(selected) >= self.max_inputs:
+            raise CoinSelectionError(
+                f"Covering the target takes more than {self.max_inputs} inputs."
+            )
+        selected[_ref(utxo.input)] = utxo
+
+    def _largest_first(
+        self,
+        index: UTxOIndex,
+        target: Value,
+        unavailable: Set[TransactionInput],
+        goal: str,
+        selected: Optional[Dict[_Ref, UTxO]] = None,
+    ) -> Dict[_Ref, UTxO]:
+        selected = {} if selected is None else selected
+        for unit, needed in self._requirements(target):
+            have = sum(_amount(utxo, unit) for utxo in selected.values())
+            for utxo in index.largest(unit):
+                if have >= needed:
+                    break
+                if utxo.input in unavailable or _ref(utxo.input) in selected:
+                    continue
+                self._add(selected, utxo)
+                have += _amount(utxo, unit)
+            if have < needed:
+                raise CoinSelectionError(
+                    f"Only {have} of {needed} {_unit_name(unit)} available."
+                )
+        return selected
+
+    def _random_improve(
+        self,
+        index: UTxOIndex,
+        target: Value,
+        unavailable: Set[TransactionInput],
+        goal: str,
+    ) -> Dict[_Ref, UTxO]:
+        selected: Dict[_Ref, UTxO] = {}
+        requirements = self._requirements(target)
+        pools: Dict[Optional[Unit], _RandomPool] = {}
+
+        def draw(unit: Optional[Unit]) -> Optional[UTxO]:
+            while True:
+                utxo = pools[unit].draw()
+                if utxo is None:
+                    return None
+                if utxo.input not in unavailable and _ref(utxo.input) not in selected:
+                    return utxo
+
+        for unit, needed in requirements:
+            pools[unit] = _RandomPool(index, unit, self._random)
+            have = sum(_amount(utxo, unit) for utxo in selected.values())
+            while have < needed:
+                utxo = draw(unit)
+                if utxo is None:
+                    raise CoinSelectionError(
+                        f"Only {have} of {needed} {_unit_name(unit)} available."
+                    )
+                self._add(selected, utxo)
+                have += _amount(utxo, unit)
+
+        for unit, needed in requirements:
+            have = sum(_amount(utxo, unit) for utxo in selected.values())
+            ideal, maximum = 2 * needed, 3 * needed
+            while len(selected) < self.max_inputs:
+                utxo = draw(unit)
+                if utxo is None:
+                    break
+                improved = have + _amount(utxo, unit)
+                if improved > maximum or abs(ideal - improved) >= abs(ideal - have):
+                    break
+                self._add(selected, utxo)
+                have = improved
+        return selected
+
+    def _branch_and_bound(
+        self,
+        index: UTxOIndex,
+        target: Value,
+        unavailable: Set[TransactionInput],
+        goal: str,
+    ) -> Dict[_Ref, UTxO]:
+        selected = self._largest_first(
+            index, Value(0, target.multi_asset), unavailable, goal
+        )
+        needed = target.coin - sum(u.output.amount.coin for u in selected.values())
+        if needed <= 0:
+            return selected
+
+        candidates = [
+            utxo
+            for utxo in index.near(
+                needed, self.bnb_candidates // 4, self.bnb_candidates
+            )
+            if utxo.input not in unavailable and _ref(utxo.input) not in selected
+        ][: self.bnb_candidates]
+        coins = [utxo.output.amount.coin for utxo in candidates]
+        sizes = [INPUT_BYTES + ASSET_BYTES * len(_units(u)) for u in candidates]
+        # prefix[j] - prefix[i]: lovelace of candidates i to j - 1.
+        prefix = [0]
+        for coin in coins:
+            prefix.append(prefix[-1] + coin)
+
+        cost: Callable[[int, int, int], tuple] = {
+            "min-inputs": lambda count, size, excess: (count, excess),
+            "min-fee": lambda count, size, excess: (size, excess),
+            "min-change": lambda count, size, excess: (excess, count),
+        }[goal]
+        limit = self.max_inputs - len(selected)
+        best: List[int] = []
+        best_cost: Optional[tuple] = None
+        chosen: List[int] = []
+        tries = 0
+
+        def search(i: int, total: int, size: int) -> None:
+            nonlocal best, best_cost, tries
+            tries += 1
+            if total >= needed:
+                # Adding inputs only makes every goal worse.
+                found = cost(len(chosen), size, total - needed)
+                if best_cost is None or found < best_cost:
+                    best, best_cost = list(chosen), found
+                return
+            if tries >= self.bnb_tries or total + prefix[-1] - prefix[i] < needed:
+                return
+            # Candidates are sorted by decreasing lovelace, so at least
+            # ``more`` of them are still needed.
+            more = bisect.bisect_left(prefix, needed - total + prefix[i], i) - i
+            if len(chosen) + more > limit:
+                return
+            if best_cost is not None and (
+                cost(len(chosen) + more, size + more * INPUT_BYTES, 0) >= best_cost
+            ):
+                return
+            chosen.append(i)
+            search(i + 1, total + coins[i], size + sizes[i])
+            chosen.pop()
+            search(i + 1, total, size)
+
+        search(0, 0, 0)
+        metrics.inc("coin_selection_bnb_tries", tries)
+        if best_cost is None:
+            # Nothing close enough covers it: fall back to the largest UTxOs.
+            return self._largest_first(index, target, unavailable, goal, selected)
+        for i in best:
+            self._add(selected, candidates[i])
+        return selected
+
+
+def _unit_name(unit: Optional[Unit]) -> str:
+    if unit is None:
+        return "lovelace"
+    policy_id, asset_name = unit
+    return f"{policy_id.payload.hex()}.{asset_name.payload.hex()}"
@@ -0,0 +1,466 @@
+"""Wallet UTxO consolidation.
+
+Every balanced transaction leaves a fresh 30 ADA output in the wallet and
+every tADA trade pays out 2 ADA with tokens, so a busy wallet fragments
+into many small UTxOs, which makes address queries and coin selection
+slower. ``plan_consolidation`` works out the transactions that merge them
+back while keeping:
+
+- ``collateral_utxos`` pure-ADA outputs that ``ChainQuery.find_collateral``
+  accepts, creating the missing ones;
+- ``token_utxos`` outputs per token policy, each with an equal share of its
+  tokens, so that as many trades can spend tokens at the same time;
+- the rest of the lovelace in one change output.
+
+Outputs with a datum or a reference script, and inputs in flight or
+reserved by the coin selector, are left alone. A wallet too fragmented for
+one transaction under the protocol's size limit is merged in rounds: each
+transaction of a round merges its share of the inputs, and the next round
+plans again from the result. ``Consolidator`` runs the rounds.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Union
+
+from pycardano import (
+    Address,
+    Asset,
+    ExtendedSigningKey,
+    MultiAsset,
+    PaymentSigningKey,
+    ScriptHash,
+    Transaction,
+    TransactionBuilder,
+    TransactionInput,
+    TransactionOutput,
+    UTxO,
+    Value,
+    min_lovelace_post_alonzo,
+)
+
+from .coin_selection import ASSET_BYTES, INPUT_BYTES
+from .metrics import metrics
+from .ratelimit import request_budget
+
+if TYPE_CHECKING:
+    from .chain_query import ChainQuery
+
+logger = logging.getLogger("consolidation")
+
+# Size of a transaction without inputs and outputs (body fields, one vkey
+# witness), of an output without assets, and what is left for the change.
+BASE_TX_BYTES = 400
+OUTPUT_BYTES = 70
+CHANGE_BYTES = 1000
+
+
+@dataclass
+class ConsolidationPolicy:
+    """What a consolidated wallet holds.
+
+    Attributes:
+        collateral_utxos: Collateral-ready pure-ADA outputs to keep.
+        collateral_amount: Lovelace of a collateral output, as requested by
+            ``ChainQuery.get_or_create_collateral``.
+        token_utxos: Outputs over which the tokens of each policy are spread.
+        min_utxos: Wallets with this many UTxOs or fewer are left alone,
+            unless collateral is missing.
+        max_inputs: Most inputs in one transaction.
+        max_assets_per_output: Most assets in one token output.
+        max_rounds: Most rounds ``Consolidator.run`` goes through.
+    """
+
+    collateral_utxos: int = 2
+    collateral_amount: int = 30000000
+    token_utxos: int = 1
+    min_utxos: int = 5
+    max_inputs: int = 120
+    max_assets_per_output: int = 40
+    max_rounds: int = 3
+
+    @classmethod
+    def from_config(cls, settings: Optional[dict]) -> "ConsolidationPolicy":
+        """Policy from the ``consolidation`` section of ``config.yaml``."""
+        settings = settings or {}
+        defaults = cls()
+        return cls(
+            **{
+                name: int(settings.get(name, getattr(defaults, name)))
+                for name in cls.__dataclass_fields__  # pylint: disable=no-member
+            }
+        )
+
+    def collateral_ready(self, utxo: UTxO) -> bool:
+        """Whether ``find_collateral`` would pick ``utxo`` as collateral."""
+        output = utxo.output
+        return (
+            not output.amount.multi_asset
+            and output.datum is None
+            and output.datum_hash is None
+            and output.script is None
+            and self.collateral_amount - 1000000
+            <= output.amount.coin
+            < self.collateral_amount + 10000000
+        )
+
+
+@dataclass
+class ConsolidationTx:
+    """One merge transaction: its inputs and outputs besides the change."""
+
+    inputs: List[UTxO]
+    outputs: List[TransactionOutput] = field(default_factory=list)
+
+    @property
+    def coin(self) -> int:
+        return sum(utxo.output.amount.coin for utxo in self.inputs)
+
+    @property
+    def estimated_size(self) -> int:
+        return (
+            BASE_TX_BYTES
+            + CHANGE_BYTES
+            + INPUT_BYTES * len(self.inputs)
+            + sum(
+                OUTPUT_BYTES + ASSET_BYTES * _asset_count(output.amount)
+                for output in self.outputs
+            )
+        )
+
+
+@dataclass
+class ConsolidationPlan:
+    """Transactions consolidating a wallet.
+
+    Attributes:
+        address: The wallet address.
+        utxos: UTxOs of the wallet that were considered.
+        kept: UTxOs left as they are.
+        transactions: The merge transactions, spending distinct inputs.
+        final: Whether the wallet meets the policy once they are confirmed;
+            otherwise another round is needed.
+    """
+
+    address: str
+    utxos: int
+    kept: int
+    transactions: List[ConsolidationTx]
+    final: bool
+
+    @property
+    def utxos_after(self) -> int:
+        """UTxOs left once every transaction is confirmed."""
+        return self.kept + sum(len(tx.outputs) + 1 for tx in self.transactions)
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "address": self.address,
+            "utxos_before": self.utxos,
+            "utxos_after": self.utxos_after,
+            "transactions": len(self.transactions),
+            "inputs": sum(len(tx.inputs) for tx in self.transactions),
+            "final": self.final,
+        }
+
+
+def _asset_count(value: Value) -> int:
+    return sum(len(asset) for asset in value.multi_asset.values())
+
+
+def _policies(utxo: UTxO) -> Set[ScriptHash]:
+    return {
+        policy_id
+        for policy_id, asset in utxo.output.amount.multi_asset.items()
+        if any(asset.values())
+    }
+
+
+def _split(
+    address: Address,
+    tokens: MultiAsset,
+    parts: int,
+    max_assets: int,
+    context,
+) -> List[TransactionOutput]:
+    """Outputs spreading ``tokens`` over ``parts`` shares with minimum ADA."""
+    outputs = []
+    for policy_id, asset in tokens.items():
+        names = sorted(asset, key=lambda name: name.payload)
+        for start in range(0, len(names), max_assets):
+            chunk = names[start : start + max_assets]
+            for part in range(parts):
+                share = Asset()
+                for name in chunk:
+                    quantity = asset[name] // parts + (part < asset[name] % parts)
+                    if quantity:
+                        share[name] = quantity
+                if not share:
+                    continue
+                output = TransactionOutput(
+                    address, Value(0, MultiAsset({policy_id: share}))
+                )
+                output.amount.coin = min_lovelace_post_alonzo(output, context)
+                outputs.append(output)
+    return outputs
+
+
+def plan_consolidation(
+    utxos: Iterable[UTxO],
+    address: Union[str, Address],
+    context,
+    policy: ConsolidationPolicy,
+    exclude: Iterable[TransactionInput] = (),
+) -> ConsolidationPlan:
+    """Plan the transactions consolidating the UTxOs of a wallet.
+
+    Args:
+        utxos: The UTxOs of the wallet.
+        address: The wallet address, which receives every output.
+        context: Chain context providing the protocol parameters.
+        policy: What the consolidated wallet holds.
+        exclude: Inputs to leave alone, e.g. the ones in flight.
+
+    Returns:
+        ConsolidationPlan: The plan, without transactions when there is
+        nothing to do.
+    """
+    address = Address.from_primitive(str(address))
+    excluded = set(exclude)
+    utxos = [utxo for utxo in utxos if utxo.input not in excluded]
+    movable = [
+        utxo
+        for utxo in utxos
+        if utxo.output.datum is None
+        and utxo.output.datum_hash is None
+        and utxo.output.script is None
+    ]
+
+    # Collateral closest to the requested amount is kept.
+    collateral = sorted(
+        (utxo for utxo in movable if policy.collateral_ready(utxo)),
+        key=lambda utxo: abs(utxo.output.amount.coin - policy.collateral_amount),
+    )[: policy.collateral_utxos]
+    missing_collateral = policy.collateral_utxos - len(collateral)
+    kept = {utxo.input for utxo in collateral}
+
+    # A policy is off target when it is spread over more UTxOs than asked,
+    # or over fewer while it has enough tokens to fill them.
+    holders: Dict[ScriptHash, int] = defaultdict(int)
+    smallest: Dict[ScriptHash, int] = {}
+    tokens = MultiAsset()
+    for utxo in movable:
+        for policy_id in _policies(utxo):
+            holders[policy_id] += 1
+        tokens += utxo.output.amount.multi_asset
+    for policy_id, asset in tokens.items():
+        smallest[policy_id] = min(asset.values(), default=0)
+    off_target = {
+        p
+        for p, count in holders.items()
+        if count > policy.token_utxos
+        or (count < policy.token_utxos and smallest[p] >= policy.token_utxos)
+    }
+    token_inputs = [
+        utxo
+        for utxo in movable
+        if utxo.input not in kept and _policies(utxo) & off_target
+    ]
+    ada_inputs = sorted(
+        (
+            utxo
+            for utxo in movable
+            if utxo.input not in kept and not utxo.output.amount.multi_asset
+        ),
+        key=lambda utxo: -utxo.output.amount.coin,
+    )
+
+    nothing_to_merge = not token_inputs and len(ada_inputs) < 2
+    if (len(utxos) <= policy.min_utxos or nothing_to_merge) and not (
+        missing_collateral and ada_inputs
+    ):
+        return ConsolidationPlan(str(address), len(utxos), len(utxos), [], True)
+
+    # Inputs of a policy go together so that each transaction produces as
+    # few token outputs as possible; lovelace follows, largest first.
+    token_inputs.sort(
+        key=lambda utxo: sorted(p.payload for p in _policies(utxo)),
+    )
+    size_limit = context.protocol_param.max_tx_size
+    chunks: List[ConsolidationTx] = []
+    for utxo in token_inputs + ada_inputs:
+        tx = chunks[-1] if chunks else None
+        grows = ASSET_BYTES * _asset_count(utxo.output.amount)
+        if (
+            tx is None
+            or len(tx.inputs) >= policy.max_inputs
+            or tx.estimated_size + INPUT_BYTES + OUTPUT_BYTES + grows > size_limit
+        ):
+            tx = ConsolidationTx([])
+            chunks.append(tx)
+        tx.inputs.append(utxo)
+
+    final = len(chunks) == 1
+    parts = policy.token_utxos if final else 1
+    fee = context.protocol_param.min_fee_constant
+    transactions = []
+    for tx in chunks:
+        tokens = MultiAsset()
+        for utxo in tx.inputs:
+            tokens += utxo.output.amount.multi_asset
+        tokens = tokens.filter(lambda p, n, quantity: quantity > 0)
+        tx.outputs = _split(
+            address, tokens, parts, policy.max_assets_per_output, context
+        )
+        # Keep the fee and a change output's minimum ADA besides the outputs.
+        needed = sum(o.amount.coin for o in tx.outputs) + 2 * fee + 1000000
+        if tx.coin < needed:
+            logger.info("Not enough lovelace to merge %d inputs", len(tx.inputs))
+            final = False
+            continue
+        transactions.append(tx)
+
+    if missing_collateral:
+        collateral_total = missing_collateral * policy.collateral_amount
+        richest = max(
+            transactions,
+            key=lambda tx: tx.coin - sum(o.amount.coin for o in tx.outputs),
+            default=None,
+        )
+        spare = (
+            richest.coin - sum(o.amount.coin for o in richest.outputs) - 2 * fee
+            if richest
+            else 0
+        )
+        if spare >= collateral_total + 1000000:
+            richest.outputs.extend(
+                TransactionOutput(address, policy.collateral_amount)
+                for _ in range(missing_collateral)
+            )
+        else:
+            final = False
+
+    moved = sum(len(tx.inputs) for tx in transactions)
+    return ConsolidationPlan(
+        str(address), len(utxos), len(utxos) - moved, transactions, final
+    )
+
+
+class Consolidator:
+    """Plans and submits the consolidation of a wallet.
+
+    Attributes:
+        chain_query: Chain access, in-flight inputs and balance indexes.
+        address: The wallet address.
+        signing_key: Key of the wallet.
+        policy: What the consolidated wallet holds.
+    """
+
+    def __init__(
+        self,
+        chain_query: "ChainQuery",
+        address: Address,
+        signing_key: Union[PaymentSigningKey, ExtendedSigningKey],
+        policy: Optional[ConsolidationPolicy] = None,
+    ) -> None:
+        self.chain_query = chain_query
+        self.address = address
+        self.signing_key = signing_key
+        self.policy = policy or ConsolidationPolicy()
+
+    async def plan(self) -> ConsolidationPlan:
+        """Plan the next round from the wallet's current UTxOs."""
+        chain_query = self.chain_query
+        utxos = await chain_query.get_utxos(str(self.address))
+        exclude = set(chain_query.in_flight_inputs)
+        if chain_query.coin_selector is not None:
+            exclude.update(chain_query.coin_selector.reserved())
+        return plan_consolidation(
+            utxos, self.address, chain_query.context, self.policy, exclude
+        )
+
+    async def run(self, dry_run: bool = False) -> List[Dict[str, object]]:
+        """Consolidate the wallet, round after round.
+
+        Args:
+            dry_run: Only plan the first round.
+
+        Returns:
+            List[Dict[str, object]]: Summary of each round, with the status
+            of its transactions.
+        """
+        rounds = []
+        # Consolidation is background work: it yields Blockfrost tokens to
+        # trades.
+        with request_budget("consolidate", background=True):
+            for _ in range(self.policy.max_rounds):
+                plan = await self.plan()
+                summary = plan.summary()
+                rounds.append(summary)
+                if dry_run or not plan.transactions:
+                    break
+                summary["status"] = await self._execute(plan)
+                if plan.final or "success" not in summary["status"]:
+                    break
+        return rounds
+
+    async def _execute(self, plan: ConsolidationPlan) -> List[str]:
+        """Submit the transactions of a round and wait for all of them."""
+        chain_query = self.chain_query
+        submitted, failed = [], []
+        with metrics.span("consolidation.round", transactions=len(plan.transactions)):
+            # The transactions spend disjoint inputs, so they are built at
+            # once and a build pool can sign them in parallel.
+            built = await asyncio.gather(
+                *(self._build(planned) for planned in plan.transactions),
+                return_exceptions=True,
+            )
+            for planned, tx in zip(plan.transactions, built):
+                try:
+                    if isinstance(tx, Exception):
+                        raise tx
+                    await chain_query.submit_tx(tx)
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.warning("Consolidation transaction failed: %s", err)
+                    failed.append(f"error: {err}")
+                    continue
+                metrics.inc("consolidation_inputs", len(planned.inputs))
+                submitted.append(tx)
+
+            async def confirm(tx) -> str:
+                try:
+                    status, _ = await chain_query.wait_for_tx(str(tx.id))
+                finally:
+                    chain_query.release_inputs(tx)
+                return status
+
+            statuses = await asyncio.gather(*(confirm(tx) for tx in submitted))
+        return list(statuses) + failed
+
+    async def _build(self, planned: ConsolidationTx) -> Transaction:
+        builder = TransactionBuilder(self.chain_query.context)
+        for utxo in planned.inputs:
+            builder.add_input(utxo)
+        for output in planned.outputs:
+            builder.add_output(output)
+        return await self.chain_query.build_and_sign(
+            builder, self.signing_key, self.address
+        )
+
+
+def print_rounds(rounds: List[Dict[str, object]]) -> None:
+    """Print the summaries returned by ``Consolidator.run``."""
+    for number, summary in enumerate(rounds, 1):
+        if not summary["transactions"]:
+            print(f"Wallet has {summary['utxos_before']} UTxOs, nothing to merge.")
+            continue
+        print(
+            f"Round {number}: {summary['inputs']} UTxOs merged in "
+            f"{summary['transactions']} transaction(s), "
+            f"{summary['utxos_before']} -> {summary['utxos_after']} UTxOs"
+            + ("" if summary["final"] else " (more rounds needed)")
+        )
+        for status in summary.get("status", []):
+            print(f"- {status}")
@@ -0,0 +1,135 @@
+"""Recognise and recover from trades losing the race for the swap UTxO.
+
+Every trade spends the single swap UTxO, so two trades built from the same
+snapshot cannot both be accepted: the node rejects the later one because one
+of its inputs no longer exists. The message reads differently per backend
+(``BadInputsUTxO`` from the ledger through Blockfrost and the simulator,
+``unknownOutputReferences`` from Ogmios), but it names the missing inputs, so
+the caller can refresh just the UTxOs that went stale and try again.
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Tuple
+
+from pycardano import UTxO
+
+CONTENTION_ERRORS = (
+    "BadInputsUTxO",
+    "UnknownOutputReferences",
+    "unknownOutputReferences",
+    "already been spent",
+)
+
+
+class SlippageExceeded(Exception):
+    """A re-quote moved further from the first quote than the policy allows."""
+
+
+def is_contention_error(err: BaseException) -> bool:
+    """Whether ``err`` rejects a transaction for spending a missing input."""
+    message = str(err)
+    return any(pattern in message for pattern in CONTENTION_ERRORS)
+
+
+def _reference_patterns(utxo: UTxO) -> Tuple[str, ...]:
+    """Ways the backends write the output reference of ``utxo``."""
+    tx_id = re.escape(str(utxo.input.transaction_id))
+    index = str(utxo.input.index)
+    return (
+        # txid#index, as the simulator writes it.
+        tx_id + "#" + index + r"\b",
+        # The ledger's TxIn through Blockfrost:
+        # SafeHash "txid"}) (TxIx 0), or (TxIx {unTxIx = 0}).
+        tx_id + r'\\*"\}\)\s*\(TxIx\s+(?:\{unTxIx = )?' + index + r"\b",
+        # Ogmios: {"transaction":{"id":"txid"},"index":0} in v6,
+        # {"txId":"txid","index":0} in v5.
+        tx_id + r'\\*"\s*\}?\s*,\s*\\*"index\\*"\s*:\s*' + index + r"\b",
+    )
+
+
+def names_utxo(err: BaseException, utxo: UTxO) -> bool:
+    """Whether the message of ``err`` refers to ``utxo`` itself.
+
+    Both the transaction id and the output index must match: the swap
+    output and the trader's change of the same transaction share the id.
+    """
+    message = str(err)
+    return any(
+        re.search(pattern, message, re.IGNORECASE)
+        for pattern in _reference_patterns(utxo)
+    )
+
+
+def check_slippage(quoted: int, requoted: int, slippage: float) -> None:
+    """Raise ``SlippageExceeded`` if ``requoted`` is too far from ``quoted``.
+
+    Args:
+        quoted (int): Amount out of the first quote.
+        requoted (int): Amount out of the new quote.
+        slippage (float): Largest accepted relative change, e.g. 0.01.
+    """
+    if abs(requoted - quoted) > quoted * slippage:
+        raise SlippageExceeded(
+            f"Quote moved from {quoted} to {requoted}, over {slippage:.2%}."
+        )
+
+
+@dataclass
+class ContentionPolicy:
+    """How a trade is retried after losing the swap UTxO to another trade.
+
+    Attributes:
+        max_retries: Rebuilds after the first attempt.
+        slippage: Largest relative change of the amount out accepted when
+            the oracle feed moved and the trade is re-quoted.
+        refresh_timeout: Seconds to wait for the UTxO replacing a spent one
+            to be visible.
+        poll_interval: Seconds between queries while waiting.
+    """
+
+    max_retries: int = 3
+    slippage: float = 0.01
+    refresh_timeout: float = 60.0
+    poll_interval: float = 2.0
+
+    @classmethod
+    def from_config(cls, settings: Optional[dict]) -> "ContentionPolicy":
+        """Policy from the ``contention`` section of ``config.yaml``."""
+        settings = settings or {}
+        defaults = cls()
+        return cls(
+            **{
+                name: type(getattr(defaults, name))(
+                    settings.get(name, getattr(defaults, name))
+                )
+                for name in cls.__dataclass_fields__  # pylint: disable=no-member
+            }
+        )
+
+
+async def replacement(
+    fetch: Callable[[], Awaitable[UTxO]],
+    stale: UTxO,
+    policy: ContentionPolicy,
+) -> Optional[UTxO]:
+    """Poll ``fetch`` until it returns a UTxO other than ``stale``.
+
+    Args:
+        fetch: Query returning the current UTxO, e.g. ``get_swap_utxo``.
+        stale (UTxO): The UTxO known to be spent.
+        policy (ContentionPolicy): Timeout and polling interval.
+
+    Returns:
+        Optional[UTxO]: The new UTxO, None if it did not show up in time.
+    """
+    deadline = time.monotonic() + policy.refresh_timeout
+    while True:
+        utxo = await fetch()
+        if utxo.input != stale.input:
+            return utxo
+        if time.monotonic() + policy.poll_interval > deadline:
+            return None
+        await asyncio.sleep(policy.poll_interval)
@@ -153,10 +153,14 @@ class DynamicRewardsMixin:
 
     async def _get_aggstate_utxo_and_datum(self) -> Tuple[UTxO, AggDatum]:
         """Get aggstate utxo and datum."""
-        oracle_utxos = await self.chain_query.get_utxos(self.oracle_addr)
-        aggstate_utxo: UTxO = self.filter_utxos_by_asset(
-            oracle_utxos, self.aggstate_nft
-        )[0]
+        aggstate_utxo: UTxO = await self.chain_query.find_utxo(
+            self.oracle_addr,
+            lambda utxo: utxo.output.amount.multi_asset >= self.aggstate_nft,
+            reference_scripts=False,
+            holding=self.aggstate_nft,
+        )
+        if aggstate_utxo is None:
+            raise ValueError("No aggstate UTxO found at the oracle address")
 
         if aggstate_utxo.output.datum and not isinstance(
             aggstate_utxo.output.datum, AggDatum
@@ -0,0 +1,284 @@
+"""Follow the oracle feed and report each update once, as it is seen.
+
+An update of the feed spends the feed UTxO and creates a new one holding the
+oracle NFT. A ``FeedWatcher`` asks its source every ``interval`` seconds
+whether that happened, with the cheapest query the backend offers, and only
+then fetches and decodes the new datum:
+
+* ``KupoFeedSource`` asks Kupo for the feed outputs created after the slot
+  of the last one seen, which is an empty list until the feed moves.
+* ``BlockfrostFeedSource`` reads the latest transaction of the oracle NFT,
+  one entry, at background priority.
+* ``SimulatorFeedSource`` looks the feed UTxO up in memory.
+
+Each ``FeedUpdate`` carries the POSIX time of the block that created the
+output, so the delay between the update and its report can be measured.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from pycardano import MultiAsset, Network, RawCBOR, UTxO
+
+from .datums import GenericData
+from .ratelimit import request_budget
+from .simulator import SLOT_ZERO_POSIX
+
+if TYPE_CHECKING:
+    from blockfrost import BlockFrostApi
+
+    from ..swap import SwapContract
+    from .kupo import KupoContext
+    from .simulator import LedgerSimulator
+
+logger = logging.getLogger("feed_watch")
+
+
+@dataclass(frozen=True)
+class FeedUpdate:
+    """One state of the oracle feed.
+
+    Attributes:
+        tx_id: Transaction that created the feed output (hex).
+        output_index: Index of the feed output.
+        price: Price of the datum, scaled by 1000000.
+        timestamp: Timestamp of the datum, POSIX milliseconds.
+        expiry: Expiry of the datum, POSIX milliseconds.
+        slot: Slot of the block that created the output, if known.
+        onchain_at: POSIX time of that block in seconds, if known.
+        seen_at: POSIX time the update was seen, in seconds.
+    """
+
+    tx_id: str
+    output_index: int
+    price: int
+    timestamp: int
+    expiry: int
+    slot: Optional[int]
+    onchain_at: Optional[float]
+    seen_at: float
+
+    @property
+    def lag(self) -> Optional[float]:
+        """Seconds between the block creating the output and the report."""
+        if self.onchain_at is None:
+            return None
+        return self.seen_at - self.onchain_at
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "lag": self.lag}
+
+
+def decode_update(
+    tx_id: str,
+    output_index: int,
+    datum_cbor: Optional[bytes],
+    slot: Optional[int],
+    onchain_at: Optional[float],
+) -> Optional[FeedUpdate]:
+    """The update held by a feed output, None if its datum cannot be read."""
+    seen_at = time.time()
+    if not datum_cbor:
+        logger.warning("Feed output %s#%s has no datum", tx_id, output_index)
+        return None
+    try:
+        price_data = GenericData.from_cbor(datum_cbor).price_data
+    except Exception as err:  # pylint: disable=broad-except
+        logger.warning("Cannot decode feed output %s#%s: %s", tx_id, output_index, err)
+        return None
+    return FeedUpdate(
+        tx_id,
+        output_index,
+        price_data.get_price(),
+        price_data.get_timestamp(),
+        price_data.get_expiry(),
+        slot,
+        onchain_at,
+        seen_at,
+    )
+
+
+class FeedSource(ABC):
+    """Tells whether the feed moved since the last poll."""
+
+    @abstractmethod
+    async def poll(self) -> Optional[FeedUpdate]:
+        """The feed's state if it changed since the last call, else None.
+
+        The first call returns the current state.
+        """
+
+
+class KupoFeedSource(FeedSource):
+    """Feed outputs created after the last one seen, from Kupo."""
+
+    def __init__(
+        self,
+        kupo: "KupoContext",
+        oracle_address: str,
+        oracle_nft: MultiAsset,
+        network: Network,
+    ) -> None:
+        self.kupo = kupo
+        self.oracle_address = oracle_address
+        ((policy_id, assets),) = oracle_nft.items()
+        ((asset_name, _),) = assets.items()
+        self.policy_id = policy_id.payload.hex()
+        self.asset_name = asset_name.payload.hex()
+        self.slot_zero = SLOT_ZERO_POSIX.get(network, 0)
+        self.last_slot: Optional[int] = None
+
+    async def poll(self) -> Optional[FeedUpdate]:
+        latest = None
+        async for output in self.kupo.iter_matches_kupo(
+            self.oracle_address,
+            created_after=self.last_slot,
+            policy_id=self.policy_id,
+            asset_name=self.asset_name,
+        ):
+            if latest is None or output.created_at > latest.created_at:
+                latest = output
+        if latest is None:
+            return None
+        self.last_slot = latest.created_at
+        datum = await latest.datum()
+        return decode_update(
+            latest.tx_id,
+            latest.index,
+            datum.cbor if datum is not None else None,
+            latest.created_at,
+            latest.created_at + self.slot_zero,
+        )
+
+
+class BlockfrostFeedSource(FeedSource):
+    """The latest transaction of the oracle NFT, from Blockfrost.
+
+    The feed UTxO is only fetched when that transaction changes.
+    """
+
+    def __init__(
+        self,
+        api: "BlockFrostApi",
+        swap_contract: "SwapContract",
+        network: Network,
+    ) -> None:
+        self.api = api
+        self.swap_contract = swap_contract
+        ((policy_id, assets),) = swap_contract.oracle_nft.items()
+        ((asset_name, _),) = assets.items()
+        self.unit = policy_id.payload.hex() + asset_name.payload.hex()
+        self.slot_zero = SLOT_ZERO_POSIX.get(network, 0)
+        self.last_tx: Optional[str] = None
+
+    async def poll(self) -> Optional[FeedUpdate]:
+        with request_budget("feed_watch", background=True):
+            (latest,) = await asyncio.to_thread(
+                self.api.asset_transactions,
+                self.unit,
+                count=1,
+                page=1,
+                order="desc",
+            )
+            if latest.tx_hash == self.last_tx:
+                return None
+            utxo = await self.swap_contract.get_oracle_utxo()
+        tx_id = str(utxo.input.transaction_id)
+        if tx_id != latest.tx_hash:
+            # The new output is not visible yet; look again next time.
+            return None
+        self.last_tx = latest.tx_hash
+        return decode_update(
+            tx_id,
+            utxo.input.index,
+            _datum_cbor(utxo),
+            latest.block_time - self.slot_zero,
+            latest.block_time,
+        )
+
+
+class SimulatorFeedSource(FeedSource):
+    """The feed UTxO of the ledger simulator."""
+
+    def __init__(
+        self, simulator: "LedgerSimulator", swap_contract: "SwapContract"
+    ) -> None:
+        self.simulator = simulator
+        self.swap_contract = swap_contract
+        self.last: Optional[UTxO] = None
+
+    async def poll(self) -> Optional[FeedUpdate]:
+        utxo = await self.swap_contract.get_oracle_utxo()
+        if self.last is not None and utxo.input == self.last.input:
+            return None
+        self.last = utxo
+        slot = self.simulator.confirmed_slot(utxo.input.transaction_id)
+        return decode_update(
+            str(utxo.input.transaction_id),
+            utxo.input.index,
+            _datum_cbor(utxo),
+            slot,
+            self.simulator.posix_time(slot) if slot is not None else None,
+        )
+
+
+def _datum_cbor(utxo: UTxO) -> Optional[bytes]:
+    datum = utxo.output.datum
+    if datum is None:
+        return None
+    if isinstance(datum, RawCBOR):
+        return datum.cbor
+    return datum.to_cbor()
+
+
+class FeedWatcher:
+    """Polls a ``FeedSource`` and yields the feed's updates.
+
+    Attributes:
+        source: Where the feed is read from.
+        interval: Seconds between polls.
+    """
+
+    def __init__(self, source: FeedSource, interval: float = 2.0) -> None:
+        self.source = source
+        self.interval = interval
+
+    async def updates(self) -> AsyncIterator[FeedUpdate]:
+        """Yield the current feed, then each update, until cancelled.
+
+        A failed poll is logged and retried at the next interval.
+        """
+        while True:
+            try:
+                update = await self.source.poll()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Polling the oracle feed failed")
+                update = None
+            if update is not None:
+                yield update
+            await asyncio.sleep(self.interval)
+
+
+def _utc(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def print_update(update: FeedUpdate, as_json: bool = False) -> None:
+    """Print ``update`` on one line, as text or as a JSON object."""
+    if as_json:
+        print(json.dumps(update.to_dict()), flush=True)
+        return
+    lag = f"{update.lag:.1f} s" if update.lag is not None else "unknown"
+    print(
+        f"{_utc(update.seen_at)}  price {update.price / 1000000:.6f}  "
+        f"timestamp {_utc(update.timestamp / 1000)}  "
+        f"expiry {_utc(update.expiry / 1000)}  slot {update.slot}  "
+        f"seen after {lag}",
+        flush=True,
+    )
@@ -1,6 +1,7 @@
 """Kupo context to query on-chain data"""
 
-from typing import Any, List, Optional, Tuple, Union
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import cbor2
 import pycardano as pyc
@@ -8,14 +9,22 @@ from cachetools import LRUCache
 from pycardano.hash import TransactionId
 
 from swap_demo_contract.lib.api import Api
+from swap_demo_contract.lib.metrics import metrics
+from swap_demo_contract.lib.scripts import ScriptRegistry
+
+if TYPE_CHECKING:
+    from .utxo_table import UTxOTable
 
 
 class KupoContext(Api):
     """Kupo Class"""
 
-    def __init__(self, kupo_url):
+    service = "kupo"
+
+    def __init__(self, kupo_url, script_registry: Optional[ScriptRegistry] = None):
         self.api_url = kupo_url
         self.datum_cache = LRUCache(maxsize=100)
+        self.script_registry = script_registry
 
     def _try_fix_script(
         self, scripth: str, script: Union[pyc.PlutusV1Script, pyc.PlutusV2Script]
@@ -57,7 +66,9 @@ class KupoContext(Api):
         datum = self.datum_cache.get(datum_hash, None)
 
         if datum is not None:
+            metrics.inc("cache_hits", cache="kupo_datum")
             return datum
+        metrics.inc("cache_misses", cache="kupo_datum")
 
         if self.api_url is None:
             raise AssertionError(
@@ -69,6 +80,7 @@ class KupoContext(Api):
         datum_result = result.json
         if datum_result and datum_result["datum"] != datum_hash:
             datum = pyc.RawCBOR(bytes.fromhex(datum_result["datum"]))
+            metrics.inc("bytes_decoded", len(datum.cbor), kind="datum")
 
         self.datum_cache[datum_hash] = datum
         return datum
@@ -163,71 +175,277 @@ class KupoContext(Api):
 
         return utxos
 
+    async def iter_utxos_kupo(
+        self,
+        address: str,
+        policy_id: Optional[str] = None,
+        asset_name: Optional[str] = None,
+    ) -> AsyncIterator["KupoOutput"]:
+        """Yield the unspent outputs of an address as Kupo sends them.
+
+        The outputs are yielded as ``KupoOutput`` views of the JSON, parsed
+        while the response is still arriving. The filters are applied by
+        Kupo and checked again on each view.
+
+        Args:
+            address (str): An address encoded with bech32.
+            policy_id (str, optional): Only outputs holding a token of this
+                policy (hex).
+            asset_name (str, optional): With ``policy_id``, only outputs
+                holding this asset name (hex).
+
+        Yields:
+            KupoOutput: A view of each matching output.
+        """
+        async with aclosing(
+            self.iter_matches_kupo(address, "unspent", None, policy_id, asset_name)
+        ) as outputs:
+            async for output in outputs:
+                yield output
+
+    async def iter_matches_kupo(
+        self,
+        address: str,
+        status: Optional[str] = "unspent",
+        created_after: Optional[int] = None,
+        policy_id: Optional[str] = None,
+        asset_name: Optional[str] = None,
+    ) -> AsyncIterator["KupoOutput"]:
+        """Yield the outputs of an address as Kupo sends them.
+
+        Like ``iter_utxos_kupo``, for spent outputs as well.
+
+        Args:
+            address (str): An address encoded with bech32.
+            status (str, optional): ``unspent``, ``spent``, or None for both.
+            created_after (int, optional): Only outputs created after this
+                slot.
+            policy_id (str, optional): Only outputs holding a token of this
+                policy (hex).
+            asset_name (str, optional): With ``policy_id``, only outputs
+                holding this asset name (hex).
+
+        Yields:
+            KupoOutput: A view of each matching output, most recent first.
+        """
+        if self.api_url is None:
+            raise AssertionError(
+                "api_url object attribute has not been assigned properly."
+            )
+
+        params = [status] if status else []
+        if created_after is not None:
+            params.append(f"created_after={created_after}")
+        if policy_id is not None:
+            params.append(f"policy_id={policy_id}")
+            if asset_name:
+                params.append(f"asset_name={asset_name}")
+        kupo_utxo_url = "/matches/" + address
+        if params:
+            kupo_utxo_url += "?" + "&".join(params)
+        async for result in self._stream(path=kupo_utxo_url):
+            output = KupoOutput(self, address, result)
+            if policy_id is None or output.holds(policy_id, asset_name):
+                yield output
+
+    async def find_utxo_kupo(
+        self,
+        address: str,
+        policy_id: str,
+        asset_name: Optional[str] = None,
+    ) -> Optional[pyc.UTxO]:
+        """First unspent output of an address holding a token, such as an NFT.
+
+        Only the matching output is decoded, and the response is not read
+        further once it is found.
+
+        Args:
+            address (str): An address encoded with bech32.
+            policy_id (str): Policy id of the token (hex).
+            asset_name (str, optional): Asset name of the token (hex).
+
+        Returns:
+            Optional[UTxO]: The output, None if there is none.
+        """
+        async with aclosing(
+            self.iter_utxos_kupo(address, policy_id, asset_name)
+        ) as outputs:
+            async for output in outputs:
+                return await output.to_utxo()
+        return None
+
+    async def utxo_table_kupo(self, address: str) -> "UTxOTable":
+        """Get the unspent outputs of an address as a ``UTxOTable``.
+
+        The table is filled while Kupo's response is read, without building
+        pycardano objects. Inline datums are kept by hash.
+
+        Args:
+            address (str): An address encoded with bech32.
+
+        Returns:
+            UTxOTable: The outputs, in Kupo's order.
+        """
+        from .utxo_table import UTxOTableBuilder  # pylint: disable=C0415
+
+        builder = UTxOTableBuilder()
+        async for result in self._stream(path="/matches/" + address + "?unspent"):
+            builder.add_kupo(result)
+        metrics.inc("utxos_tabulated", len(builder), backend="kupo")
+        return builder.build()
+
+    @metrics.timed("kupo.unpack_outputs")
     async def _unpack_outputs(
         self, address: str, api_response: List[Any]
     ) -> List[Tuple[pyc.UTxO, int]]:
-        utxos: List[Tuple[pyc.UTxO, int]] = []
-
-        for result in api_response:
-            tx_id = result["transaction_id"]
-            index = result["output_index"]
-
-            created_at_slot = result["created_at"]["slot_no"]
-
-            tx_in = pyc.TransactionInput.from_primitive([tx_id, index])
-
-            lovelace_amount = result["value"]["coins"]
-
-            script = None
-            script_hash = result.get("script_hash", None)
-            if script_hash:
-                kupo_script_url = "/scripts/" + script_hash
-                script_resp = await self._get(path=kupo_script_url)
-                script = script_resp.json
-                if script["language"] == "plutus:v2":
-                    script = pyc.PlutusV2Script(bytes.fromhex(script["script"]))  # noqa
-                    script = self._try_fix_script(script_hash, script)
-                elif script["language"] == "plutus:v1":
-                    script = pyc.PlutusV1Script(bytes.fromhex(script["script"]))  # noqa
-                    script = self._try_fix_script(script_hash, script)
-                else:
-                    raise ValueError("Unknown plutus script type")
-
-            datum = None
-            datum_hash = (
-                pyc.DatumHash.from_primitive(result["datum_hash"])
-                if result["datum_hash"]
-                else None
+        metrics.inc("utxos_decoded", len(api_response), backend="kupo")
+        return [await self._unpack_output(address, result) for result in api_response]
+
+    async def _unpack_output(
+        self, address: str, result: Dict[str, Any]
+    ) -> Tuple[pyc.UTxO, int]:
+        tx_id = result["transaction_id"]
+        index = result["output_index"]
+
+        created_at_slot = result["created_at"]["slot_no"]
+
+        tx_in = pyc.TransactionInput.from_primitive([tx_id, index])
+
+        lovelace_amount = result["value"]["coins"]
+
+        script = None
+        script_hash = result.get("script_hash", None)
+        if script_hash and self.script_registry is not None:
+            script = self.script_registry.by_hash(
+                pyc.ScriptHash.from_primitive(script_hash)
             )
-            if datum_hash and result.get("datum_type", "inline"):
-                datum = await self._get_datum_from_kupo(result["datum_hash"])
-                if datum:
-                    datum_hash = None
-
-            if not result["value"]["assets"]:
-                tx_out = pyc.TransactionOutput(
-                    pyc.Address.from_primitive(address),
-                    amount=lovelace_amount,
-                    datum_hash=datum_hash,
-                    datum=datum,
-                    script=script,
-                )
+            if script is not None:
+                metrics.inc("cache_hits", cache="script_registry")
+        if script_hash and script is None:
+            metrics.inc("cache_misses", cache="script_registry")
+            kupo_script_url = "/scripts/" + script_hash
+            script_resp = await self._get(path=kupo_script_url)
+            script = script_resp.json
+            metrics.inc("bytes_decoded", len(script["script"]) // 2, kind="script")
+            if script["language"] == "plutus:v2":
+                script = pyc.PlutusV2Script(bytes.fromhex(script["script"]))  # noqa
+                script = self._try_fix_script(script_hash, script)
+            elif script["language"] == "plutus:v1":
+                script = pyc.PlutusV1Script(bytes.fromhex(script["script"]))  # noqa
+                script = self._try_fix_script(script_hash, script)
             else:
-                multi_assets = pyc.MultiAsset()
-
-                for asset, quantity in result["value"]["assets"].items():
-                    policy_hex, policy, asset_name_hex = self._extract_asset_info(asset)
-                    multi_assets.setdefault(policy, pyc.Asset())[
-                        asset_name_hex
-                    ] = quantity
-
-                tx_out = pyc.TransactionOutput(
-                    pyc.Address.from_primitive(result["address"]),
-                    amount=pyc.Value(lovelace_amount, multi_assets),
-                    datum_hash=datum_hash,
-                    datum=datum,
-                    script=script,
-                )
-            utxos.append((pyc.UTxO(tx_in, tx_out), created_at_slot))
+                raise ValueError("Unknown plutus script type")
 
-        return utxos
+        datum = None
+        datum_hash = (
+            pyc.DatumHash.from_primitive(result["datum_hash"])
+            if result["datum_hash"]
+            else None
+        )
+        if datum_hash and result.get("datum_type", "inline"):
+            datum = await self._get_datum_from_kupo(result["datum_hash"])
+            if datum:
+                datum_hash = None
+
+        if not result["value"]["assets"]:
+            tx_out = pyc.TransactionOutput(
+                pyc.Address.from_primitive(address),
+                amount=lovelace_amount,
+                datum_hash=datum_hash,
+                datum=datum,
+                script=script,
+            )
+        else:
+            multi_assets = pyc.MultiAsset()
+
+            for asset, quantity in result["value"]["assets"].items():
+                policy_hex, policy, asset_name_hex = self._extract_asset_info(asset)
+                multi_assets.setdefault(policy, pyc.Asset())[asset_name_hex] = quantity
+
+            tx_out = pyc.TransactionOutput(
+                pyc.Address.from_primitive(result["address"]),
+                amount=pyc.Value(lovelace_amount, multi_assets),
+                datum_hash=datum_hash,
+                datum=datum,
+                script=script,
+            )
+        return pyc.UTxO(tx_in, tx_out), created_at_slot
+
+
+class KupoOutput:
+    """Lightweight view of one output in a Kupo ``/matches`` response.
+
+    The coin, assets and transaction input are read straight from the JSON;
+    the pycardano ``UTxO``, with its address, value, datum and script, is
+    only built by ``to_utxo``.
+    """
+
+    __slots__ = ("_context", "_address", "raw")
+
+    def __init__(self, context: KupoContext, address: str, raw: Dict[str, Any]):
+        self._context = context
+        self._address = address
+        self.raw = raw
+
+    @property
+    def tx_id(self) -> str:
+        return self.raw["transaction_id"]
+
+    @property
+    def index(self) -> int:
+        return self.raw["output_index"]
+
+    @property
+    def input(self) -> pyc.TransactionInput:
+        return pyc.TransactionInput.from_primitive([self.tx_id, self.index])
+
+    @property
+    def coin(self) -> int:
+        return self.raw["value"]["coins"]
+
+    @property
+    def assets(self) -> Dict[str, int]:
+        """Quantities by ``policy_id.asset_name`` (hex, no dot when unnamed)."""
+        return self.raw["value"]["assets"]
+
+    @property
+    def created_at(self) -> int:
+        return self.raw["created_at"]["slot_no"]
+
+    @property
+    def datum_hash(self) -> Optional[str]:
+        return self.raw["datum_hash"]
+
+    @property
+    def script_hash(self) -> Optional[str]:
+        return self.raw.get("script_hash")
+
+    async def datum(self) -> Optional[pyc.RawCBOR]:
+        """The output's datum, fetched from Kupo (cached), if it has one."""
+        if not self.datum_hash:
+            return None
+        return await self._context._get_datum_from_kupo(  # pylint: disable=W0212
+            self.datum_hash
+        )
+
+    def quantity(self, policy_id: str, asset_name: str = "") -> int:
+        """Quantity held of one asset."""
+        unit = f"{policy_id}.{asset_name}" if asset_name else policy_id
+        return self.assets.get(unit, 0)
+
+    def holds(self, policy_id: str, asset_name: Optional[str] = None) -> bool:
+        """Whether the output holds the asset, or any asset of the policy."""
+        if asset_name is not None:
+            return self.quantity(policy_id, asset_name) > 0
+        return any(
+            unit == policy_id or unit.startswith(policy_id + ".")
+            for unit in self.assets
+        )
+
+    async def to_utxo(self) -> pyc.UTxO:
+        """Decode the output, fetching its datum and script when needed."""
+        metrics.inc("utxos_decoded", backend="kupo")
+        utxo, _ = await self._context._unpack_output(  # pylint: disable=W0212
+            self._address, self.raw
+        )
+        return utxo
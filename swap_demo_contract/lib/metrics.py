@@ -0,0 +1,191 @@
+"""Timing spans and counters for the backend, build, sign and submit paths.
+
+Everything is recorded into the process-wide ``metrics`` registry, which can
+be rendered in the Prometheus text exposition format or as a short summary
+at the end of a command. Recording is thread-safe, because transactions are
+built and Blockfrost is queried from worker threads.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterator, List, Tuple
+
+# Upper bounds (seconds) of the span duration histogram buckets.
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+@dataclass
+class SpanStats:
+    """Count, total, maximum and bucketed durations of one span."""
+
+    buckets: Tuple[float, ...]
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    bucket_counts: List[int] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        if not self.bucket_counts:
+            self.bucket_counts = [0] * len(self.buckets)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+class Metrics:
+    """Registry of labelled counters and timing spans.
+
+    Attributes:
+        prefix: Prefix of the exported metric names.
+        buckets: Histogram bucket bounds of the span durations, in seconds.
+    """
+
+    def __init__(self, prefix: str = "odv_demo", buckets=DEFAULT_BUCKETS) -> None:
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._spans: Dict[Tuple[str, Labels], SpanStats] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add ``value`` to the counter ``name`` with the given labels."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record one ``seconds`` long occurrence of the span ``name``."""
+        key = (name, _labels(labels))
+        with self._lock:
+            stats = self._spans.get(key)
+            if stats is None:
+                stats = self._spans[key] = SpanStats(self.buckets)
+            stats.observe(seconds)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        """Time the enclosed block, including any time spent awaiting."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator timing every call of a coroutine function as a span."""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return await fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+    def to_prometheus(self) -> str:
+        """Render every counter and span in the Prometheus text format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            spans = [
+                (key, replace(stats, bucket_counts=list(stats.bucket_counts)))
+                for key, stats in sorted(self._spans.items())
+            ]
+
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        metric = f"{self.prefix}_span_seconds"
+        if spans:
+            lines.append(f"# TYPE {metric} histogram")
+        for (name, labels), stats in spans:
+            labels = (("span", name),) + labels
+            cumulative = 0
+            for bound, count in zip(stats.buckets, stats.bucket_counts):
+                cumulative += count
+                bucket = labels + (("le", f"{bound:g}"),)
+                lines.append(f"{metric}_bucket{_format_labels(bucket)} {cumulative}")
+            bucket = labels + (("le", "+Inf"),)
+            lines.append(f"{metric}_bucket{_format_labels(bucket)} {stats.count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {stats.total:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {stats.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Human-readable table of the spans and counters recorded so far."""
+        with self._lock:
+            spans = sorted(self._spans.items(), key=lambda kv: -kv[1].total)
+            counters = sorted(self._counters.items())
+
+        lines = []
+        if spans:
+            lines.append(
+                f"{'span':44} {'count':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9}"
+            )
+            for (name, labels), stats in spans:
+                label = name + _format_labels(labels)
+                lines.append(
+                    f"{label:44} {stats.count:6d} {stats.total:9.3f} "
+                    f"{stats.total / stats.count * 1000:9.1f} {stats.max * 1000:9.1f}"
+                )
+        for (name, labels), value in counters:
+            lines.append(f"{name + _format_labels(labels):44} {value:g}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
@@ -23,6 +23,8 @@ from pycardano import (
 )
 
 from swap_demo_contract.lib.chain_query import ChainQuery
+from swap_demo_contract.lib.metrics import metrics
+from swap_demo_contract.lib.ratelimit import budgeted
 
 from .dynamic_rewards import DynamicRewardsMixin
 from .redeemers import OdvRequest
@@ -76,6 +78,8 @@ class OracleUser(DynamicRewardsMixin):
         self.c3_token_hash = c3_token_hash
         self.c3_token_name = c3_token_name
 
+    @metrics.timed("oracle_user.send_odv_request")
+    @budgeted("odv_request")
     async def send_odv_request(self, funds: int):
         """
         send ODV request by adding funds (payment token) to aggstate UTxO of oracle script.
@@ -121,6 +125,6 @@ class OracleUser(DynamicRewardsMixin):
         auxiliary_data = AuxiliaryData(AlonzoMetadata(metadata=Metadata(metadata)))
         builder.auxiliary_data = auxiliary_data
 
-        await self.chain_query.submit_tx_builder(
+        return await self.chain_query.submit_tx_builder(
             builder, self.signing_key, self.address
         )
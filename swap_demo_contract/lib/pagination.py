@@ -0,0 +1,204 @@
+"""Concurrent, streaming pagination of Blockfrost address UTxOs.
+
+pycardano's ``BlockFrostChainContext.utxos`` requests the pages of an
+address one after the other and decodes them only once all have arrived.
+``stream_address_utxos`` requests the first page alone, which is all most
+addresses need. When it is full, it keeps ``concurrency`` further pages in
+flight and yields the decoded UTxOs of each page as soon as it arrives.
+Blockfrost does not report the number of pages, so pages are requested
+ahead speculatively, and the first page that comes back short marks the
+end. A caller that stops iterating cancels the pages still pending.
+"""
+
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from blockfrost import ApiError
+from blockfrost.config import DEFAULT_PAGINATION_PAGE_ITEMS_COUNT
+from pycardano import (
+    Address,
+    Asset,
+    AssetName,
+    BlockFrostChainContext,
+    DatumHash,
+    MultiAsset,
+    RawCBOR,
+    ScriptHash,
+    TransactionInput,
+    TransactionOutput,
+    UTxO,
+    Value,
+)
+from pycardano.hash import SCRIPT_HASH_SIZE
+
+from .metrics import metrics
+
+ScriptResolver = Callable[[str], object]
+
+
+def decode_utxo(
+    result, address: Address, resolve_script: Optional[ScriptResolver] = None
+) -> UTxO:
+    """Decode one entry of Blockfrost's ``/addresses/{address}/utxos``.
+
+    Args:
+        result: The entry, as returned by blockfrost-python.
+        address: The address queried.
+        resolve_script: Returns the script of a reference script hash. When
+            omitted, reference scripts are left unset.
+
+    Returns:
+        UTxO: The decoded UTxO.
+    """
+    lovelace = 0
+    multi_asset = MultiAsset()
+    for item in result.amount:
+        if item.unit == "lovelace":
+            lovelace = int(item.quantity)
+            continue
+        unit = bytes.fromhex(item.unit)
+        policy_id = ScriptHash(unit[:SCRIPT_HASH_SIZE])
+        if policy_id not in multi_asset:
+            multi_asset[policy_id] = Asset()
+        multi_asset[policy_id][AssetName(unit[SCRIPT_HASH_SIZE:])] = int(item.quantity)
+
+    inline_datum = getattr(result, "inline_datum", None)
+    datum_hash = (
+        DatumHash.from_primitive(result.data_hash)
+        if result.data_hash and inline_datum is None
+        else None
+    )
+    datum = RawCBOR(bytes.fromhex(inline_datum)) if inline_datum else None
+
+    script = None
+    script_hash = getattr(result, "reference_script_hash", None)
+    if script_hash and resolve_script is not None:
+        script = resolve_script(script_hash)
+
+    return UTxO(
+        TransactionInput.from_primitive([result.tx_hash, result.output_index]),
+        TransactionOutput(
+            address,
+            amount=Value(lovelace, multi_asset),
+            datum_hash=datum_hash,
+            datum=datum,
+            script=script,
+        ),
+    )
+
+
+async def stream_address_pages(
+    context: BlockFrostChainContext,
+    address: str,
+    concurrency: int = 4,
+    page_size: int = DEFAULT_PAGINATION_PAGE_ITEMS_COUNT,
+    asset: Optional[str] = None,
+    transform: Optional[Callable[[list], list]] = None,
+) -> AsyncIterator[list]:
+    """Yield the pages of an address's UTxOs as they arrive.
+
+    Pages after the first may arrive out of order. Use
+    ``contextlib.aclosing`` when stopping early so the pending pages are
+    cancelled straight away.
+
+    Args:
+        context: Blockfrost chain context whose ``api`` is queried.
+        address: Bech32 address.
+        concurrency: Pages in flight once the first page is full.
+        page_size: UTxOs per page, at most 100.
+        asset: Only the UTxOs holding this asset (policy id and asset name,
+            concatenated in hex).
+        transform: Applied to each page in the worker thread that fetched
+            it, e.g. to decode it.
+
+    Yields:
+        The entries of each page, as returned by blockfrost-python or
+        ``transform``.
+    """
+
+    def fetch(page: int) -> Tuple[list, int]:
+        try:
+            if asset is None:
+                results = context.api.address_utxos(address, page=page, count=page_size)
+            else:
+                results = context.api.address_utxos_asset(
+                    address, asset, page=page, count=page_size
+                )
+        except ApiError as err:
+            if err.status_code == 404:
+                return [], 0
+            raise
+        metrics.inc("blockfrost_pages")
+        return (transform(results) if transform else results), len(results)
+
+    entries, count = await asyncio.to_thread(fetch, 1)
+    yield entries
+    if count < page_size:
+        return
+
+    pending: Dict[asyncio.Task, int] = {}
+    next_page = 2
+    last_page: Optional[int] = None
+    try:
+        while True:
+            while len(pending) < concurrency and (
+                last_page is None or next_page <= last_page
+            ):
+                task = asyncio.create_task(asyncio.to_thread(fetch, next_page))
+                pending[task] = next_page
+                next_page += 1
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=pending.get):
+                if task not in pending:
+                    continue  # past the last page
+                page = pending.pop(task)
+                entries, count = task.result()
+                if count < page_size and (last_page is None or page < last_page):
+                    last_page = page
+                    for other, other_page in list(pending.items()):
+                        if other_page > last_page:
+                            other.cancel()
+                            del pending[other]
+                yield entries
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def stream_address_utxos(
+    context: BlockFrostChainContext,
+    address: str,
+    resolve_script: Optional[ScriptResolver] = None,
+    **kwargs,
+) -> AsyncIterator[UTxO]:
+    """Yield the decoded UTxOs of an address, page by page as they arrive.
+
+    UTxOs of one page keep their order. See ``stream_address_pages`` for
+    early termination and the other arguments.
+
+    Args:
+        context: Blockfrost chain context whose ``api`` is queried.
+        address: Bech32 address.
+        resolve_script: Passed on to ``decode_utxo``.
+    """
+    decoded_address = Address.from_primitive(address)
+
+    def decode(results: list) -> List[UTxO]:
+        return [decode_utxo(r, decoded_address, resolve_script) for r in results]
+
+    async with aclosing(
+        stream_address_pages(context, address, transform=decode, **kwargs)
+    ) as pages:
+        async for utxos in pages:
+            for utxo in utxos:
+                yield utxo
+
+
+async def address_utxos(
+    context: BlockFrostChainContext, address: str, **kwargs
+) -> List[UTxO]:
+    """All UTxOs of an address, see ``stream_address_utxos`` for ``kwargs``."""
+    return [utxo async for utxo in stream_address_utxos(context, address, **kwargs)]
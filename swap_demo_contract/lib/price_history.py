@@ -0,0 +1,245 @@
+"""Local history of the oracle feed, indexed from Kupo.
+
+Every update of the oracle feed spends the feed UTxO and creates a new one
+holding the oracle NFT, so the address's spent outputs holding the NFT are
+the feed's history. ``PriceHistoryIndexer`` reads the ones created since the
+last indexed slot from Kupo, decodes their ``GenericData`` datums, and
+appends one record per update to a ``PriceHistory`` file.
+
+The file is an 8-byte magic followed by fixed-size records of four
+little-endian int64 fields: ``slot``, ``price``, ``timestamp`` and
+``expiry`` (POSIX milliseconds), in slot order. It is only ever appended
+to, and read through a memory map, so a range query is a binary search on
+the slot column and does not load the rest of the file.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pycardano import MultiAsset
+
+    from .kupo import KupoContext, KupoOutput
+
+logger = logging.getLogger("price_history")
+
+MAGIC = b"ODVPRH01"
+
+DEFAULT_PATH = "oracle-price-history.bin"
+
+RECORD = np.dtype(
+    [("slot", "<i8"), ("price", "<i8"), ("timestamp", "<i8"), ("expiry", "<i8")]
+)
+
+
+def history_path(configyaml: dict) -> str:
+    """File of the ``price_history`` config section."""
+    settings = configyaml.get("price_history") or {}
+    return settings.get("path", DEFAULT_PATH)
+
+
+class PriceHistory:
+    """Append-only file of oracle feed updates.
+
+    Attributes:
+        path: Location of the file, created on the first append.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._records: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        return max(size - len(MAGIC), 0) // RECORD.itemsize
+
+    def records(self) -> np.ndarray:
+        """Every record, as a read-only memory-mapped structured array."""
+        count = len(self)
+        if count == 0:
+            return np.zeros(0, dtype=RECORD)
+        if self._records is None or len(self._records) != count:
+            with open(self.path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{self.path} is not a price history file")
+            self._records = np.memmap(
+                self.path, dtype=RECORD, mode="r", offset=len(MAGIC), shape=(count,)
+            )
+        return self._records
+
+    @property
+    def last_slot(self) -> Optional[int]:
+        """Slot of the latest record, None when the history is empty."""
+        records = self.records()
+        return int(records["slot"][-1]) if len(records) else None
+
+    def append(self, rows: np.ndarray) -> int:
+        """Append the ``rows`` newer than the last record.
+
+        A record left incomplete by an interrupted append is dropped first.
+
+        Args:
+            rows (np.ndarray): ``RECORD`` rows sorted by slot.
+
+        Returns:
+            int: Number of rows written.
+        """
+        last_slot = self.last_slot
+        if last_slot is not None:
+            rows = rows[rows["slot"] > last_slot]
+        if not len(rows):
+            return 0
+        with open(self.path, "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            else:
+                f.truncate(len(MAGIC) + len(self) * RECORD.itemsize)
+                f.seek(0, os.SEEK_END)
+            f.write(rows.astype(RECORD, copy=False).tobytes())
+        return len(rows)
+
+    def range(
+        self, start_slot: Optional[int] = None, end_slot: Optional[int] = None
+    ) -> np.ndarray:
+        """Records with ``start_slot <= slot < end_slot``."""
+        records = self.records()
+        slots = records["slot"]
+        first = 0 if start_slot is None else np.searchsorted(slots, start_slot)
+        last = len(slots) if end_slot is None else np.searchsorted(slots, end_slot)
+        return records[first:last]
+
+    def twap(self, start_slot: int, end_slot: int) -> Optional[float]:
+        """Time-weighted average price over ``[start_slot, end_slot)``.
+
+        Each price counts from its slot until the next update, including
+        the price already in force at ``start_slot``.
+
+        Returns:
+            Optional[float]: The average, None without a price in the range.
+        """
+        records = self.records()
+        slots = records["slot"]
+        first = max(int(np.searchsorted(slots, start_slot, "right")) - 1, 0)
+        last = int(np.searchsorted(slots, end_slot))
+        window = records[first:last]
+        if not len(window):
+            return None
+        begins = np.maximum(window["slot"], start_slot)
+        ends = np.minimum(np.append(window["slot"][1:], end_slot), end_slot)
+        durations = np.maximum(ends - begins, 0)
+        if not durations.sum():
+            return None
+        return float(np.average(window["price"], weights=durations))
+
+
+class PriceHistoryIndexer:
+    """Brings a ``PriceHistory`` up to date from Kupo.
+
+    Attributes:
+        kupo: Kupo client.
+        oracle_address: Address of the oracle contract (bech32).
+        oracle_nft: The NFT identifying the feed UTxO.
+        history: File the updates are appended to.
+        concurrency: Datums fetched from Kupo at once.
+    """
+
+    def __init__(
+        self,
+        kupo: "KupoContext",
+        oracle_address: str,
+        oracle_nft: "MultiAsset",
+        history: PriceHistory,
+        concurrency: int = 16,
+    ) -> None:
+        self.kupo = kupo
+        self.oracle_address = oracle_address
+        ((policy_id, assets),) = oracle_nft.items()
+        ((asset_name, _),) = assets.items()
+        self.policy_id = policy_id.payload.hex()
+        self.asset_name = asset_name.payload.hex()
+        self.history = history
+        self.concurrency = concurrency
+
+    async def sync(self) -> int:
+        """Index the feed updates created after the last indexed slot.
+
+        Spent and unspent outputs are read in one query, so the current
+        feed is indexed too.
+
+        Returns:
+            int: Number of updates appended.
+        """
+        outputs = []
+        async for output in self.kupo.iter_matches_kupo(
+            self.oracle_address,
+            status=None,
+            created_after=self.history.last_slot,
+            policy_id=self.policy_id,
+            asset_name=self.asset_name,
+        ):
+            outputs.append(output)
+        if not outputs:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def decode(output: "KupoOutput") -> Optional[tuple]:
+            async with semaphore:
+                datum = await output.datum()
+            return self._record(output, datum)
+
+        records = [r for r in await asyncio.gather(*map(decode, outputs)) if r]
+        rows = np.array(sorted(records), dtype=RECORD)
+        return self.history.append(rows)
+
+    @staticmethod
+    def _record(output: "KupoOutput", datum) -> Optional[tuple]:
+        # pycardano is only imported when indexing.
+        from .datums import GenericData  # pylint: disable=import-outside-toplevel
+
+        if datum is None:
+            logger.warning("Feed output %s#%s has no datum", output.tx_id, output.index)
+            return None
+        try:
+            price_data = GenericData.from_cbor(datum.cbor).price_data
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning(
+                "Cannot decode feed output %s#%s: %s", output.tx_id, output.index, err
+            )
+            return None
+        return (
+            output.created_at,
+            price_data.get_price(),
+            price_data.get_timestamp(),
+            price_data.get_expiry(),
+        )
+
+
+def _utc(milliseconds: int) -> str:
+    return datetime.fromtimestamp(milliseconds / 1000, timezone.utc).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+
+
+def print_history(history: PriceHistory, records: np.ndarray) -> None:
+    """Print ``records`` of ``history`` and their time-weighted average."""
+    print("Charli3 - Oracle Feed history")
+    print(f"{len(history)} updates stored, last at slot {history.last_slot}.")
+    if not len(records):
+        return
+    print(f"{'slot':>12} {'price':>12}  {'timestamp (UTC)':19}  expiry (UTC)")
+    for slot, price, timestamp, expiry in records.tolist():
+        print(f"{slot:>12} {price / 1000000:>12.6f}  {_utc(timestamp)}  {_utc(expiry)}")
+    if len(records) > 1:
+        start, end = int(records["slot"][0]), int(records["slot"][-1])
+        print(
+            f"TWAP over slots {start}-{end}: {history.twap(start, end) / 1000000:.6f}"
+        )
@@ -0,0 +1,291 @@
+"""CPU and wall-clock profiling of a whole command.
+
+``profile_call`` runs a callable under cProfile (main thread, deterministic)
+and a sampling wall-clock profiler. Every few milliseconds the sampler
+records the Python stack of each thread. When the main thread sits in the
+event loop's ``select`` it is not running anything, so the sample is
+attributed instead to what each pending task awaits: I/O, ``asyncio.sleep``
+or a worker thread. Worker threads are classified as on-CPU or blocked from
+the function at the top of their stack, which is an approximation: time in C
+code is charged to the Python function that called it.
+
+The samples are written as collapsed stacks (``state;thread;frame;...``),
+which flamegraph.pl, speedscope and inferno read directly.
+"""
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+CPU = "cpu"
+IO = "io"
+SLEEP = "sleep"
+THREAD = "thread"
+
+# (file suffix, function) pairs where a thread is blocked rather than running.
+_BLOCKING = {
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("socket.py", "create_connection"),
+    ("socket.py", "getaddrinfo"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv"),
+    ("ssl.py", "recv_into"),
+    ("ssl.py", "do_handshake"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("_base.py", "result"),
+    ("connectionpool.py", "_make_request"),
+    ("client.py", "recv"),
+}
+
+# Top frames of threads that are idle, waiting for work.
+_IDLE = {("thread.py", "_worker")}
+
+# Innermost coroutines that mean a task is sleeping or waiting on a thread.
+_AWAIT_STATES = {
+    ("tasks.py", "sleep"): SLEEP,
+    ("threads.py", "to_thread"): THREAD,
+    ("base_events.py", "run_in_executor"): THREAD,
+}
+
+_labels: Dict[str, str] = {}
+
+
+def _short_filename(filename: str) -> str:
+    short = _labels.get(filename)
+    if short is None:
+        for marker in ("site-packages" + os.sep, "lib" + os.sep + "python"):
+            if marker in filename:
+                short = filename.split(marker, 1)[1]
+                if marker.startswith("lib"):
+                    short = short.split(os.sep, 1)[-1]
+                break
+        else:
+            parts = filename.split(os.sep)
+            short = os.sep.join(parts[-2:])
+        _labels[filename] = short
+    return short
+
+
+def _frame_label(frame) -> str:
+    return f"{_short_filename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def _frame_key(frame) -> Tuple[str, str]:
+    return os.path.basename(frame.f_code.co_filename), frame.f_code.co_name
+
+
+def _thread_stack(frame) -> List:
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _coroutine_stack(coro) -> List:
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed wall-clock interval.
+
+    Attributes:
+        interval: Seconds between samples.
+        stacks: Sample count per ``(state, thread, frames...)`` stack.
+        main_states: Share of main-thread samples per state. A sample taken
+            while several tasks are waiting is split between them.
+        hotspots: Self samples per ``(state, innermost frame)``.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.main_states: Counter = Counter()
+        self.hotspots: Counter = Counter()
+        self.samples = 0
+        self.wall = 0.0
+        self._main = threading.main_thread()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.wall = time.perf_counter() - self._started
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=W0212
+                if ident != own:
+                    self._sample(ident, names.get(ident, str(ident)), frame)
+            self.samples += 1
+
+    def _find_loop(self, frames: List) -> Optional[asyncio.AbstractEventLoop]:
+        for frame in frames:
+            if frame.f_code.co_name in ("run_forever", "_run_once"):
+                loop = frame.f_locals.get("self")
+                if isinstance(loop, asyncio.AbstractEventLoop):
+                    return loop
+        return None
+
+    def _sample(self, ident: int, name: str, frame) -> None:
+        frames = _thread_stack(frame)
+        if not frames:
+            return
+        main = ident == self._main.ident
+        thread = "main" if main else name
+        if _frame_key(frames[-1]) in _IDLE:
+            return
+        blocked = _frame_key(frames[-1]) in _BLOCKING
+
+        if main and blocked and _frame_key(frames[-1]) == ("selectors.py", "select"):
+            self._loop = self._loop or self._find_loop(frames)
+            if self._loop is not None and self._sample_tasks():
+                return
+        elif not main and blocked:
+            if any(f.f_code.co_name == "_worker" for f in frames) or any(
+                f.f_code.co_name == "run_forever" for f in frames
+            ):
+                # An idle pool worker or another thread's idle event loop.
+                return
+
+        state = IO if blocked else CPU
+        labels = [_frame_label(f) for f in frames]
+        self.stacks[(state, thread, *labels)] += 1
+        self.hotspots[(state, labels[-1])] += 1
+        if main:
+            self.main_states[state] += 1
+
+    def _sample_tasks(self) -> bool:
+        try:
+            tasks = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+        except RuntimeError:
+            return False
+        stacks = []
+        for task in tasks:
+            frames = _coroutine_stack(task.get_coro())
+            if frames:
+                stacks.append(frames)
+        if not stacks:
+            return False
+        for frames in stacks:
+            state = _AWAIT_STATES.get(_frame_key(frames[-1]), IO)
+            labels = [_frame_label(f) for f in frames]
+            self.stacks[(state, "main", *labels)] += 1
+            where = f"{labels[-1]}:{frames[-1].f_lineno}"
+            self.hotspots[(state, where)] += 1
+            self.main_states[state] += 1 / len(stacks)
+        return True
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w", encoding="UTF-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(";".join(s.replace(";", ":") for s in stack) + f" {count}\n")
+
+    def summary(self, top: int = 15) -> str:
+        # Sampling runs a little slower than the nominal interval.
+        per_sample = self.wall / self.samples if self.samples else self.interval
+        lines = [
+            f"Wall clock {self.wall:.2f} s, {self.samples} samples "
+            f"every {self.interval * 1000:g} ms"
+        ]
+        total = sum(self.main_states.values()) or 1
+        titles = {
+            CPU: "on CPU",
+            IO: "awaiting I/O",
+            SLEEP: "sleeping",
+            THREAD: "awaiting worker threads",
+        }
+        lines.append("Main thread:")
+        for state in (CPU, IO, SLEEP, THREAD):
+            share = self.main_states[state] / total
+            lines.append(
+                f"  {titles[state]:24} {share * self.wall:8.2f} s {share:6.1%}"
+            )
+        for state in (CPU, IO, SLEEP, THREAD):
+            spots = [(k[1], n) for k, n in self.hotspots.items() if k[0] == state]
+            if not spots:
+                continue
+            lines.append(f"Top {titles[state]} (self time, all threads):")
+            for label, count in sorted(spots, key=lambda kv: -kv[1])[:top]:
+                lines.append(f"  {count * per_sample:8.2f} s  {label}")
+        return "\n".join(lines)
+
+
+def profile_call(
+    fn: Callable[[], T],
+    prefix: str,
+    top: int = 15,
+    interval: float = 0.005,
+) -> T:
+    """Run ``fn`` under cProfile and the sampling profiler.
+
+    Writes ``<prefix>.pstats`` (cProfile, readable with ``pstats`` or
+    snakeviz) and ``<prefix>.folded`` (collapsed wall-clock stacks), then
+    prints a top-``top`` summary to stderr.
+
+    Args:
+        fn: The command to run.
+        prefix: Path prefix of the output files.
+        top: Number of entries in each summary table.
+        interval: Seconds between wall-clock samples.
+
+    Returns:
+        Whatever ``fn`` returns.
+    """
+    profile = cProfile.Profile()
+    sampler = SamplingProfiler(interval)
+    sampler.start()
+    profile.enable()
+    try:
+        return fn()
+    finally:
+        profile.disable()
+        sampler.stop()
+
+        profile.dump_stats(f"{prefix}.pstats")
+        sampler.write_collapsed(f"{prefix}.folded")
+
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        cpu_table = out.getvalue().split("\n\n", 1)[-1].rstrip()
+        print(sampler.summary(top), file=sys.stderr)
+        print("cProfile, main thread, by cumulative time:", file=sys.stderr)
+        print(cpu_table, file=sys.stderr)
+        print(
+            f"Wrote {prefix}.folded (collapsed stacks) and {prefix}.pstats",
+            file=sys.stderr,
+        )
@@ -0,0 +1,217 @@
+"""Vectorized trade quotes over a cached oracle feed and swap state.
+
+``SwapContract.swap_a_with_b`` and ``swap_b_with_a`` fetch and decode the
+oracle feed for every quote. A ``QuoteEngine`` keeps one ``MarketState`` (the
+oracle price and the swap UTxO's liquidity) for ``ttl`` seconds and prices
+whole arrays of trade sizes against it at once, so a ladder of a hundred
+sizes costs two lookups at most and a handful of numpy operations.
+
+Amounts are integers and are divided with floor division, as the swap
+contract rounds: selling ``a`` tUSDT buys ``a * price // precision`` tADA and
+selling ``b`` tADA buys ``b * precision // price`` tUSDT. Products that could
+overflow 64 bits are computed on Python integers instead.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from ..swap import SwapContract
+
+ASSETS_OUT = {"tUSDT": "tADA", "tADA": "tUSDT"}
+
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def _amounts(amounts: Iterable[int], factor: int) -> np.ndarray:
+    """``amounts`` as an integer array whose products by ``factor`` are exact.
+
+    That is an int64 array, or an array of Python integers when a product
+    could overflow.
+    """
+    if isinstance(amounts, np.ndarray) and amounts.dtype.kind in "iu":
+        if not amounts.size:
+            return np.zeros(0, dtype=np.int64)
+        values = amounts
+    else:
+        # numpy would guess a float dtype for Python integers that do not
+        # fit in int64, so their type is checked one by one.
+        values = amounts.tolist() if isinstance(amounts, np.ndarray) else list(amounts)
+        if not all(
+            isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values
+        ):
+            raise ValueError("Amounts must be integers.")
+        if not values:
+            return np.zeros(0, dtype=np.int64)
+    if min(values) < 0:
+        raise ValueError("Amounts must not be negative.")
+    if max(values) <= _INT64_MAX // factor:
+        return np.asarray(values, dtype=np.int64)
+    return np.array([int(v) for v in values], dtype=object)
+
+
+@dataclass(frozen=True)
+class MarketState:
+    """What a quote depends on, read from the oracle feed and swap UTxOs.
+
+    Attributes:
+        price: Oracle price of one tADA in tUSDT, scaled by ``precision``.
+        swap_lovelace: Lovelace held by the swap UTxO.
+        swap_tokens: tUSDT held by the swap UTxO.
+        precision: Scale of ``price``, the contract's ``coin_precision``.
+        fetched_at: ``time.monotonic()`` when the state was read.
+    """
+
+    price: int
+    swap_lovelace: int
+    swap_tokens: int
+    precision: int = 1000000
+    fetched_at: float = 0.0
+
+    def liquidity(self, asset_in: str) -> int:
+        """Most the swap pays out to a trade selling ``asset_in``.
+
+        As ``swap_A`` checks it, in whole tADA for tUSDT sales.
+        """
+        if asset_in == "tUSDT":
+            return self.swap_lovelace // 1000000
+        return self.swap_tokens
+
+    def quote(self, asset_in: str, amounts: Iterable[int]) -> np.ndarray:
+        """Amounts bought selling each of ``amounts`` of ``asset_in``."""
+        if asset_in == "tUSDT":
+            return _amounts(amounts, self.price) * self.price // self.precision
+        return _amounts(amounts, self.precision) * self.precision // self.price
+
+    def max_amount_in(self, asset_in: str) -> int:
+        """Largest amount of ``asset_in`` whose quote the liquidity covers."""
+        cap = self.liquidity(asset_in) + 1
+        if asset_in == "tUSDT":
+            return (cap * self.precision - 1) // self.price
+        return (cap * self.price - 1) // self.precision
+
+
+@dataclass
+class Ladder:
+    """Quotes for a range of trade sizes.
+
+    Attributes:
+        asset_in: Asset sold.
+        asset_out: Asset bought.
+        amounts_in: Trade sizes.
+        amounts_out: Amount bought at each size.
+        fillable: Whether each trade buys at least one unit and is covered
+            by the swap liquidity.
+        state: Market state the ladder was priced against.
+    """
+
+    asset_in: str
+    asset_out: str
+    amounts_in: np.ndarray
+    amounts_out: np.ndarray
+    fillable: np.ndarray
+    state: MarketState
+
+    @classmethod
+    def price(
+        cls, state: MarketState, asset_in: str, amounts: Iterable[int]
+    ) -> "Ladder":
+        if asset_in not in ASSETS_OUT:
+            raise ValueError(f"Unknown asset {asset_in!r}, expected tADA or tUSDT")
+        amounts_in = _amounts(amounts, 1)
+        amounts_out = state.quote(asset_in, amounts_in)
+        fillable = (amounts_out >= 1) & (amounts_out <= state.liquidity(asset_in))
+        return cls(
+            asset_in,
+            ASSETS_OUT[asset_in],
+            amounts_in,
+            amounts_out,
+            fillable.astype(bool),
+            state,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "asset_in": self.asset_in,
+            "asset_out": self.asset_out,
+            "price": self.state.price,
+            "liquidity": self.state.liquidity(self.asset_in),
+            "max_amount_in": self.state.max_amount_in(self.asset_in),
+            "amounts_in": [int(v) for v in self.amounts_in],
+            "amounts_out": [int(v) for v in self.amounts_out],
+            "fillable": self.fillable.tolist(),
+        }
+
+
+class QuoteEngine:
+    """Prices trades against a market state reused for ``ttl`` seconds.
+
+    Concurrent callers needing a fresh state share a single refresh.
+
+    Attributes:
+        swap_contract: Client reading the oracle feed and swap UTxOs.
+        ttl: Seconds a market state is reused.
+    """
+
+    def __init__(self, swap_contract: "SwapContract", ttl: float = 5.0) -> None:
+        self.swap_contract = swap_contract
+        self.ttl = ttl
+        self._state: Optional[MarketState] = None
+        self._lock = asyncio.Lock()
+
+    async def state(self, force: bool = False) -> MarketState:
+        """The current market state, read again once older than ``ttl``."""
+        async with self._lock:
+            state = self._state
+            if force or state is None or time.monotonic() - state.fetched_at > self.ttl:
+                oracle_utxo, swap_utxo = await asyncio.gather(
+                    self.swap_contract.get_oracle_utxo(),
+                    self.swap_contract.get_swap_utxo(),
+                )
+                price = self.swap_contract.oracle_price(oracle_utxo)
+                if price <= 0:
+                    raise ValueError("The oracle feed has no price.")
+                state = self._state = MarketState(
+                    price=price,
+                    swap_lovelace=swap_utxo.output.amount.coin,
+                    swap_tokens=self.swap_contract.swap_token_amount(swap_utxo),
+                    precision=self.swap_contract.coin_precision,
+                    fetched_at=time.monotonic(),
+                )
+            return state
+
+    async def ladder(self, asset_in: str, amounts: Iterable[int]) -> Ladder:
+        """Quotes for selling each of ``amounts`` of ``asset_in``.
+
+        Args:
+            asset_in (str): ``tADA`` or ``tUSDT``
+            amounts (Iterable[int]): trade sizes
+
+        Returns:
+            Ladder: amounts bought and whether the swap can fill them
+        """
+        return Ladder.price(await self.state(), asset_in, amounts)
+
+
+def print_ladder(ladder: Ladder) -> None:
+    """Print ``ladder`` as a table."""
+    state = ladder.state
+    print(f"Oracle exchange rate: {state.price / state.precision} tUSDT/tADA (A/B)")
+    print(
+        f"Swap liquidity: {state.swap_lovelace // 1000000} tADA, "
+        f"{state.swap_tokens} tUSDT"
+    )
+    print(f"{ladder.asset_in + ' in':>16} {ladder.asset_out + ' out':>16}")
+    for amount_in, amount_out, fillable in zip(
+        ladder.amounts_in, ladder.amounts_out, ladder.fillable
+    ):
+        note = "" if fillable else "  (not fillable)"
+        print(f"{int(amount_in):>16} {int(amount_out):>16}{note}")
+    print(
+        f"Largest fillable trade: {state.max_amount_in(ladder.asset_in)} "
+        f"{ladder.asset_in}"
+    )
@@ -0,0 +1,267 @@
+"""Client-side rate limiting and request budgets for Blockfrost.
+
+Blockfrost allows a project a sustained request rate with a burst allowance
+(10 requests/s and a burst of 500 on the free plan) and answers 429 beyond
+it. ``RateLimitedBlockFrostApi`` wraps the ``BlockFrostApi`` of a chain
+context so that every request, including every page of a paginated call,
+first takes a token from a shared ``TokenBucket``. Callers beyond the rate
+queue in arrival order instead of being rejected. A 429 drains the bucket
+and the request is retried with exponential backoff (blockfrost-python
+drops the response headers, so ``Retry-After`` is not available).
+
+Address UTxO queries are coalesced: concurrent identical queries share one
+request, and its answer is reused for ``cache_ttl`` seconds or until the
+next transaction submission. A single trade otherwise asks for the same
+wallet's UTxOs several times while balancing and picking collateral.
+
+Operations such as a trade or a confirmation wait run under a named request
+budget (``budgeted``/``request_budget``). Once an operation has used its
+budget, its further requests, like all confirmation polling, only take
+tokens while part of the burst is left for other operations.
+"""
+
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from blockfrost import ApiError
+from blockfrost.config import DEFAULT_PAGINATION_PAGE_ITEMS_COUNT
+
+from .metrics import metrics
+
+logger = logging.getLogger("ratelimit")
+
+# Requests per operation before it is demoted to background priority.
+DEFAULT_BUDGETS = {
+    "trade": 40,
+    "add_liquidity": 40,
+    "mint": 40,
+    "odv_request": 40,
+    "confirm": 12,
+}
+
+# Calls whose answers are shared, and the call that invalidates them.
+COALESCED_CALLS = ("address_utxos",)
+INVALIDATING_CALLS = ("transaction_submit",)
+
+
+@dataclass
+class _Operation:
+    name: str
+    background: bool = False
+    used: int = 0
+    warned: bool = False
+
+
+_operation: contextvars.ContextVar[Optional[_Operation]] = contextvars.ContextVar(
+    "blockfrost_operation", default=None
+)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that queues callers in arrival order.
+
+    Each ``acquire`` reserves a token immediately, letting the balance go
+    negative, and sleeps until the bucket would have refilled it, so waiting
+    callers are served first come, first served.
+
+    Attributes:
+        rate: Tokens added per second.
+        burst: Bucket capacity.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, reserve: float = 0.0) -> float:
+        """Take a token and return how long to wait before using it.
+
+        Args:
+            reserve: Tokens that must remain in the bucket after this one,
+                kept for higher-priority callers.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (reserve + 1 - self._tokens) / self.rate)
+            self._tokens -= 1
+            return wait
+
+    def acquire(self, reserve: float = 0.0) -> float:
+        """Block until a token is available; return the seconds waited."""
+        wait = self.reserve(reserve)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def drain(self, seconds: float) -> None:
+        """Empty the bucket so that nobody gets a token for ``seconds``."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+@contextmanager
+def request_budget(name: str, background: bool = False) -> Iterator[None]:
+    """Account the Blockfrost requests made inside the block to ``name``.
+
+    Args:
+        name: Operation name, looked up in the request budgets.
+        background: Run every request at background priority.
+    """
+    token = _operation.set(_Operation(name, background))
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def budgeted(name: str, background: bool = False):
+    """Decorator running a coroutine function under ``request_budget``."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with request_budget(name, background):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RateLimitedBlockFrostApi:
+    """Proxy of a ``BlockFrostApi`` that rate limits and retries its calls.
+
+    Attributes:
+        api: The wrapped client.
+        bucket: Token bucket shared by every request of the project.
+        budgets: Request budget per operation name.
+        background_share: Share of the burst kept for foreground requests.
+        max_retries: Retries of a request answered with 429.
+        cache_ttl: Seconds an address UTxO answer is reused.
+    """
+
+    def __init__(
+        self,
+        api,
+        bucket: TokenBucket,
+        budgets: Optional[Dict[str, int]] = None,
+        background_share: float = 0.2,
+        max_retries: int = 6,
+        cache_ttl: float = 2.0,
+    ) -> None:
+        self.api = api
+        self.bucket = bucket
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.background_share = background_share
+        self.max_retries = max_retries
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[Tuple, Tuple[float, Future]] = {}
+        self._cache_lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            if name in INVALIDATING_CALLS:
+                with self._cache_lock:
+                    self._cache.clear()
+            if name in COALESCED_CALLS and self.cache_ttl > 0:
+                return self._coalesced(name, attr, args, kwargs)
+            return self._dispatch(name, attr, args, kwargs)
+
+        return call
+
+    def _dispatch(self, name: str, fn, args: tuple, kwargs: dict) -> Any:
+        if kwargs.pop("gather_pages", False):
+            return self._gather_pages(name, fn, *args, **kwargs)
+        return self._request(name, fn, *args, **kwargs)
+
+    def _coalesced(self, name: str, fn, args: tuple, kwargs: dict) -> Any:
+        key = (name, args, tuple(sorted(kwargs.items())))
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            owner = entry is None or (entry[1].done() and entry[0] <= time.monotonic())
+            if owner:
+                entry = self._cache[key] = (
+                    time.monotonic() + self.cache_ttl,
+                    Future(),
+                )
+        future = entry[1]
+        if not owner:
+            metrics.inc("blockfrost_coalesced", call=name)
+            return future.result()
+
+        try:
+            result = self._dispatch(name, fn, args, dict(kwargs))
+        except BaseException as err:
+            with self._cache_lock:
+                if self._cache.get(key) is entry:
+                    del self._cache[key]
+            future.set_exception(err)
+            raise
+        future.set_result(result)
+        return result
+
+    def _reserve(self) -> float:
+        operation = _operation.get()
+        if operation is None:
+            return 0.0
+        operation.used += 1
+        limit = self.budgets.get(operation.name)
+        over = limit is not None and operation.used > limit
+        if over and not operation.warned:
+            operation.warned = True
+            metrics.inc("blockfrost_budget_exceeded", operation=operation.name)
+            logger.warning(
+                "%s used its budget of %d Blockfrost requests", operation.name, limit
+            )
+        if operation.background or over:
+            return self.bucket.burst * self.background_share
+        return 0.0
+
+    def _request(self, name: str, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire(self._reserve())
+            if waited:
+                metrics.observe("blockfrost.queued", waited)
+            metrics.inc("blockfrost_requests", call=name)
+            try:
+                return fn(*args, **kwargs)
+            except ApiError as err:
+                if err.status_code != 429 or attempt == self.max_retries:
+                    raise
+                backoff = min(2**attempt, 60)
+                metrics.inc("blockfrost_throttled", call=name)
+                logger.warning("Blockfrost rate limit hit, backing off %ss", backoff)
+                self.bucket.drain(backoff)
+        raise AssertionError("unreachable")
+
+    def _gather_pages(self, name: str, fn, *args, **kwargs):
+        """Fetch every page of a list call, one token per page."""
+        count = kwargs.setdefault("count", DEFAULT_PAGINATION_PAGE_ITEMS_COUNT)
+        page = kwargs.pop("page", 1)
+        items = []
+        while True:
+            batch = self._request(name, fn, *args, page=page, **kwargs)
+            items.extend(batch)
+            if len(batch) < count:
+                return items
+            page += 1
@@ -0,0 +1,120 @@
+"""Registry of the Plutus scripts shipped under utils/scripts"""
+
+import os
+from typing import Dict, List, Optional
+
+import cbor2
+from pycardano import Address, Network, PlutusV2Script, ScriptHash, plutus_script_hash
+
+SCRIPTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "scripts"
+)
+
+
+class ScriptEntry:
+    """One ``.plutus`` file, decoded and hashed on first use.
+
+    Attributes:
+        name: File name without the ``.plutus`` extension.
+        path: Location of the hex encoded script.
+    """
+
+    def __init__(self, name: str, path: str) -> None:
+        self.name = name
+        self.path = path
+        self._script: Optional[PlutusV2Script] = None
+        self._hash: Optional[ScriptHash] = None
+        self._addresses: Dict[Optional[Network], Address] = {}
+
+    @property
+    def script(self) -> PlutusV2Script:
+        if self._script is None:
+            with open(self.path, "r", encoding="UTF-8") as f:
+                script_hex = f.read().strip()
+            self._script = PlutusV2Script(cbor2.loads(bytes.fromhex(script_hex)))
+        return self._script
+
+    @property
+    def hash(self) -> ScriptHash:
+        if self._hash is None:
+            self._hash = plutus_script_hash(self.script)
+        return self._hash
+
+    def address(self, network: Optional[Network]) -> Address:
+        """Enterprise script address of this script on ``network``."""
+        if network not in self._addresses:
+            self._addresses[network] = Address(self.hash, network=network)
+        return self._addresses[network]
+
+
+class ScriptRegistry:
+    """All scripts under a directory, indexed by name and by hash.
+
+    Files are listed when the registry is created but only read, decoded and
+    hashed when first requested, after which the script object, its hash and
+    its per-network addresses are reused.
+    """
+
+    def __init__(self, scripts_dir: str = SCRIPTS_DIR) -> None:
+        self.scripts_dir = scripts_dir
+        self.entries: Dict[str, ScriptEntry] = {
+            file_name[: -len(".plutus")]: ScriptEntry(
+                file_name[: -len(".plutus")], os.path.join(scripts_dir, file_name)
+            )
+            for file_name in sorted(os.listdir(scripts_dir))
+            if file_name.endswith(".plutus")
+        }
+        self._by_hash: Optional[Dict[ScriptHash, ScriptEntry]] = None
+
+    def __getitem__(self, name: str) -> ScriptEntry:
+        return self.entries[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def by_hash(self, script_hash: ScriptHash) -> Optional[PlutusV2Script]:
+        """Return the local script with ``script_hash``, if there is one."""
+        if self._by_hash is None:
+            self._by_hash = {entry.hash: entry for entry in self.entries.values()}
+        entry = self._by_hash.get(script_hash)
+        return entry.script if entry else None
+
+    def validate(self, configyaml, network: Optional[Network]) -> List[str]:
+        """Compare the swap and minting scripts with the configuration.
+
+        Args:
+            configyaml: The loaded configuration file.
+            network: Network used to derive script addresses.
+
+        Returns:
+            List[str]: One message per mismatch, empty when everything agrees.
+        """
+        problems = []
+        swap_address = configyaml.get("swap_contract_address")
+        if "swap" in self and swap_address:
+            expected = self["swap"].address(network)
+            if Address.from_primitive(swap_address) != expected:
+                problems.append(
+                    f"swap.plutus hashes to {expected}, "
+                    f"but swap_contract_address is {swap_address}"
+                )
+        swap_policy = configyaml.get("swap_minting_policy")
+        if "mint_script" in self and swap_policy:
+            expected = str(self["mint_script"].hash)
+            if expected != swap_policy:
+                problems.append(
+                    f"mint_script.plutus hashes to {expected}, "
+                    f"but swap_minting_policy is {swap_policy}"
+                )
+        return problems
+
+
+_default_registry: Optional[ScriptRegistry] = None
+
+
+def default_registry() -> ScriptRegistry:
+    """Process-wide registry over the scripts shipped with the package."""
+    global _default_registry  # pylint: disable=global-statement
+    if _default_registry is None:
+        _default_registry = ScriptRegistry()
+    return _default_registry
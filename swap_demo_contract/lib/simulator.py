@@ -0,0 +1,598 @@
+"""In-process ledger simulator implementing pycardano's ChainContext"""
+
+import hashlib
+import threading
+import time
+from collections import Counter
+from copy import deepcopy
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple, Union
+
+import cbor2
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+from pycardano import (
+    Address,
+    Asset,
+    AssetName,
+    ChainContext,
+    ExecutionUnits,
+    GenesisParameters,
+    MultiAsset,
+    Network,
+    PlutusV2Script,
+    ProtocolParameters,
+    RawCBOR,
+    RedeemerMap,
+    ScriptHash,
+    Transaction,
+    TransactionFailedException,
+    TransactionId,
+    TransactionInput,
+    TransactionOutput,
+    UTxO,
+    Value,
+    VerificationKeyHash,
+)
+from pycardano.serialization import IndefiniteList, default_encoder
+from pycardano.utils import fee, min_lovelace_post_alonzo
+
+from .datums import (
+    AggDatum,
+    AggState,
+    GenericData,
+    OraclePlatform,
+    OracleSettings,
+    PriceData,
+    PriceRewards,
+)
+
+# Slot 0 of each network as a POSIX time (slots last one second).
+SLOT_ZERO_POSIX = {Network.MAINNET: 1591566291, Network.TESTNET: 1655683200}
+
+# Execution units reported for every redeemer of a tag. Scripts are not run.
+DEFAULT_EXECUTION_UNITS = {
+    "spend": (1500000, 600000000),
+    "mint": (800000, 300000000),
+    "cert": (500000, 200000000),
+    "reward": (500000, 200000000),
+}
+
+
+def default_protocol_parameters() -> ProtocolParameters:
+    """Babbage-era preprod protocol parameters."""
+    return ProtocolParameters(
+        min_fee_constant=155381,
+        min_fee_coefficient=44,
+        max_block_size=90112,
+        max_tx_size=16384,
+        max_block_header_size=1100,
+        key_deposit=2000000,
+        pool_deposit=500000000,
+        pool_influence=Fraction(3, 10),
+        monetary_expansion=Fraction(3, 1000),
+        treasury_expansion=Fraction(1, 5),
+        decentralization_param=Fraction(0),
+        extra_entropy="",
+        protocol_major_version=8,
+        protocol_minor_version=0,
+        min_utxo=4310,
+        min_pool_cost=170000000,
+        price_mem=Fraction(577, 10000),
+        price_step=Fraction(721, 10000000),
+        max_tx_ex_mem=14000000,
+        max_tx_ex_steps=10000000000,
+        max_block_ex_mem=62000000,
+        max_block_ex_steps=20000000000,
+        max_val_size=5000,
+        collateral_percent=150,
+        max_collateral_inputs=3,
+        coins_per_utxo_word=4310,
+        coins_per_utxo_byte=4310,
+        # Scripts are not executed, so the cost models only feed the script
+        # data hash.
+        cost_models={"PlutusV1": {}, "PlutusV2": {}},
+    )
+
+
+def default_genesis_parameters() -> GenesisParameters:
+    """Preprod genesis parameters."""
+    return GenesisParameters(
+        active_slots_coefficient=Fraction(1, 20),
+        update_quorum=5,
+        max_lovelace_supply=45000000000000000,
+        network_magic=1,
+        epoch_length=432000,
+        system_start=1654041600,
+        slots_per_kes_period=129600,
+        slot_length=1,
+        max_kes_evolutions=62,
+        security_param=2160,
+    )
+
+
+def _reference(tx_in: TransactionInput) -> str:
+    return f"{tx_in.transaction_id}#{tx_in.index}"
+
+
+class LedgerSimulator(ChainContext):
+    """A single-node chain kept in memory.
+
+    Submitted transactions are checked the way a node would check them
+    (inputs exist and are unspent, validity interval, value conservation,
+    fee, minimum UTxO value, size and key witnesses) and rejected with
+    ``TransactionFailedException`` otherwise. Plutus scripts are not run:
+    ``evaluate_tx`` reports fixed execution units per redeemer tag.
+
+    Slots follow the wall clock of the configured network. With
+    ``block_time`` 0 every accepted transaction is confirmed immediately;
+    otherwise it waits in the mempool until the next block, which is cut
+    every ``block_time`` seconds. Address queries only see confirmed
+    transactions, but new transactions may spend mempool outputs.
+
+    The simulator is safe to use from the worker threads ``ChainQuery``
+    builds transactions in.
+
+    Attributes:
+        block_time: Seconds between blocks, 0 to confirm on submission.
+        execution_units: (mem, steps) reported for each redeemer tag.
+        stats: Number of queries, submissions, rejections and confirmations.
+    """
+
+    def __init__(
+        self,
+        network: Network = Network.TESTNET,
+        block_time: float = 0.0,
+        protocol_param: Optional[ProtocolParameters] = None,
+        genesis_param: Optional[GenesisParameters] = None,
+    ) -> None:
+        self._network = network
+        self.block_time = block_time
+        self._protocol_param = protocol_param or default_protocol_parameters()
+        self._genesis_param = genesis_param or default_genesis_parameters()
+        self.execution_units: Dict[str, Tuple[int, int]] = dict(DEFAULT_EXECUTION_UNITS)
+        self.stats: Counter = Counter()
+
+        self._lock = threading.RLock()
+        self._time_shift = 0.0
+        self._unspent: Dict[TransactionInput, TransactionOutput] = {}
+        self._by_address: Dict[str, Dict[TransactionInput, None]] = {}
+        self._mempool: List[Transaction] = []
+        self._pending_outputs: Dict[TransactionInput, TransactionOutput] = {}
+        self._pending_spent: set = set()
+        self._confirmed: Dict[TransactionId, int] = {}
+        # Confirmed transactions in order, with the slot they were confirmed
+        # at and the outputs they spent.
+        self._history: List[Tuple[int, Transaction, List[TransactionOutput]]] = []
+        self._last_block_at = time.monotonic()
+        self._seed_count = 0
+
+    # ChainContext interface
+
+    @property
+    def protocol_param(self) -> ProtocolParameters:
+        return self._protocol_param
+
+    @property
+    def genesis_param(self) -> GenesisParameters:
+        return self._genesis_param
+
+    @property
+    def network(self) -> Network:
+        return self._network
+
+    @property
+    def epoch(self) -> int:
+        return self.last_block_slot // self._genesis_param.epoch_length
+
+    @property
+    def last_block_slot(self) -> int:
+        self._produce_blocks()
+        return self.current_slot()
+
+    def _utxos(self, address: str) -> List[UTxO]:
+        self._produce_blocks()
+        with self._lock:
+            self.stats["utxos"] += 1
+            return [
+                UTxO(tx_in, deepcopy(self._unspent[tx_in]))
+                for tx_in in self._by_address.get(address, ())
+            ]
+
+    def submit_tx(self, tx: Union[Transaction, bytes, str]):
+        """``ChainContext.submit_tx`` without its ``log_state`` decorator.
+
+        The decorator pretty-prints every attribute of the context on each
+        call, here the whole simulated ledger, whatever the log level.
+        """
+        if isinstance(tx, Transaction):
+            tx = tx.to_cbor()
+        return self.submit_tx_cbor(tx)
+
+    def submit_tx_cbor(self, cbor: Union[bytes, str]):
+        if isinstance(cbor, str):
+            cbor = bytes.fromhex(cbor)
+        tx = Transaction.from_cbor(cbor)
+        self._produce_blocks()
+        with self._lock:
+            self.stats["submit"] += 1
+            try:
+                self._validate(tx, len(cbor))
+            except TransactionFailedException:
+                self.stats["rejected"] += 1
+                raise
+            self._accept(tx)
+        return tx.id
+
+    def evaluate_tx_cbor(self, cbor: Union[bytes, str]) -> Dict[str, ExecutionUnits]:
+        if isinstance(cbor, str):
+            cbor = bytes.fromhex(cbor)
+        tx = Transaction.from_cbor(cbor)
+        self.stats["evaluate"] += 1
+        result = {}
+        for tag, index in self._redeemer_keys(tx):
+            name = tag.name.lower()
+            mem, steps = self.execution_units.get(
+                name, DEFAULT_EXECUTION_UNITS["spend"]
+            )
+            result[f"{name}:{index}"] = ExecutionUnits(mem, steps)
+        return result
+
+    # Clock and blocks
+
+    def current_slot(self) -> int:
+        """Slot of the current wall-clock time (plus any ``advance``)."""
+        return int(time.time() + self._time_shift) - SLOT_ZERO_POSIX.get(
+            self._network, 0
+        )
+
+    def posix_time(self, slot: Optional[int] = None) -> int:
+        """POSIX time in seconds of ``slot`` (default: the current slot)."""
+        if slot is None:
+            slot = self.current_slot()
+        return slot + SLOT_ZERO_POSIX.get(self._network, 0)
+
+    def advance(self, seconds: float) -> None:
+        """Move the clock forward, cutting the blocks that fall due."""
+        with self._lock:
+            self._time_shift += seconds
+            self._last_block_at -= seconds
+        self._produce_blocks()
+
+    def produce_block(self) -> List[TransactionId]:
+        """Confirm every mempool transaction now.
+
+        Returns:
+            List[TransactionId]: The confirmed transactions.
+        """
+        with self._lock:
+            mempool, self._mempool = self._mempool, []
+            slot = self.current_slot()
+            for tx in mempool:
+                self._apply(tx, slot)
+            self._pending_outputs.clear()
+            self._pending_spent.clear()
+            self._last_block_at = time.monotonic()
+            return [tx.id for tx in mempool]
+
+    def _produce_blocks(self) -> None:
+        if self.block_time > 0 and self._mempool:
+            if time.monotonic() - self._last_block_at >= self.block_time:
+                self.produce_block()
+
+    def is_confirmed(self, tx_id: Union[str, TransactionId]) -> bool:
+        """Whether the transaction ``tx_id`` is on the simulated chain."""
+        if isinstance(tx_id, str):
+            tx_id = TransactionId.from_primitive(tx_id)
+        self._produce_blocks()
+        with self._lock:
+            return tx_id in self._confirmed
+
+    def confirmed_slot(self, tx_id: Union[str, TransactionId]) -> Optional[int]:
+        """Slot the transaction ``tx_id`` was confirmed at, None if it was not."""
+        if isinstance(tx_id, str):
+            tx_id = TransactionId.from_primitive(tx_id)
+        with self._lock:
+            return self._confirmed.get(tx_id)
+
+    @property
+    def mempool_size(self) -> int:
+        return len(self._mempool)
+
+    # Ledger state
+
+    def seed(
+        self,
+        address: Union[str, Address],
+        amount: Union[int, Value],
+        datum=None,
+        script=None,
+        tx_in: Optional[TransactionInput] = None,
+    ) -> UTxO:
+        """Create a confirmed UTxO out of thin air.
+
+        Args:
+            address: Owner of the new output.
+            amount: Lovelace or value of the output.
+            datum: Inline datum, stored as raw CBOR like the backends return it.
+            script: Reference script of the output.
+            tx_in: Input of the new UTxO. A synthetic one is made when omitted.
+
+        Returns:
+            UTxO: The new UTxO.
+        """
+        if isinstance(address, str):
+            address = Address.from_primitive(address)
+        if datum is not None and not isinstance(datum, RawCBOR):
+            datum = RawCBOR(datum.to_cbor())
+        output = TransactionOutput(address, amount, datum=datum, script=script)
+        with self._lock:
+            if tx_in is None:
+                self._seed_count += 1
+                tx_in = TransactionInput(
+                    TransactionId(
+                        hashlib.blake2b(
+                            f"seed-{self._seed_count}".encode(), digest_size=32
+                        ).digest()
+                    ),
+                    0,
+                )
+            self._add_output(tx_in, output)
+        return UTxO(tx_in, output)
+
+    def transactions(
+        self, start: int = 0
+    ) -> List[Tuple[int, Transaction, List[TransactionOutput]]]:
+        """Confirmed transactions from position ``start`` on.
+
+        Returns:
+            List[Tuple[int, Transaction, List[TransactionOutput]]]: The slot
+            each was confirmed at, the transaction and the outputs it spent.
+        """
+        with self._lock:
+            return self._history[start:]
+
+    def utxo(self, tx_in: TransactionInput) -> Optional[UTxO]:
+        """The confirmed UTxO at ``tx_in``, if it is unspent."""
+        with self._lock:
+            output = self._unspent.get(tx_in)
+            return UTxO(tx_in, deepcopy(output)) if output is not None else None
+
+    def _add_output(self, tx_in: TransactionInput, output: TransactionOutput) -> None:
+        self._unspent[tx_in] = output
+        self._by_address.setdefault(str(output.address), {})[tx_in] = None
+
+    def _spend(self, tx_in: TransactionInput) -> None:
+        output = self._unspent.pop(tx_in)
+        self._by_address[str(output.address)].pop(tx_in, None)
+
+    def _lookup(self, tx_in: TransactionInput) -> Optional[TransactionOutput]:
+        """Output at ``tx_in`` as the mempool sees it (confirmed or pending)."""
+        if tx_in in self._pending_spent:
+            return None
+        output = self._unspent.get(tx_in)
+        return output if output is not None else self._pending_outputs.get(tx_in)
+
+    @staticmethod
+    def _normalize_datums(tx: Transaction) -> None:
+        # Backends hand inline datums back as raw CBOR.
+        for output in tx.transaction_body.outputs:
+            datum = output.datum
+            if datum is not None and not isinstance(datum, RawCBOR):
+                if hasattr(datum, "to_cbor"):
+                    output.datum = RawCBOR(datum.to_cbor())
+                else:
+                    output.datum = RawCBOR(cbor2.dumps(datum, default=default_encoder))
+
+    def _accept(self, tx: Transaction) -> None:
+        self._normalize_datums(tx)
+        if self.block_time > 0:
+            self._mempool.append(tx)
+            self._pending_spent.update(tx.transaction_body.inputs)
+            for index, output in enumerate(tx.transaction_body.outputs):
+                self._pending_outputs[TransactionInput(tx.id, index)] = output
+        else:
+            self._apply(tx, self.current_slot())
+
+    def _apply(self, tx: Transaction, slot: int) -> None:
+        spent = [self._unspent[tx_in] for tx_in in tx.transaction_body.inputs]
+        self._history.append((slot, tx, spent))
+        for tx_in in tx.transaction_body.inputs:
+            self._spend(tx_in)
+        for index, output in enumerate(tx.transaction_body.outputs):
+            self._add_output(TransactionInput(tx.id, index), output)
+        self._confirmed[tx.id] = slot
+        self.stats["confirmed"] += 1
+
+    # Validation
+
+    @staticmethod
+    def _redeemer_keys(tx: Transaction):
+        redeemers = tx.transaction_witness_set.redeemer
+        if not redeemers:
+            return []
+        if isinstance(redeemers, RedeemerMap):
+            return [(key.tag, key.index) for key in redeemers]
+        return [(r.tag, r.index) for r in redeemers]
+
+    @staticmethod
+    def _ex_units_total(tx: Transaction) -> Tuple[int, int]:
+        redeemers = tx.transaction_witness_set.redeemer
+        if not redeemers:
+            return 0, 0
+        if isinstance(redeemers, RedeemerMap):
+            redeemers = redeemers.values()
+        values = list(redeemers)
+        return (
+            sum(value.ex_units.mem for value in values),
+            sum(value.ex_units.steps for value in values),
+        )
+
+    def _reject(self, reason: str, detail: str) -> None:
+        raise TransactionFailedException(f"{reason}: {detail}")
+
+    def _validate(self, tx: Transaction, size: int) -> None:
+        body = tx.transaction_body
+        params = self._protocol_param
+        if tx.id in self._confirmed or any(tx.id == m.id for m in self._mempool):
+            self._reject("DuplicateTransaction", str(tx.id))
+        if size > params.max_tx_size:
+            self._reject("MaxTxSizeUTxO", f"{size} > {params.max_tx_size}")
+
+        slot = self.current_slot()
+        if body.validity_start is not None and slot < body.validity_start:
+            self._reject(
+                "OutsideValidityIntervalUTxO", f"{slot} < {body.validity_start}"
+            )
+        if body.ttl is not None and slot >= body.ttl:
+            self._reject("OutsideValidityIntervalUTxO", f"{slot} >= {body.ttl}")
+
+        spent = []
+        for tx_in in body.inputs:
+            output = self._lookup(tx_in)
+            if output is None:
+                self._reject("BadInputsUTxO", _reference(tx_in))
+            spent.append(output)
+        for tx_in in body.reference_inputs or []:
+            if self._lookup(tx_in) is None:
+                self._reject("BadInputsUTxO", f"reference input {_reference(tx_in)}")
+
+        redeemer_keys = self._redeemer_keys(tx)
+        if redeemer_keys:
+            if not body.collateral:
+                self._reject("NoCollateralInputs", str(tx.id))
+            for tx_in in body.collateral:
+                if self._lookup(tx_in) is None:
+                    self._reject("BadInputsUTxO", f"collateral {_reference(tx_in)}")
+
+        consumed = Value(0)
+        for output in spent:
+            consumed += output.amount
+        if body.mint:
+            consumed += Value(0, body.mint)
+        produced = Value(body.fee)
+        for output in body.outputs:
+            produced += output.amount
+        if consumed != produced:
+            self._reject(
+                "ValueNotConservedUTxO", f"consumed {consumed}, produced {produced}"
+            )
+
+        mem, steps = self._ex_units_total(tx)
+        if mem > params.max_tx_ex_mem or steps > params.max_tx_ex_steps:
+            self._reject("ExUnitsTooBigUTxO", f"mem {mem}, steps {steps}")
+        min_fee = fee(self, size, steps, mem)
+        if body.fee < min_fee:
+            self._reject("FeeTooSmallUTxO", f"{body.fee} < {min_fee}")
+
+        for output in body.outputs:
+            required = min_lovelace_post_alonzo(output, self)
+            if output.amount.coin < required:
+                self._reject(
+                    "BabbageOutputTooSmallUTxO", f"{output.amount.coin} < {required}"
+                )
+
+        self._check_witnesses(tx, spent)
+
+    def _check_witnesses(self, tx: Transaction, spent: List[TransactionOutput]) -> None:
+        body_hash = tx.transaction_body.hash()
+        signers = set()
+        for witness in tx.transaction_witness_set.vkey_witnesses or []:
+            try:
+                VerifyKey(witness.vkey.payload[:32]).verify(
+                    body_hash, witness.signature
+                )
+            except BadSignatureError:
+                self._reject("InvalidWitnessesUTXOW", str(witness.vkey))
+            signers.add(witness.vkey.hash())
+
+        required = {
+            output.address.payment_part
+            for output in spent
+            if isinstance(output.address.payment_part, VerificationKeyHash)
+        }
+        required.update(tx.transaction_body.required_signers or [])
+        missing = required - signers
+        if missing:
+            self._reject(
+                "MissingVKeyWitnessesUTXOW", ", ".join(str(pkh) for pkh in missing)
+            )
+
+
+def seed_demo_state(
+    ledger: LedgerSimulator,
+    *,
+    user_address: Address,
+    oracle_address: Address,
+    swap_address: Address,
+    oracle_nft: MultiAsset,
+    aggstate_nft: MultiAsset,
+    swap_nft: MultiAsset,
+    token_a: MultiAsset,
+    c3_token_hash: ScriptHash,
+    c3_token_name: AssetName,
+    reference_script_input: TransactionInput,
+    oracle_script: PlutusV2Script,
+    price: int = 2500000,
+    wallet_utxos: int = 5,
+    wallet_lovelace: int = 1000000000,
+) -> None:
+    """Pre-seed ``ledger`` with everything the swap and ODV flows read.
+
+    The oracle contract gets a price feed (valid for an hour), the aggstate
+    UTxO and the oracle reference script; the swap contract gets its NFT
+    with tADA and tUSDT liquidity; the wallet gets pure-ADA UTxOs, a
+    collateral UTxO and a UTxO holding tUSDT and C3 tokens.
+
+    Args:
+        ledger: The simulator to seed.
+        price: Oracle exchange rate with six decimals.
+        wallet_utxos: Number of pure-ADA wallet UTxOs.
+        wallet_lovelace: Lovelace held by each of them.
+    """
+    now_ms = ledger.posix_time() * 1000
+    feed = GenericData(PriceData({0: price, 1: now_ms, 2: now_ms + 3600000}))
+    ledger.seed(oracle_address, Value(2000000, deepcopy(oracle_nft)), datum=feed)
+
+    platform_pkh = user_address.payment_part.payload
+    settings = OracleSettings(
+        os_node_list=IndefiniteList(
+            [hashlib.blake2b(bytes([i]), digest_size=28).digest() for i in range(4)]
+        ),
+        os_updated_nodes=6000,
+        os_updated_node_time=3600000,
+        os_aggregate_time=1800000,
+        os_aggregate_change=200,
+        os_minimum_deposit=1000000000,
+        os_aggregate_valid_range=600000,
+        os_node_fee_price=PriceRewards(
+            node_fee=1000000, aggregate_fee=2000000, platform_fee=1000000
+        ),
+        os_iqr_multiplier=0,
+        os_divergence=0,
+        os_platform=OraclePlatform(IndefiniteList([platform_pkh]), 1),
+    )
+    ledger.seed(
+        oracle_address,
+        Value(5000000, deepcopy(aggstate_nft)),
+        datum=AggDatum(AggState(settings)),
+    )
+    ledger.seed(
+        oracle_address,
+        50000000,
+        script=oracle_script,
+        tx_in=reference_script_input,
+    )
+
+    ((token_a_policy, token_a_assets),) = token_a.items()
+    ((token_a_name, _),) = token_a_assets.items()
+    swap_assets = deepcopy(swap_nft)
+    swap_assets += MultiAsset({token_a_policy: Asset({token_a_name: 10000000})})
+    ledger.seed(swap_address, Value(10000 * 1000000, swap_assets))
+
+    for _ in range(wallet_utxos):
+        ledger.seed(user_address, wallet_lovelace)
+    ledger.seed(user_address, 30000000)
+    wallet_assets = MultiAsset({token_a_policy: Asset({token_a_name: 1000000})})
+    wallet_assets += MultiAsset({c3_token_hash: Asset({c3_token_name: 1000000000})})
+    ledger.seed(user_address, Value(5000000, wallet_assets))
@@ -0,0 +1,690 @@
+"""Local index of the swap contract's trades, for volume and liquidity analytics.
+
+Every trade or liquidity deposit spends the swap UTxO and creates a new one
+holding the swap NFT, so the chain of outputs holding the NFT is the
+contract's activity. A ``SwapActivityIndexer`` follows that chain from a
+source and stores one ``SwapEvent`` per transaction in a
+``SwapActivityStore``: the decoded redeemer, the liquidity left in the swap
+UTxO and how much it changed.
+
+Sources:
+
+* ``BlockfrostSwapSource`` pages the transactions of the swap NFT and reads
+  each one's inputs, outputs and redeemer, many at a time.
+* ``KupoSwapSource`` reads the NFT's outputs at the swap address created
+  since the last indexed slot in one query. Kupo does not index the
+  trader's inputs, so its events have no user, and the redeemer is only
+  known when Kupo reports it for the spent output; otherwise the kind of
+  event is inferred from the liquidity deltas.
+* ``SimulatorSwapSource`` reads the ledger simulator's confirmed
+  transactions.
+
+Each source keeps a cursor in the store, so ``sync`` only reads what is new
+and can be called again to follow the tip.
+
+The store is a SQLite database, with indexes on the time, the user and the
+slot, so the aggregates are single ``GROUP BY`` queries.
+"""
+
+import asyncio
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from dataclasses import astuple, dataclass, fields
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pycardano import MultiAsset, Network, RedeemerMap, Transaction
+from pycardano.exception import DeserializeException
+
+from .metrics import metrics
+from .ratelimit import request_budget
+from .redeemers import AddLiquidity, SwapA, SwapB
+from .simulator import SLOT_ZERO_POSIX
+
+if TYPE_CHECKING:
+    from blockfrost import BlockFrostApi
+
+    from .kupo import KupoContext, KupoOutput
+    from .simulator import LedgerSimulator
+
+logger = logging.getLogger("swap_activity")
+
+DEFAULT_PATH = "swap-activity.sqlite3"
+
+PERIODS = {"hour": 3600, "day": 86400, "week": 604800}
+
+TRADES = ("swap_a", "swap_b")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS swap_events (
+    tx_id TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL,
+    tx_index INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    amount INTEGER,
+    user TEXT,
+    lovelace INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    lovelace_delta INTEGER NOT NULL,
+    token_delta INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS swap_events_time ON swap_events (time, kind);
+CREATE INDEX IF NOT EXISTS swap_events_user ON swap_events (user, kind);
+CREATE INDEX IF NOT EXISTS swap_events_slot ON swap_events (slot, tx_index);
+CREATE TABLE IF NOT EXISTS cursors (
+    source TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+"""
+
+
+def activity_path(configyaml: dict) -> str:
+    """File of the ``swap_activity`` config section."""
+    settings = configyaml.get("swap_activity") or {}
+    return settings.get("path", DEFAULT_PATH)
+
+
+@dataclass(frozen=True)
+class SwapEvent:
+    """One transaction moving the swap NFT to a new output.
+
+    Attributes:
+        tx_id: Transaction id (hex).
+        slot: Slot of the block including it.
+        tx_index: Position of the transaction in its block.
+        time: POSIX time of the block, in seconds.
+        kind: ``swap_a`` (tUSDT sold for tADA), ``swap_b`` (tADA sold for
+            tUSDT), ``add_liquidity``, ``start`` (first output holding the
+            NFT) or ``other``.
+        amount: Amount sold, as in the redeemer: tUSDT for ``swap_a``, tADA
+            for ``swap_b``.
+        user: Address (bech32) of the first input not at the swap address.
+        lovelace: Lovelace left in the swap UTxO.
+        tokens: tUSDT left in the swap UTxO.
+        lovelace_delta: Change of ``lovelace``.
+        token_delta: Change of ``tokens``.
+    """
+
+    tx_id: str
+    slot: int
+    tx_index: int
+    time: int
+    kind: str
+    amount: Optional[int]
+    user: Optional[str]
+    lovelace: int
+    tokens: int
+    lovelace_delta: int
+    token_delta: int
+
+
+def decode_redeemer(cbor: bytes) -> Tuple[str, Optional[int]]:
+    """Kind of event and amount of a swap redeemer.
+
+    Returns:
+        Tuple[str, Optional[int]]: ``other`` and None for an unknown one.
+    """
+    for cls, kind in ((SwapA, "swap_a"), (SwapB, "swap_b")):
+        try:
+            return kind, cls.from_cbor(cbor).amount
+        except DeserializeException:
+            continue
+    try:
+        AddLiquidity.from_cbor(cbor)
+        return "add_liquidity", None
+    except DeserializeException:
+        return "other", None
+
+
+def infer_kind(lovelace_delta: int, token_delta: int) -> Tuple[str, Optional[int]]:
+    """Kind of event and amount sold, from the liquidity deltas alone."""
+    if token_delta > 0 and lovelace_delta <= 0:
+        return "swap_a", token_delta
+    if token_delta < 0 and lovelace_delta > 0:
+        return "swap_b", lovelace_delta // 1000000
+    if token_delta >= 0 and lovelace_delta >= 0:
+        return "add_liquidity", None
+    return "other", None
+
+
+def make_event(
+    tx_id: str,
+    slot: int,
+    tx_index: int,
+    time: int,
+    before: Optional[Tuple[int, int]],
+    after: Tuple[int, int],
+    redeemer: Optional[bytes] = None,
+    user: Optional[str] = None,
+) -> SwapEvent:
+    """Event of a transaction turning the ``before`` liquidity into ``after``.
+
+    Args:
+        before: Lovelace and tUSDT of the spent swap UTxO, None when the
+            transaction did not spend one.
+        after: Lovelace and tUSDT of the new swap UTxO.
+        redeemer: CBOR of the swap UTxO's redeemer, if known.
+    """
+    lovelace, tokens = after
+    lovelace_delta, token_delta = (
+        (lovelace - before[0], tokens - before[1]) if before else (lovelace, tokens)
+    )
+    if before is None:
+        kind, amount = "start", None
+    elif redeemer is not None:
+        kind, amount = decode_redeemer(redeemer)
+    else:
+        kind, amount = infer_kind(lovelace_delta, token_delta)
+    return SwapEvent(
+        tx_id,
+        slot,
+        tx_index,
+        time,
+        kind,
+        amount,
+        user,
+        lovelace,
+        tokens,
+        lovelace_delta,
+        token_delta,
+    )
+
+
+class SwapActivityStore:
+    """SQLite store of swap events and of the sources' cursors.
+
+    Events are stored in chain order, so the rowid orders them too.
+
+    Attributes:
+        path: Database file, ``:memory:`` for a store that is not kept.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM swap_events").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+    def cursor(self, source: str) -> Optional[int]:
+        """Position ``source`` resumes from, None before the first sync."""
+        row = self.db.execute(
+            "SELECT position FROM cursors WHERE source = ?", (source,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, events: Iterable[SwapEvent], source: str, position: int) -> int:
+        """Store ``events`` and move the cursor of ``source``, atomically.
+
+        Events already stored are skipped, so a batch can be indexed again.
+
+        Returns:
+            int: Number of events stored.
+        """
+        placeholders = ", ".join("?" * len(fields(SwapEvent)))
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                f"INSERT OR IGNORE INTO swap_events VALUES ({placeholders})",
+                map(astuple, events),
+            )
+            added = self.db.total_changes - before
+            self.db.execute(
+                "INSERT OR REPLACE INTO cursors VALUES (?, ?)", (source, position)
+            )
+        return added
+
+    def latest(self) -> Optional[SwapEvent]:
+        """The last event stored."""
+        row = self.db.execute(
+            "SELECT * FROM swap_events ORDER BY rowid DESC LIMIT 1"
+        ).fetchone()
+        return SwapEvent(*row) if row else None
+
+    def events(
+        self, since: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[SwapEvent]:
+        """Events from POSIX time ``since`` on, the latest ``limit`` at most."""
+        rows = self.db.execute(
+            "SELECT * FROM (SELECT rowid, * FROM swap_events WHERE time >= ? "
+            "ORDER BY rowid DESC LIMIT ?) ORDER BY rowid",
+            (since or 0, -1 if limit is None else limit),
+        ).fetchall()
+        return [SwapEvent(*row[1:]) for row in rows]
+
+    def volume(self, period: int, since: Optional[int] = None) -> List[Dict]:
+        """Trades per ``period`` seconds.
+
+        Returns:
+            List[Dict]: Per period start (POSIX seconds), the number of
+            trades of each side and the tUSDT and lovelace that changed
+            hands.
+        """
+        rows = self.db.execute(
+            "SELECT time / ? * ? AS start, COUNT(*), SUM(kind = 'swap_a'), "
+            "SUM(kind = 'swap_b'), SUM(ABS(token_delta)), SUM(ABS(lovelace_delta)) "
+            "FROM swap_events WHERE kind IN (?, ?) AND time >= ? "
+            "GROUP BY start ORDER BY start",
+            (period, period, *TRADES, since or 0),
+        ).fetchall()
+        keys = ("start", "trades", "swap_a", "swap_b", "tokens", "lovelace")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def liquidity_curve(self, period: int, since: Optional[int] = None) -> List[Dict]:
+        """Liquidity of the swap UTxO at the end of each ``period`` seconds.
+
+        Returns:
+            List[Dict]: Per period start with activity, the lovelace and
+            tUSDT left by its last event.
+        """
+        # SQLite takes the bare columns from the row holding the MAX.
+        rows = self.db.execute(
+            "SELECT time / ? * ? AS start, lovelace, tokens, MAX(rowid) "
+            "FROM swap_events WHERE time >= ? GROUP BY start ORDER BY start",
+            (period, period, since or 0),
+        ).fetchall()
+        return [
+            {"start": start, "lovelace": lovelace, "tokens": tokens}
+            for start, lovelace, tokens, _ in rows
+        ]
+
+    def trades_per_user(self, limit: Optional[int] = None) -> List[Dict]:
+        """Users by number of trades, most active first."""
+        rows = self.db.execute(
+            "SELECT user, COUNT(*) AS trades, SUM(kind = 'swap_a'), "
+            "SUM(kind = 'swap_b') FROM swap_events "
+            "WHERE user IS NOT NULL AND kind IN (?, ?) "
+            "GROUP BY user ORDER BY trades DESC, user LIMIT ?",
+            (*TRADES, -1 if limit is None else limit),
+        ).fetchall()
+        keys = ("user", "trades", "swap_a", "swap_b")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class SwapActivitySource(ABC):
+    """Where the swap events are read from.
+
+    Attributes:
+        name: Key of the source's cursor in the store.
+        swap_address: Address of the swap contract (bech32).
+        policy_id: Policy of the swap NFT (hex).
+        asset_name: Name of the swap NFT (hex).
+        token_policy_id: Policy of tUSDT (hex).
+        token_name: Name of tUSDT (hex).
+    """
+
+    name: str
+
+    def __init__(
+        self, swap_address: str, swap_nft: MultiAsset, token: MultiAsset
+    ) -> None:
+        self.swap_address = swap_address
+        self.policy_id, self.asset_name = _unit(swap_nft)
+        self.token_policy_id, self.token_name = _unit(token)
+
+    @abstractmethod
+    def batches(
+        self, position: Optional[int], previous: Optional[SwapEvent]
+    ) -> AsyncIterator[Tuple[List[SwapEvent], int]]:
+        """Yield the events after ``position`` in batches.
+
+        Args:
+            position: The cursor of the last sync, None for the first one.
+            previous: The last event stored.
+
+        Yields:
+            Tuple[List[SwapEvent], int]: The events of a batch, in chain
+            order, and the cursor after it.
+        """
+
+
+def _unit(asset: MultiAsset) -> Tuple[str, str]:
+    ((policy_id, assets),) = asset.items()
+    (asset_name, *_) = assets
+    return policy_id.payload.hex(), asset_name.payload.hex()
+
+
+class SimulatorSwapSource(SwapActivitySource):
+    """Events of the transactions the ledger simulator confirmed.
+
+    The cursor is the number of confirmed transactions read, and an event's
+    ``tx_index`` is the position of its transaction among them.
+    """
+
+    name = "simulator"
+
+    def __init__(
+        self,
+        simulator: "LedgerSimulator",
+        swap_address: str,
+        swap_nft: MultiAsset,
+        token: MultiAsset,
+        batch_size: int = 500,
+    ) -> None:
+        super().__init__(swap_address, swap_nft, token)
+        self.simulator = simulator
+        self.swap_nft = swap_nft
+        self.token = token
+        self.batch_size = batch_size
+
+    async def batches(self, position, previous):
+        position = position or 0
+        while True:
+            history = self.simulator.transactions(position)[: self.batch_size]
+            if not history:
+                return
+            events = []
+            for offset, (slot, tx, spent) in enumerate(history):
+                event = self._event(position + offset, slot, tx, spent)
+                if event is not None:
+                    events.append(event)
+            position += len(history)
+            yield events, position
+
+    def _event(
+        self, index: int, slot: int, tx: Transaction, spent
+    ) -> Optional[SwapEvent]:
+        after = next((o for o in tx.transaction_body.outputs if self._is_swap(o)), None)
+        if after is None:
+            return None
+        before = next((o for o in spent if self._is_swap(o)), None)
+        user = next(
+            (str(o.address) for o in spent if str(o.address) != self.swap_address),
+            None,
+        )
+        return make_event(
+            str(tx.id),
+            slot,
+            index,
+            self.simulator.posix_time(slot),
+            self._liquidity(before) if before is not None else None,
+            self._liquidity(after),
+            self._redeemer(tx),
+            user,
+        )
+
+    def _is_swap(self, output) -> bool:
+        return (
+            str(output.address) == self.swap_address
+            and output.amount.multi_asset >= self.swap_nft
+        )
+
+    def _liquidity(self, output) -> Tuple[int, int]:
+        ((policy_id, assets),) = self.token.items()
+        ((asset_name, _),) = assets.items()
+        tokens = output.amount.multi_asset.get(policy_id, {}).get(asset_name, 0)
+        return output.amount.coin, tokens
+
+    @staticmethod
+    def _redeemer(tx: Transaction) -> Optional[bytes]:
+        redeemers = tx.transaction_witness_set.redeemer
+        if not redeemers:
+            return None
+        if isinstance(redeemers, RedeemerMap):
+            data = [value.data for value in redeemers.data.values()]
+        else:
+            data = [r.data for r in redeemers]
+        # The swap UTxO is the only script input of the swap transactions.
+        return data[0].to_cbor() if data else None
+
+
+class KupoSwapSource(SwapActivitySource):
+    """Events read from the swap NFT's outputs indexed by Kupo.
+
+    The cursor is the slot before the last one indexed.
+    """
+
+    name = "kupo"
+
+    def __init__(
+        self,
+        kupo: "KupoContext",
+        swap_address: str,
+        swap_nft: MultiAsset,
+        token: MultiAsset,
+        network: Network,
+        batch_size: int = 500,
+    ) -> None:
+        super().__init__(swap_address, swap_nft, token)
+        self.kupo = kupo
+        self.slot_zero = SLOT_ZERO_POSIX.get(network, 0)
+        self.batch_size = batch_size
+
+    async def batches(self, position, previous):
+        outputs: List["KupoOutput"] = []
+        async for output in self.kupo.iter_matches_kupo(
+            self.swap_address,
+            status=None,
+            created_after=position,
+            policy_id=self.policy_id,
+            asset_name=self.asset_name,
+        ):
+            outputs.append(output)
+        outputs.sort(key=lambda o: (o.created_at, o.raw.get("transaction_index", 0)))
+        before = (previous.lovelace, previous.tokens) if previous else None
+        redeemer = None
+        for start in range(0, len(outputs), self.batch_size):
+            events = []
+            for output in outputs[start : start + self.batch_size]:
+                after = (
+                    output.coin,
+                    output.quantity(self.token_policy_id, self.token_name),
+                )
+                events.append(
+                    make_event(
+                        output.tx_id,
+                        output.created_at,
+                        output.raw.get("transaction_index", 0),
+                        output.created_at + self.slot_zero,
+                        before,
+                        after,
+                        redeemer,
+                    )
+                )
+                before = after
+                # Kupo 2.7 and later report the redeemer spending an output,
+                # which is the one of the next event.
+                spent_at = output.raw.get("spent_at") or {}
+                redeemer = (
+                    bytes.fromhex(spent_at["redeemer"])
+                    if spent_at.get("redeemer")
+                    else None
+                )
+            # The last slot is read again next time, in case a batch ended
+            # partway through it; the events already stored are skipped.
+            yield events, events[-1].slot - 1
+
+
+class BlockfrostSwapSource(SwapActivitySource):
+    """Events of the swap NFT's transactions, read from Blockfrost.
+
+    The transactions of a page are read ``concurrency`` at a time, at
+    background priority so trades are not held up. The cursor is the number
+    of the NFT's transactions read.
+    """
+
+    name = "blockfrost"
+
+    page_size = 100
+
+    def __init__(
+        self,
+        api: "BlockFrostApi",
+        swap_address: str,
+        swap_nft: MultiAsset,
+        token: MultiAsset,
+        network: Network,
+        concurrency: int = 8,
+    ) -> None:
+        super().__init__(swap_address, swap_nft, token)
+        self.api = api
+        self.slot_zero = SLOT_ZERO_POSIX.get(network, 0)
+        self.concurrency = concurrency
+
+    @property
+    def nft_unit(self) -> str:
+        return self.policy_id + self.asset_name
+
+    @property
+    def token_unit(self) -> str:
+        return self.token_policy_id + self.token_name
+
+    async def batches(self, position, previous):
+        position = position or 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def read(tx) -> Optional[SwapEvent]:
+            async with semaphore:
+                return await asyncio.to_thread(self._event, tx)
+
+        while True:
+            page, skip = divmod(position, self.page_size)
+            with request_budget("swap_activity", background=True):
+                txs = await asyncio.to_thread(
+                    self.api.asset_transactions,
+                    self.nft_unit,
+                    count=self.page_size,
+                    page=page + 1,
+                    order="asc",
+                )
+            metrics.inc("blockfrost_pages", endpoint="asset_transactions")
+            txs = txs[skip:]
+            if not txs:
+                return
+            with request_budget("swap_activity", background=True):
+                events = await asyncio.gather(*map(read, txs))
+            position += len(txs)
+            yield [event for event in events if event is not None], position
+            if skip + len(txs) < self.page_size:
+                return
+
+    def _event(self, tx) -> Optional[SwapEvent]:
+        utxos = self.api.transaction_utxos(tx.tx_hash)
+        after = next((o for o in utxos.outputs if self._is_swap(o)), None)
+        if after is None:
+            return None
+        inputs = [
+            i
+            for i in utxos.inputs
+            if not i.collateral and not getattr(i, "reference", False)
+        ]
+        before = next((i for i in inputs if self._is_swap(i)), None)
+        user = next((i.address for i in inputs if i.address != self.swap_address), None)
+        redeemer = None
+        if before is not None:
+            spends = [
+                r
+                for r in self.api.transaction_redeemers(tx.tx_hash)
+                if r.purpose == "spend"
+            ]
+            if spends:
+                redeemer = bytes.fromhex(
+                    self.api.script_datum_cbor(spends[0].redeemer_data_hash).cbor
+                )
+        return make_event(
+            tx.tx_hash,
+            tx.block_time - self.slot_zero,
+            tx.tx_index,
+            tx.block_time,
+            self._liquidity(before) if before is not None else None,
+            self._liquidity(after),
+            redeemer,
+            user,
+        )
+
+    def _is_swap(self, output) -> bool:
+        return output.address == self.swap_address and any(
+            a.unit == self.nft_unit for a in output.amount
+        )
+
+    def _liquidity(self, output) -> Tuple[int, int]:
+        amounts = {a.unit: int(a.quantity) for a in output.amount}
+        return amounts.get("lovelace", 0), amounts.get(self.token_unit, 0)
+
+
+class SwapActivityIndexer:
+    """Brings a ``SwapActivityStore`` up to date from a source.
+
+    Attributes:
+        source: Where the events are read from.
+        store: Where they are stored.
+    """
+
+    def __init__(self, source: SwapActivitySource, store: SwapActivityStore) -> None:
+        self.source = source
+        self.store = store
+
+    async def sync(self) -> int:
+        """Index the events since the last sync, a batch at a time.
+
+        Returns:
+            int: Number of events stored.
+        """
+        added = 0
+        async for events, position in self.source.batches(
+            self.store.cursor(self.source.name), self.store.latest()
+        ):
+            added += self.store.add(events, self.source.name, position)
+        metrics.inc("swap_events_indexed", added, source=self.source.name)
+        return added
+
+    async def follow(self, interval: float) -> None:
+        """Index the new events every ``interval`` seconds, until cancelled."""
+        while True:
+            try:
+                added = await self.sync()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Indexing the swap activity failed")
+            else:
+                if added:
+                    logger.info("Indexed %d swap events", added)
+            await asyncio.sleep(interval)
+
+
+def _utc(seconds: int) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def print_activity(store: SwapActivityStore, period: int, limit: int = 10) -> None:
+    """Print the volume and liquidity per ``period`` and the top traders."""
+    print("Swap contract activity")
+    latest = store.latest()
+    print(
+        f"{len(store)} events stored"
+        + (f", last at slot {latest.slot}." if latest else ".")
+    )
+    volume = store.volume(period)
+    if volume:
+        print(
+            f"{'period (UTC)':16} {'trades':>7} {'swap A':>7} {'swap B':>7} "
+            f"{'tUSDT':>12} {'tADA':>14}"
+        )
+        for row in volume:
+            print(
+                f"{_utc(row['start']):16} {row['trades']:>7} {row['swap_a']:>7} "
+                f"{row['swap_b']:>7} {row['tokens']:>12} "
+                f"{row['lovelace'] / 1000000:>14.6f}"
+            )
+    curve = store.liquidity_curve(period)
+    if curve:
+        print("Liquidity at the end of each period:")
+        print(f"{'period (UTC)':16} {'tADA':>14} {'tUSDT':>12}")
+        for row in curve:
+            print(
+                f"{_utc(row['start']):16} {row['lovelace'] / 1000000:>14.6f} "
+                f"{row['tokens']:>12}"
+            )
+    users = store.trades_per_user(limit)
+    if users:
+        print("Most active users:")
+        for row in users:
+            print(
+                f"{row['trades']:>5} trades ({row['swap_a']} A, {row['swap_b']} B) "
+                f"{row['user']}"
+            )
@@ -0,0 +1,429 @@
+"""Templates for transactions that spend the same script over and over.
+
+Each swap spends the swap UTxO with the same script, redeemer tag, reference
+inputs and output layout; only the amounts, the wallet inputs and the
+collateral change. ``TransactionBuilder`` rediscovers all of that on every
+build: it deep-copies itself to evaluate the scripts, then rebuilds the
+transaction until the fee stops moving.
+
+A ``ScriptSpendTemplate`` keeps what does not change: the script witness (or
+the reference script input and its size), the cost models hashed into the
+script data hash and the collateral amount, which only depend on the
+protocol parameters. ``ScriptSpendTemplate.builder`` returns a
+``TemplatedBuilder`` for one spend. It has the parts of the
+``TransactionBuilder`` interface that ``ChainQuery`` uses to add collateral
+and balancing inputs and to build and sign, so it goes through the same
+pipeline, including the build pool. Its ``build`` assembles the
+transaction body directly and computes the exact fee from one serialized
+size. Spends the template cannot balance (no collateral, inputs short of
+the outputs, fee or change) are handed to an equivalent
+``TransactionBuilder``.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Set, Tuple, Union
+
+from pycardano import (
+    Address,
+    CostModels,
+    Datum,
+    ExecutionUnits,
+    InvalidTransactionException,
+    PlutusData,
+    PlutusV2Script,
+    ProtocolParameters,
+    Redeemer,
+    RedeemerKey,
+    RedeemerMap,
+    RedeemerTag,
+    RedeemerValue,
+    Transaction,
+    TransactionBody,
+    TransactionBuilder,
+    TransactionInput,
+    TransactionOutput,
+    TransactionWitnessSet,
+    UTxO,
+    Value,
+    VerificationKeyHash,
+    VerificationKeyWitness,
+    fee,
+    min_lovelace_post_alonzo,
+    script_data_hash,
+)
+from pycardano.txbuilder import FAKE_TX_SIGNATURE, FAKE_VKEY
+from pycardano.utils import max_tx_fee
+
+from .metrics import metrics
+
+logger = logging.getLogger("tx_templates")
+
+# Headroom added to evaluated execution units, as TransactionBuilder does.
+EXECUTION_BUFFER = 0.2
+
+# Collateral change at or below this is left to the collateral, as
+# TransactionBuilder does.
+COLLATERAL_RETURN_THRESHOLD = 1000000
+
+
+@dataclass(frozen=True)
+class _Costs:
+    """What a template derives from one set of protocol parameters."""
+
+    protocol_param: ProtocolParameters
+    cost_models: CostModels
+    collateral: int
+
+
+class ScriptSpendTemplate:
+    """Invariant parts of transactions spending one script's UTxOs.
+
+    Attributes:
+        script: The spending validator.
+        reference_script: UTxO holding ``script`` as a reference script, used
+            instead of attaching the script to every transaction.
+        execution_buffer: Share added to evaluated execution units.
+    """
+
+    def __init__(
+        self,
+        script: PlutusV2Script,
+        reference_script: Optional[UTxO] = None,
+        execution_buffer: float = EXECUTION_BUFFER,
+    ) -> None:
+        self.script = script
+        self.reference_script = reference_script
+        self.execution_buffer = execution_buffer
+        self.witness_scripts = None if reference_script else [script]
+        self.reference_script_size = len(script) if reference_script else 0
+        self._costs: Optional[_Costs] = None
+
+    def costs(self, context) -> _Costs:
+        """Cost models and collateral amount for the context's parameters.
+
+        Recomputed only when the parameters change, at an epoch boundary.
+        """
+        protocol_param = context.protocol_param
+        costs = self._costs
+        if costs is None or costs.protocol_param != protocol_param:
+            costs = self._costs = _Costs(
+                protocol_param,
+                CostModels({1: protocol_param.cost_models.get("PlutusV2", {})}),
+                max_tx_fee(context, self.reference_script_size)
+                * protocol_param.collateral_percent
+                // 100,
+            )
+        return costs
+
+    def builder(
+        self,
+        context,
+        script_utxo: UTxO,
+        redeemer: PlutusData,
+        outputs: Iterable[TransactionOutput],
+        reference_inputs: Iterable[TransactionInput] = (),
+        ex_units: Optional[ExecutionUnits] = None,
+        datum: Optional[Datum] = None,
+    ) -> "TemplatedBuilder":
+        """Builder spending ``script_utxo`` with ``redeemer``.
+
+        Args:
+            context: Chain context the transaction is built against.
+            script_utxo: UTxO locked by the template's script.
+            redeemer: Redeemer data.
+            outputs: Outputs of the transaction, before the change.
+            reference_inputs: Inputs read by the script.
+            ex_units: Execution units of the redeemer; evaluated on build
+                when not given.
+            datum: Datum of ``script_utxo`` when it only holds its hash.
+
+        Returns:
+            TemplatedBuilder: The builder, without wallet inputs.
+        """
+        return TemplatedBuilder(
+            self,
+            context,
+            script_utxo,
+            redeemer,
+            list(outputs),
+            list(reference_inputs),
+            ex_units,
+            datum,
+        )
+
+
+class TemplatedBuilder:
+    """One spend of a ``ScriptSpendTemplate``, built like a ``TransactionBuilder``.
+
+    Attributes:
+        template: The template of the spend.
+        context: Chain context the transaction is built against.
+        script_utxo: The script UTxO spent.
+        inputs: Every input, the script UTxO first.
+        outputs: Outputs before the change.
+        collaterals: Collateral inputs.
+        required_signers: Key hashes that must sign.
+        input_addresses: Addresses the fallback builder may balance from.
+        excluded_inputs: UTxOs the fallback builder must not select.
+    """
+
+    def __init__(
+        self,
+        template: ScriptSpendTemplate,
+        context,
+        script_utxo: UTxO,
+        redeemer: PlutusData,
+        outputs: List[TransactionOutput],
+        reference_inputs: List[TransactionInput],
+        ex_units: Optional[ExecutionUnits] = None,
+        datum: Optional[Datum] = None,
+    ) -> None:
+        self.template = template
+        self.context = context
+        self.script_utxo = script_utxo
+        self.redeemer = redeemer
+        self.ex_units = ex_units
+        self.datum = datum
+        self.inputs: List[UTxO] = [script_utxo]
+        self.outputs = outputs
+        self.reference_inputs = reference_inputs
+        self.collaterals: List[UTxO] = []
+        self.required_signers: Optional[List[VerificationKeyHash]] = None
+        self.input_addresses: List[Union[Address, str]] = []
+        self.excluded_inputs: List[UTxO] = []
+        self.mint = None
+        self.auxiliary_data = None
+        self._witness_set: Optional[TransactionWitnessSet] = None
+        self._fallback: Optional[TransactionBuilder] = None
+
+    def add_input(self, utxo: UTxO) -> "TemplatedBuilder":
+        self.inputs.append(utxo)
+        return self
+
+    def add_output(self, output: TransactionOutput) -> "TemplatedBuilder":
+        self.outputs.append(output)
+        return self
+
+    def add_input_address(self, address: Union[Address, str]) -> "TemplatedBuilder":
+        self.input_addresses.append(address)
+        return self
+
+    def redeemers(self) -> List[Redeemer]:
+        return [Redeemer(self.redeemer, self.ex_units)]
+
+    def to_builder(self) -> TransactionBuilder:
+        """Equivalent ``TransactionBuilder``, which can select more inputs."""
+        builder = TransactionBuilder(self.context)
+        script = self.template.reference_script or self.template.script
+        builder.add_script_input(
+            self.script_utxo,
+            script=script,
+            datum=self.datum,
+            redeemer=Redeemer(self.redeemer, self.ex_units),
+        )
+        for utxo in self.inputs[1:]:
+            builder.add_input(utxo)
+        for address in self.input_addresses:
+            builder.add_input_address(address)
+        for output in self.outputs:
+            builder.add_output(output)
+        for tx_in in self.reference_inputs:
+            builder.reference_inputs.add(tx_in)
+        builder.excluded_inputs = list(self.excluded_inputs)
+        builder.collaterals = list(self.collaterals)
+        builder.required_signers = self.required_signers
+        return builder
+
+    def build(
+        self,
+        change_address: Address,
+        auto_validity_start_offset: int = 0,
+        auto_ttl_offset: int = 120,
+    ) -> TransactionBody:
+        """Balance the spend, sending the change to ``change_address``.
+
+        Raises:
+            InvalidTransactionException: The transaction is over the size
+                limit.
+        """
+        self._fallback = None
+        context = self.context
+        costs = self.template.costs(context)
+        provided = Value()
+        for utxo in self.inputs:
+            provided += utxo.output.amount
+        requested = Value()
+        for output in self.outputs:
+            requested += output.amount
+        change = provided - requested
+        short = change.coin <= 0 or change.multi_asset.count(lambda p, n, v: v < 0)
+        change.multi_asset = change.multi_asset.filter(lambda p, n, v: v > 0)
+        if short or not self.collaterals:
+            return self._fallback_build(
+                change_address, auto_validity_start_offset, auto_ttl_offset
+            )
+
+        slot = context.last_block_slot
+        inputs = sorted(
+            self.inputs,
+            key=lambda utxo: (str(utxo.input.transaction_id), utxo.input.index),
+        )
+        collateral = self._collateral(costs.collateral, change_address)
+        if collateral is None:
+            return self._fallback_build(
+                change_address, auto_validity_start_offset, auto_ttl_offset
+            )
+        fields = dict(
+            inputs=[utxo.input for utxo in inputs],
+            validity_start=max(0, slot + auto_validity_start_offset),
+            ttl=max(0, slot + auto_ttl_offset),
+            required_signers=self.required_signers or None,
+            collateral=[utxo.input for utxo in self.collaterals],
+            collateral_return=collateral[0],
+            total_collateral=collateral[1],
+            reference_inputs=self._reference_inputs(),
+        )
+        redeemer_key = RedeemerKey(RedeemerTag.SPEND, inputs.index(self.script_utxo))
+        vkeys = self._fake_vkey_witnesses()
+
+        ex_units = self.ex_units
+        if ex_units is None:
+            body, witness_set = self._assemble(
+                fields,
+                redeemer_key,
+                ExecutionUnits(0, 0),
+                costs,
+                change,
+                0,
+                change_address,
+            )
+            witness_set.vkey_witnesses = vkeys
+            evaluated = context.evaluate_tx(Transaction(body, witness_set))
+            units = evaluated[f"spend:{redeemer_key.index}"]
+            buffer = 1 + self.template.execution_buffer
+            ex_units = ExecutionUnits(
+                int(units.mem * buffer), int(units.steps * buffer)
+            )
+
+        # Sized once with a fee of the same CBOR width as the final one:
+        # every fee is above 65535 and below 2**32, so the size is exact
+        # unless the change crosses a width boundary.
+        size = 0
+        tx_fee = 1 << 16
+        while True:
+            body, witness_set = self._assemble(
+                fields, redeemer_key, ex_units, costs, change, tx_fee, change_address
+            )
+            witness_set.vkey_witnesses = vkeys
+            tx_size = len(Transaction(body, witness_set).to_cbor())
+            if tx_size <= size:
+                break
+            size = tx_size
+            tx_fee = fee(
+                context,
+                size,
+                ex_units.steps,
+                ex_units.mem,
+                self.template.reference_script_size,
+            )
+        if size > context.protocol_param.max_tx_size:
+            raise InvalidTransactionException(
+                f"Transaction size ({size}) exceeds the max limit "
+                f"({context.protocol_param.max_tx_size})."
+            )
+        change_output = body.outputs[-1]
+        if change_output.amount.coin < min_lovelace_post_alonzo(change_output, context):
+            return self._fallback_build(
+                change_address, auto_validity_start_offset, auto_ttl_offset
+            )
+
+        witness_set.vkey_witnesses = None
+        self._witness_set = witness_set
+        metrics.inc("tx_template_builds", path="template")
+        return body
+
+    def build_witness_set(
+        self, remove_dup_script: bool = False
+    ) -> TransactionWitnessSet:
+        """Witness set of the last build, without key witnesses."""
+        if self._fallback is not None:
+            return self._fallback.build_witness_set(remove_dup_script)
+        return self._witness_set
+
+    def _fallback_build(
+        self,
+        change_address: Address,
+        auto_validity_start_offset: int,
+        auto_ttl_offset: int,
+    ) -> TransactionBody:
+        logger.debug("Template cannot balance the spend, using TransactionBuilder")
+        metrics.inc("tx_template_builds", path="fallback")
+        self._fallback = self.to_builder()
+        return self._fallback.build(
+            change_address=change_address,
+            auto_validity_start_offset=auto_validity_start_offset,
+            auto_ttl_offset=auto_ttl_offset,
+        )
+
+    def _assemble(
+        self,
+        fields: dict,
+        redeemer_key: RedeemerKey,
+        ex_units: ExecutionUnits,
+        costs: _Costs,
+        change: Value,
+        tx_fee: int,
+        change_address: Address,
+    ) -> Tuple[TransactionBody, TransactionWitnessSet]:
+        redeemers = RedeemerMap({redeemer_key: RedeemerValue(self.redeemer, ex_units)})
+        datums = [self.datum] if self.datum is not None else []
+        change_output = TransactionOutput(
+            change_address, Value(change.coin - tx_fee, change.multi_asset)
+        )
+        body = TransactionBody(
+            outputs=self.outputs + [change_output],
+            fee=tx_fee,
+            script_data_hash=script_data_hash(redeemers, datums, costs.cost_models),
+            **fields,
+        )
+        witness_set = TransactionWitnessSet(
+            plutus_v2_script=self.template.witness_scripts,
+            redeemer=redeemers,
+            plutus_data=datums or None,
+        )
+        return body, witness_set
+
+    def _collateral(
+        self, amount: int, address: Address
+    ) -> Optional[Tuple[Optional[TransactionOutput], Optional[int]]]:
+        """Collateral return and total, or None when the collateral is short."""
+        total = Value()
+        for utxo in self.collaterals:
+            total += utxo.output.amount
+        if total.coin < amount:
+            return None
+        returned = total - amount
+        if returned.coin <= COLLATERAL_RETURN_THRESHOLD and not returned.multi_asset:
+            return None, None
+        output = TransactionOutput(address, returned)
+        if returned.coin < min_lovelace_post_alonzo(output, self.context):
+            return None
+        return output, amount
+
+    def _reference_inputs(self) -> Optional[List[TransactionInput]]:
+        reference_inputs = list(self.reference_inputs)
+        if self.template.reference_script is not None:
+            reference_inputs.append(self.template.reference_script.input)
+        return reference_inputs or None
+
+    def _fake_vkey_witnesses(self) -> List[VerificationKeyWitness]:
+        """One placeholder witness per key spending or required to sign."""
+        keys: Set[bytes] = set()
+        for utxo in self.inputs[1:] + self.collaterals:
+            payment_part = utxo.output.address.payment_part
+            if isinstance(payment_part, VerificationKeyHash):
+                keys.add(payment_part.payload)
+        for signer in self.required_signers or ():
+            keys.add(signer.payload)
+        return [VerificationKeyWitness(FAKE_VKEY, FAKE_TX_SIGNATURE) for _ in keys]
@@ -0,0 +1,439 @@
+"""Compact columnar representation of large UTxO sets.
+
+A ``pyc.UTxO`` is a small tree of objects (input, output, address, value,
+multi-asset dicts), which costs kilobytes of heap per output once tens of
+thousands are held. ``UTxOTable`` keeps the same information in parallel
+numpy arrays, one row per output. Assets are stored in compressed sparse
+row form: the assets of row ``i`` are ``asset_ids[offsets[i]:offsets[i+1]]``
+with their ``quantities``, and asset ids index an interned table of
+``(policy_id, asset_name)`` pairs. Addresses, datums and script hashes are
+interned the same way.
+
+Tables are built straight from Kupo or Blockfrost responses with
+``UTxOTableBuilder``, filtered with vectorized masks, and selected rows are
+turned back into ``pyc.UTxO`` objects with ``to_utxos``. Quantities are
+signed 64-bit integers; larger token quantities are rejected.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cbor2
+import numpy as np
+import pycardano as pyc
+
+NO_REF = -1
+
+Unit = Tuple[str, str]
+
+
+class _Interner:
+    """Assigns consecutive ids to hashable values."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[Any, int] = {}
+        self.values: List[Any] = []
+
+    def __call__(self, value: Any) -> int:
+        ref = self.ids.get(value)
+        if ref is None:
+            ref = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return ref
+
+
+class UTxOTable:
+    """UTxOs as parallel arrays.
+
+    Attributes:
+        tx_ids: ``(n, 32)`` uint8 array of transaction ids.
+        indices: Output indices.
+        coins: Lovelace of each output.
+        offsets: ``n + 1`` offsets of each row's assets in ``asset_ids``.
+        asset_ids: Interned asset of each asset entry.
+        quantities: Quantity of each asset entry.
+        address_refs: Index of each row's address in ``addresses``.
+        datum_refs: Index in ``datums``, ``NO_REF`` when there is no datum.
+        script_refs: Index in ``script_hashes``, ``NO_REF`` when none.
+        units: ``(policy_id, asset_name)`` hex pairs, by asset id.
+        addresses: Bech32 addresses, by address ref.
+        datums: ``(datum_hash, inline_cbor)`` pairs, either may be None.
+        script_hashes: Reference script hashes (hex).
+    """
+
+    def __init__(
+        self,
+        tx_ids: np.ndarray,
+        indices: np.ndarray,
+        coins: np.ndarray,
+        offsets: np.ndarray,
+        asset_ids: np.ndarray,
+        quantities: np.ndarray,
+        address_refs: np.ndarray,
+        datum_refs: np.ndarray,
+        script_refs: np.ndarray,
+        units: List[Unit],
+        addresses: List[str],
+        datums: List[Tuple[Optional[str], Optional[bytes]]],
+        script_hashes: List[str],
+    ) -> None:
+        self.tx_ids = tx_ids
+        self.indices = indices
+        self.coins = coins
+        self.offsets = offsets
+        self.asset_ids = asset_ids
+        self.quantities = quantities
+        self.address_refs = address_refs
+        self.datum_refs = datum_refs
+        self.script_refs = script_refs
+        self.units = units
+        self.addresses = addresses
+        self.datums = datums
+        self.script_hashes = script_hashes
+        self._unit_ids = {unit: i for i, unit in enumerate(units)}
+
+    def __len__(self) -> int:
+        return len(self.coins)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the arrays (the interned tables are not counted)."""
+        return sum(
+            array.nbytes
+            for array in (
+                self.tx_ids,
+                self.indices,
+                self.coins,
+                self.offsets,
+                self.asset_ids,
+                self.quantities,
+                self.address_refs,
+                self.datum_refs,
+                self.script_refs,
+            )
+        )
+
+    @property
+    def asset_counts(self) -> np.ndarray:
+        """Number of distinct assets held by each row."""
+        return np.diff(self.offsets)
+
+    @property
+    def asset_rows(self) -> np.ndarray:
+        """Row of each asset entry."""
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.asset_counts)
+
+    def unit_ids(self, policy_id: str, asset_name: Optional[str] = None) -> np.ndarray:
+        """Asset ids of one asset, or of every asset of a policy."""
+        if asset_name is not None:
+            unit_id = self._unit_ids.get((policy_id, asset_name))
+            return np.array([] if unit_id is None else [unit_id], dtype=np.int32)
+        return np.array(
+            [i for i, (policy, _) in enumerate(self.units) if policy == policy_id],
+            dtype=np.int32,
+        )
+
+    def quantity_of(
+        self, policy_id: str, asset_name: Optional[str] = None
+    ) -> np.ndarray:
+        """Quantity of an asset (or all assets of a policy) in each row."""
+        hits = np.isin(self.asset_ids, self.unit_ids(policy_id, asset_name))
+        totals = np.zeros(len(self), dtype=np.int64)
+        np.add.at(totals, self.asset_rows[hits], self.quantities[hits])
+        return totals
+
+    def holding(
+        self,
+        policy_id: str,
+        asset_name: Optional[str] = None,
+        min_quantity: int = 1,
+    ) -> np.ndarray:
+        """Mask of the rows holding at least ``min_quantity`` of an asset.
+
+        Args:
+            policy_id: Policy id (hex).
+            asset_name: Asset name (hex); any asset of the policy when None.
+            min_quantity: Smallest quantity held.
+
+        Returns:
+            Boolean mask over the rows.
+        """
+        return self.quantity_of(policy_id, asset_name) >= min_quantity
+
+    def pure_ada(
+        self, min_coin: Optional[int] = None, max_coin: Optional[int] = None
+    ) -> np.ndarray:
+        """Mask of the rows holding only lovelace, within ``[min_coin, max_coin]``."""
+        mask = self.asset_counts == 0
+        if min_coin is not None:
+            mask &= self.coins >= min_coin
+        if max_coin is not None:
+            mask &= self.coins <= max_coin
+        return mask
+
+    def without_datum(self) -> np.ndarray:
+        """Mask of the rows with neither a datum nor a reference script."""
+        return (self.datum_refs == NO_REF) & (self.script_refs == NO_REF)
+
+    def excluding(self, inputs: Iterable[pyc.TransactionInput]) -> np.ndarray:
+        """Mask of the rows that are not one of ``inputs``."""
+        keys = {(bytes(i.transaction_id), i.index) for i in inputs}
+        mask = np.ones(len(self), dtype=bool)
+        if not keys:
+            return mask
+        # Compare the first 8 bytes of the tx ids first, then the candidates.
+        prefixes = np.frombuffer(b"".join(k[0][:8] for k in keys), dtype=np.uint64)
+        candidates = np.isin(self._tx_prefixes(), prefixes)
+        for row in np.flatnonzero(candidates).tolist():
+            if (self.tx_ids[row].tobytes(), int(self.indices[row])) in keys:
+                mask[row] = False
+        return mask
+
+    def _tx_prefixes(self) -> np.ndarray:
+        return np.ascontiguousarray(self.tx_ids[:, :8]).view(np.uint64).ravel()
+
+    def totals(self) -> Dict[Unit, int]:
+        """Total quantity of every asset across the table."""
+        sums = np.zeros(len(self.units), dtype=np.int64)
+        np.add.at(sums, self.asset_ids, self.quantities)
+        return {unit: int(total) for unit, total in zip(self.units, sums) if total}
+
+    def select(self, rows) -> "UTxOTable":
+        """A table of the given rows (a boolean mask or row indices)."""
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        counts = self.asset_counts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # Position p of the new asset arrays, in row j, comes from
+        # self.offsets[rows[j]] + (p - offsets[j]).
+        entries = np.repeat(self.offsets[rows] - offsets[:-1], counts) + np.arange(
+            offsets[-1]
+        )
+        return UTxOTable(
+            self.tx_ids[rows],
+            self.indices[rows],
+            self.coins[rows],
+            offsets,
+            self.asset_ids[entries],
+            self.quantities[entries],
+            self.address_refs[rows],
+            self.datum_refs[rows],
+            self.script_refs[rows],
+            self.units,
+            self.addresses,
+            self.datums,
+            self.script_hashes,
+        )
+
+    def input(self, row: int) -> pyc.TransactionInput:
+        return pyc.TransactionInput(
+            pyc.TransactionId(self.tx_ids[row].tobytes()), int(self.indices[row])
+        )
+
+    def to_utxos(
+        self,
+        rows=None,
+        resolve_script: Optional[Callable[[str], Any]] = None,
+    ) -> List[pyc.UTxO]:
+        """Build ``pyc.UTxO`` objects for the given rows (all by default).
+
+        Args:
+            rows: A boolean mask or row indices.
+            resolve_script: Returns the script of a reference script hash.
+                Reference scripts are left unset without it.
+
+        Returns:
+            List[UTxO]: The UTxOs, in row order.
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        addresses: Dict[int, pyc.Address] = {}
+        utxos = []
+        for row in rows.tolist():
+            address_ref = int(self.address_refs[row])
+            address = addresses.get(address_ref)
+            if address is None:
+                address = addresses[address_ref] = pyc.Address.from_primitive(
+                    self.addresses[address_ref]
+                )
+            multi_asset = pyc.MultiAsset()
+            for entry in range(self.offsets[row], self.offsets[row + 1]):
+                policy_id, asset_name = self.units[self.asset_ids[entry]]
+                multi_asset.setdefault(
+                    pyc.ScriptHash.from_primitive(policy_id), pyc.Asset()
+                )[pyc.AssetName.from_primitive(asset_name)] = int(
+                    self.quantities[entry]
+                )
+            datum_hash = datum = None
+            if self.datum_refs[row] != NO_REF:
+                hash_hex, cbor = self.datums[self.datum_refs[row]]
+                if cbor is not None:
+                    datum = pyc.RawCBOR(cbor)
+                elif hash_hex is not None:
+                    datum_hash = pyc.DatumHash.from_primitive(hash_hex)
+            script = None
+            if self.script_refs[row] != NO_REF and resolve_script is not None:
+                script = resolve_script(self.script_hashes[self.script_refs[row]])
+            coin = int(self.coins[row])
+            utxos.append(
+                pyc.UTxO(
+                    self.input(row),
+                    pyc.TransactionOutput(
+                        address,
+                        amount=pyc.Value(coin, multi_asset) if multi_asset else coin,
+                        datum_hash=datum_hash,
+                        datum=datum,
+                        script=script,
+                    ),
+                )
+            )
+        return utxos
+
+
+class UTxOTableBuilder:
+    """Accumulates outputs from any source and builds a ``UTxOTable``."""
+
+    def __init__(self) -> None:
+        self._tx_ids = bytearray()
+        self._indices: List[int] = []
+        self._coins: List[int] = []
+        self._counts: List[int] = []
+        self._asset_ids: List[int] = []
+        self._quantities: List[int] = []
+        self._address_refs: List[int] = []
+        self._datum_refs: List[int] = []
+        self._script_refs: List[int] = []
+        self._units = _Interner()
+        self._addresses = _Interner()
+        self._datums = _Interner()
+        self._scripts = _Interner()
+
+    def __len__(self) -> int:
+        return len(self._coins)
+
+    def add(
+        self,
+        tx_id: bytes,
+        index: int,
+        address: str,
+        coin: int,
+        assets: Iterable[Tuple[str, str, int]] = (),
+        datum_hash: Optional[str] = None,
+        datum_cbor: Optional[bytes] = None,
+        script_hash: Optional[str] = None,
+    ) -> None:
+        """Add one output; ``assets`` holds ``(policy_id, asset_name, quantity)``."""
+        self._tx_ids += tx_id
+        self._indices.append(index)
+        self._coins.append(coin)
+        count = 0
+        for policy_id, asset_name, quantity in assets:
+            self._asset_ids.append(self._units((policy_id, asset_name)))
+            self._quantities.append(quantity)
+            count += 1
+        self._counts.append(count)
+        self._address_refs.append(self._addresses(address))
+        self._datum_refs.append(
+            self._datums((datum_hash, datum_cbor))
+            if datum_hash is not None or datum_cbor is not None
+            else NO_REF
+        )
+        self._script_refs.append(self._scripts(script_hash) if script_hash else NO_REF)
+
+    def add_kupo(self, result: Dict[str, Any], address: Optional[str] = None) -> None:
+        """Add one object of a Kupo ``/matches`` response.
+
+        Inline datums are kept by hash, as Kupo serves their content from
+        ``/datums``.
+        """
+        assets = []
+        for unit, quantity in result["value"]["assets"].items():
+            policy_id, _, asset_name = unit.partition(".")
+            assets.append((policy_id, asset_name, quantity))
+        self.add(
+            bytes.fromhex(result["transaction_id"]),
+            result["output_index"],
+            address or result["address"],
+            result["value"]["coins"],
+            assets,
+            datum_hash=result.get("datum_hash"),
+            script_hash=result.get("script_hash"),
+        )
+
+    def add_blockfrost(self, result, address: str) -> None:
+        """Add one entry of Blockfrost's ``/addresses/{address}/utxos``."""
+        coin = 0
+        assets = []
+        for item in result.amount:
+            if item.unit == "lovelace":
+                coin = int(item.quantity)
+            else:
+                assets.append((item.unit[:56], item.unit[56:], int(item.quantity)))
+        inline_datum = getattr(result, "inline_datum", None)
+        self.add(
+            bytes.fromhex(result.tx_hash),
+            result.output_index,
+            address,
+            coin,
+            assets,
+            datum_hash=None if inline_datum else result.data_hash,
+            datum_cbor=bytes.fromhex(inline_datum) if inline_datum else None,
+            script_hash=getattr(result, "reference_script_hash", None),
+        )
+
+    def add_utxo(self, utxo: pyc.UTxO) -> None:
+        """Add a decoded UTxO."""
+        output = utxo.output
+        assets = [
+            (policy_id.payload.hex(), asset_name.payload.hex(), quantity)
+            for policy_id, asset in output.amount.multi_asset.items()
+            for asset_name, quantity in asset.items()
+        ]
+        datum_cbor = None
+        if isinstance(output.datum, pyc.RawCBOR):
+            datum_cbor = output.datum.cbor
+        elif output.datum is not None:
+            datum_cbor = cbor2.dumps(output.datum, default=pyc.default_encoder)
+        self.add(
+            bytes(utxo.input.transaction_id),
+            utxo.input.index,
+            str(output.address),
+            output.amount.coin,
+            assets,
+            datum_hash=output.datum_hash.payload.hex() if output.datum_hash else None,
+            datum_cbor=datum_cbor,
+            script_hash=(
+                pyc.script_hash(output.script).payload.hex() if output.script else None
+            ),
+        )
+
+    def build(self) -> UTxOTable:
+        offsets = np.zeros(len(self._counts) + 1, dtype=np.int64)
+        np.cumsum(np.array(self._counts, dtype=np.int64), out=offsets[1:])
+        return UTxOTable(
+            np.frombuffer(bytes(self._tx_ids), dtype=np.uint8).reshape(-1, 32),
+            np.array(self._indices, dtype=np.uint32),
+            np.array(self._coins, dtype=np.int64),
+            offsets,
+            np.array(self._asset_ids, dtype=np.int32),
+            np.array(self._quantities, dtype=np.int64),
+            np.array(self._address_refs, dtype=np.int32),
+            np.array(self._datum_refs, dtype=np.int32),
+            np.array(self._script_refs, dtype=np.int32),
+            self._units.values,
+            self._addresses.values,
+            self._datums.values,
+            self._scripts.values,
+        )
+
+
+def table_from_utxos(utxos: Sequence[pyc.UTxO]) -> UTxOTable:
+    """Build a table from decoded UTxOs."""
+    builder = UTxOTableBuilder()
+    for utxo in utxos:
+        builder.add_utxo(utxo)
+    return builder.build()
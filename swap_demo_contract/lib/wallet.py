@@ -0,0 +1,174 @@
+"""HD wallet key store with memoized derivations"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+from nacl.utils import random as random_bytes
+from pycardano import (
+    Address,
+    ExtendedSigningKey,
+    HDWallet,
+    Network,
+    PaymentVerificationKey,
+)
+
+# CIP-1852 derivation paths
+ACCOUNT_PATH = "m/1852'/1815'/{account}'"
+SPEND_ROLE = 0
+STAKE_ROLE = 2
+
+
+class WalletKeyStore:
+    """Derive CIP-1852 keys from a mnemonic, stretching the seed only once.
+
+    ``HDWallet.from_mnemonic`` runs a PBKDF2 seed stretch which dominates key
+    derivation. The key store does it at most once per instance, memoizes every
+    derived node by path and derives new paths from their closest known
+    ancestor, so deriving ``n`` addresses of an account costs ``n`` soft
+    derivations.
+
+    When ``cache_path`` is given the derived nodes are persisted, encrypted with
+    a key taken from the mnemonic. A later process that finds the paths it needs
+    in the cache skips the seed stretch entirely.
+
+    Attributes:
+        cache_path: Optional file holding the encrypted derived-key cache.
+    """
+
+    def __init__(self, mnemonic: str, cache_path: Optional[str] = None) -> None:
+        self._mnemonic = mnemonic
+        self._box = SecretBox(
+            hashlib.blake2b(
+                mnemonic.encode(), digest_size=32, person=b"odv-demo-keys"
+            ).digest()
+        )
+        self.cache_path = cache_path
+        self._nodes: Dict[str, HDWallet] = {}
+        self._dirty = False
+        if cache_path:
+            self._load_cache()
+
+    @property
+    def root(self) -> HDWallet:
+        """The root node, running the seed stretch on first use."""
+        if "m" not in self._nodes:
+            self._nodes["m"] = HDWallet.from_mnemonic(self._mnemonic)
+            self._dirty = True
+        return self._nodes["m"]
+
+    def derive(self, path: str) -> HDWallet:
+        """Derive (or fetch) the node at ``path``.
+
+        Args:
+            path: Derivation path such as ``m/1852'/1815'/0'/0/0``.
+
+        Returns:
+            HDWallet: The derived node.
+        """
+        node = self._nodes.get(path)
+        if node is not None:
+            return node
+
+        if path[:2] != "m/":
+            raise ValueError(f"Bad derivation path: {path}")
+
+        # Start from the deepest ancestor already derived.
+        segments = path[2:].split("/")
+        depth = len(segments)
+        while depth > 0 and "/".join(["m", *segments[:depth]]) not in self._nodes:
+            depth -= 1
+        node = self._nodes["m/" + "/".join(segments[:depth])] if depth else self.root
+
+        for i in range(depth, len(segments)):
+            segment = segments[i]
+            hardened = segment.endswith("'")
+            node = node.derive(int(segment.rstrip("'")), hardened=hardened)
+            self._nodes["m/" + "/".join(segments[: i + 1])] = node
+        self._dirty = True
+        return node
+
+    def _role_node(self, account: int, role: int, index: int) -> HDWallet:
+        return self.derive(f"{ACCOUNT_PATH.format(account=account)}/{role}/{index}")
+
+    def signing_key(self, account: int = 0, index: int = 0) -> ExtendedSigningKey:
+        """Extended payment signing key of ``account``/``index``."""
+        return ExtendedSigningKey.from_hdwallet(
+            self._role_node(account, SPEND_ROLE, index)
+        )
+
+    def credentials(
+        self, account: int = 0, index: int = 0
+    ) -> Tuple[PaymentVerificationKey, PaymentVerificationKey]:
+        """Payment and stake verification keys of ``account``/``index``."""
+        spend_vk = PaymentVerificationKey.from_primitive(
+            self._role_node(account, SPEND_ROLE, index).public_key
+        )
+        stake_vk = PaymentVerificationKey.from_primitive(
+            self._role_node(account, STAKE_ROLE, 0).public_key
+        )
+        return spend_vk, stake_vk
+
+    def address(
+        self, network: Optional[Network], account: int = 0, index: int = 0
+    ) -> Address:
+        """Base address of ``account``/``index``, staked to the account key."""
+        spend_vk, stake_vk = self.credentials(account, index)
+        return Address(spend_vk.hash(), stake_vk.hash(), network=network)
+
+    def addresses(
+        self, network: Optional[Network], count: int, account: int = 0
+    ) -> List[Address]:
+        """The first ``count`` base addresses of ``account``."""
+        return [self.address(network, account, index) for index in range(count)]
+
+    def _load_cache(self) -> None:
+        if not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, "rb") as f:
+            blob = f.read()
+        try:
+            entries = json.loads(self._box.decrypt(blob))
+        except (CryptoError, ValueError):
+            # Written with another mnemonic or corrupted: start over.
+            print(f"Ignoring unreadable key cache {self.cache_path}")
+            return
+
+        root = entries.get("m")
+        if root is None:
+            return
+        for path, entry in entries.items():
+            self._nodes[path] = HDWallet(
+                root_xprivate_key=bytes.fromhex(root["xprivate_key"]),
+                root_public_key=bytes.fromhex(root["public_key"]),
+                root_chain_code=bytes.fromhex(root["chain_code"]),
+                xprivate_key=bytes.fromhex(entry["xprivate_key"]),
+                public_key=bytes.fromhex(entry["public_key"]),
+                chain_code=bytes.fromhex(entry["chain_code"]),
+                path=path,
+            )
+
+    def save_cache(self) -> None:
+        """Persist the derived nodes if a cache file is configured."""
+        if not self.cache_path or not self._dirty or "m" not in self._nodes:
+            return
+        entries = {
+            path: {
+                "xprivate_key": bytes(node.xprivate_key).hex(),
+                "public_key": bytes(node.public_key).hex(),
+                "chain_code": bytes(node.chain_code).hex(),
+            }
+            for path, node in self._nodes.items()
+        }
+        blob = self._box.encrypt(
+            json.dumps(entries).encode(), random_bytes(SecretBox.NONCE_SIZE)
+        )
+        tmp_path = f"{self.cache_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(bytes(blob))
+        os.replace(tmp_path, self.cache_path)
+        self._dirty = False
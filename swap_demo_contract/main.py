@@ -1,222 +1,46 @@
 import argparse
-import asyncio
-import os
 import sys
-
-import cbor2
-import yaml
-from pycardano import (
-    Address,
-    Asset,
-    AssetName,
-    BlockFrostChainContext,
-    ExtendedSigningKey,
-    HDWallet,
-    MultiAsset,
-    Network,
-    OgmiosV6ChainContext,
-    PaymentSigningKey,
-    PaymentVerificationKey,
-    PlutusV2Script,
-    ScriptHash,
-    TransactionId,
-    TransactionInput,
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from .runtime import Runtime
+
+# pycardano, blockfrost, cbor2 and aiohttp take around a second to import, so
+# they are only loaded by the subcommands that use them (see ``prepare``).
+_RUNTIME_EXPORTS = (
+    "Runtime",
+    "context",
+    "create_c3_oracle_rate_nft",
+    "load_contracts_addresses",
+    "load_odv_oracle_config_tokens",
+    "load_swap_config_tokens",
+    "user_wallet_address",
+    "user_wallet_credentials",
+    "user_wallet_extended_signing_key",
 )
 
-from swap_demo_contract.lib.chain_query import ChainQuery
-from swap_demo_contract.lib.kupo import KupoContext
-
-from .lib.oracle_user import OracleUser
-from .mint import Mint
-from .swap import Swap, SwapContract
 
+def __getattr__(name):
+    """Keep the helpers that used to live here importable from this module."""
+    if name in _RUNTIME_EXPORTS:
+        from . import runtime
 
-def load_contracts_addresses(configyaml):
-    """Loads the contract addresses"""
+        return getattr(runtime, name)
+    if name in ("load_config", "validate_config"):
+        from . import config
 
-    # Fetch necessary config values
-    minting_policy = configyaml.get("dynamic_payment_oracle_minting_policy")
-    asset_name = configyaml.get("dynamic_payment_oracle_asset_name")
-    oracle_rate_address = configyaml.get("dynamic_payment_oracle_addr")
-    oracle_contract_address = configyaml.get("oracle_contract_address")
-    swap_contract_address = configyaml.get("swap_contract_address")
-
-    # Convert minting policy to ScriptHash if available
-    oracle_rate_nft_hash = (
-        ScriptHash.from_primitive(minting_policy) if minting_policy else None
-    )
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    if oracle_rate_nft_hash and asset_name and oracle_rate_address:
-        return (
-            Address.from_primitive(oracle_contract_address),
-            Address.from_primitive(swap_contract_address),
-            Address.from_primitive(oracle_rate_address),
-            create_c3_oracle_rate_nft(oracle_rate_nft_hash, asset_name),
-        )
-    else:
-        return (
-            Address.from_primitive(oracle_contract_address),
-            Address.from_primitive(swap_contract_address),
-            None,
-            None,
-        )
 
-
-def create_c3_oracle_rate_nft(minting_policy, token_name) -> MultiAsset | None:
-    """Create C3 oracle rate NFT."""
-    if token_name and minting_policy:
-        return MultiAsset.from_primitive(
-            {minting_policy.payload: {token_name.encode(): 1}}
-        )
-    else:
+def replay_latency(value: str):
+    """Parse ``--replay-latency``: seconds, or None for the recorded times."""
+    if value == "recorded":
         return None
-
-
-def load_swap_config_tokens(configyaml):
-    swap_minting_policy = ScriptHash.from_primitive(
-        configyaml.get("swap_minting_policy")
-    )
-    swap_asset_name = AssetName(configyaml.get("swap_asset_name").encode())
-    swap_nft = MultiAsset({swap_minting_policy: Asset({swap_asset_name: 1})})
-
-    token_a_minting_policy = ScriptHash.from_primitive(
-        configyaml.get("token_a_minting_policy")
-    )
-    token_a_asset_name = AssetName(configyaml.get("token_a_asset_name").encode())
-    token_a = MultiAsset({token_a_minting_policy: Asset({token_a_asset_name: 1})})
-    return (swap_nft, token_a)
-
-
-def load_odv_oracle_config_tokens(configyaml):
-    aggstate_minting_policy = ScriptHash.from_primitive(
-        configyaml.get("aggstate_minting_policy")
-    )
-    aggstate_asset_name = AssetName(configyaml.get("aggstate_asset_name").encode())
-    aggstate_nft = MultiAsset(
-        {aggstate_minting_policy: Asset({aggstate_asset_name: 1})}
-    )
-
-    oracle_nft_minting_policy = ScriptHash.from_primitive(
-        configyaml.get("oracle_nft_minting_policy")
-    )
-    oracle_nft_asset_name = AssetName(configyaml.get("oracle_nft_asset_name").encode())
-    oracle_nft = MultiAsset(
-        {oracle_nft_minting_policy: Asset({oracle_nft_asset_name: 1})}
-    )
-
-    c3_token_hash = ScriptHash.from_primitive(configyaml.get("c3_token_hash"))
-
-    c3_token_name = AssetName(configyaml.get("c3_token_name").encode())
-
-    return (aggstate_nft, oracle_nft, c3_token_hash, c3_token_name)
-
-
-def load_config():
-    """Loads the YAML configuration file."""
     try:
-        with open("config.yaml", "r", encoding="UTF-8") as config_yaml:
-            return yaml.load(config_yaml, Loader=yaml.FullLoader)
-    except FileNotFoundError:
-        print("Configuration file not found.")
-        sys.exit(1)
-
-
-def validate_config(config, connection, required_keys):
-    """Validates that all required keys exist for a connection configuration."""
-    if connection not in config or not all(
-        key in config[connection] for key in required_keys
-    ):
-        raise ValueError(f"Context for {connection} not found or is incomplete.")
-
-
-def context(args) -> ChainQuery:
-    """Connection context"""
-    blockfrost_context = None
-    ogmios_context = None
-    kupo_context = None
-
-    configyaml = load_config()
-
-    if args.environment == "mainnet":
-        network = Network.MAINNET
-    elif args.environment == "preprod":
-        network = Network.TESTNET
-    else:
-        network = None
-
-    if args.connection == "blockfrost":
-        required_keys = ["project_id"]
-        validate_config(configyaml, args.connection, required_keys)
-
-        blockfrost_context = BlockFrostChainContext(
-            project_id=configyaml[args.connection].get("project_id", ""),
-            base_url=None,
-        )
-    elif args.connection == "ogmios":
-        required_keys = ["kupo_url", "ws_url"]
-        validate_config(configyaml, args.connection, required_keys)
-
-        ogmios_ws_url = configyaml["ogmios"]["ws_url"]
-        kupo_url = configyaml["ogmios"]["kupo_url"]
-
-        _, ws_string = ogmios_ws_url.split("ws://")
-        ws_url, port = ws_string.split(":")
-        ogmios_context = OgmiosV6ChainContext(
-            host=ws_url, port=int(port), network=network
-        )
-
-        kupo_context = KupoContext(kupo_url)
-
-    return ChainQuery(
-        blockfrost_context=blockfrost_context,
-        ogmios_context=ogmios_context,
-        kupo_context=kupo_context,
-    )
-
-
-def user_wallet_extended_signing_key(configyaml) -> PaymentSigningKey:
-    mnemonic_24 = configyaml.get("MNEMONIC_24")
-    hdwallet = HDWallet.from_mnemonic(mnemonic_24)
-    hdwallet_spend = hdwallet.derive_from_path("m/1852'/1815'/0'/0/0")
-
-    extended_signing_key = ExtendedSigningKey.from_hdwallet(hdwallet_spend)
-    return extended_signing_key
-
-
-def user_wallet_credentials(configyaml) -> Address:
-    mnemonic_24 = configyaml.get("MNEMONIC_24")
-    hdwallet = HDWallet.from_mnemonic(mnemonic_24)
-    hdwallet_spend = hdwallet.derive_from_path("m/1852'/1815'/0'/0/0")
-    spend_public_key = hdwallet_spend.public_key
-    spend_vk = PaymentVerificationKey.from_primitive(spend_public_key)
-
-    hdwallet_stake = hdwallet.derive_from_path("m/1852'/1815'/0'/2/0")
-    stake_public_key = hdwallet_stake.public_key
-    stake_vk = PaymentVerificationKey.from_primitive(stake_public_key)
-
-    return spend_vk, stake_vk
-
-
-def user_wallet_address(configyaml, args):
-    if args.environment == "mainnet":
-        network = Network.MAINNET
-    elif args.environment == "preprod":
-        network = Network.TESTNET
-    else:
-        network = None
-
-    mnemonic_24 = configyaml.get("MNEMONIC_24")
-    hdwallet = HDWallet.from_mnemonic(mnemonic_24)
-    hdwallet_spend = hdwallet.derive_from_path("m/1852'/1815'/0'/0/0")
-    spend_public_key = hdwallet_spend.public_key
-    spend_vk = PaymentVerificationKey.from_primitive(spend_public_key)
-
-    hdwallet_stake = hdwallet.derive_from_path("m/1852'/1815'/0'/2/0")
-    stake_public_key = hdwallet_stake.public_key
-    stake_vk = PaymentVerificationKey.from_primitive(stake_public_key)
-
-    str_address = Address(spend_vk.hash(), stake_vk.hash(), network=network).encode()
-    return Address.from_primitive(str_address)
+        return float(value) / 1000
+    except ValueError as err:
+        raise argparse.ArgumentTypeError("expected milliseconds or 'recorded'") from err
 
 
 def create_parser():
@@ -233,10 +57,11 @@ def create_parser():
     # Service to connect to the blockchain
     parser.add_argument(
         "connection",
-        choices=["blockfrost", "ogmios"],
+        choices=["blockfrost", "ogmios", "simulator", "pool"],
         nargs="?",
         default="blockfrost",
-        help="External service to read blockhain information",
+        help="External service to read blockhain information, an in-process "
+        "simulated chain, or a pool of the services listed in backend_pool",
     )
 
     # Service to connect to the blockchain
@@ -248,6 +73,63 @@ def create_parser():
         help="Blockchain environment",
     )
 
+    # Record or replay the Kupo and Blockfrost traffic
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Save every Kupo and Blockfrost request and response, with "
+        "timings, to this cassette file.",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="Answer Kupo and Blockfrost requests from a recorded cassette "
+        "instead of the live services.",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write the timing spans and counters of the command to this file "
+        "in the Prometheus text format.",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print a summary of the timing spans and counters after the command.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="odv-demo-profile",
+        metavar="PREFIX",
+        help="Profile the command: write PREFIX.pstats (cProfile) and "
+        "PREFIX.folded (wall-clock collapsed stacks) and print the top "
+        "entries, separating on-CPU time from awaiting I/O "
+        "(default prefix: odv-demo-profile).",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=15,
+        metavar="N",
+        help="Entries per table in the profile summary (default: 15).",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Log debug output, including every submitted transaction.",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=replay_latency,
+        default=0.0,
+        metavar="MS|recorded",
+        help="Delay of each replayed response in milliseconds, or 'recorded' "
+        "for the recorded response times (default: 0).",
+    )
+
     # Create a subparser for each main choice
     subparser = parser.add_subparsers(dest="subparser")
 
@@ -286,6 +168,38 @@ def create_parser():
         help="Amount of tUSDT to trade.",
     )
 
+    # Price ladders
+    quote_parser = subparser.add_parser(
+        "quote",
+        help="Price trade sizes against the oracle feed and swap liquidity.",
+        description="Quote the amount bought for each trade size, and whether "
+        "the swap contract can fill it, without submitting anything.",
+    )
+    quote_parser.add_argument(
+        "asset",
+        choices=["tADA", "tUSDT"],
+        help="Asset sold.",
+    )
+    quote_parser.add_argument(
+        "amounts",
+        nargs="*",
+        type=int,
+        metavar="AMOUNT",
+        help="Trade sizes to quote.",
+    )
+    quote_parser.add_argument(
+        "--range",
+        nargs=3,
+        type=int,
+        metavar=("START", "STOP", "STEP"),
+        help="Also quote the sizes START, START + STEP, ... below STOP.",
+    )
+    quote_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the ladder as a JSON object.",
+    )
+
     # Create a parser for the "user" choice
     user_parser = subparser.add_parser(
         "user",
@@ -305,6 +219,19 @@ def create_parser():
         help="Print the wallet address.",
     )
 
+    user_parser.add_argument(
+        "--consolidate",
+        action="store_true",
+        help="Merge the wallet's small UTxOs, keeping collateral and token "
+        "UTxOs as set in the consolidation section of the config.",
+    )
+
+    user_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --consolidate, print the plan without submitting it.",
+    )
+
     # Create a parser for the "swap-contract" choice
     swap_contract_parser = subparser.add_parser(
         "swap-contract",
@@ -340,6 +267,21 @@ def create_parser():
         help="Generate a UTXO and mint an NFT at the specified swap contract address.",
     )
 
+    swap_contract_parser.add_argument(
+        "--activity",
+        action="store_true",
+        help="Index the new trades and print the trading volume, the liquidity "
+        "and the most active users.",
+    )
+
+    swap_contract_parser.add_argument(
+        "--period",
+        choices=("hour", "day", "week"),
+        default="day",
+        help="With --activity, the period volume and liquidity are grouped by "
+        "(default: day).",
+    )
+
     # Create a parser for the "oracle-contract" choice
     oracle_contract_parser = subparser.add_parser(
         "oracle-contract",
@@ -352,12 +294,56 @@ def create_parser():
         help="Print the oracle feed (exchange rate) tUSDT/tADA.",
     )
 
+    oracle_contract_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="With --feed, keep running and print a line each time the feed "
+        "is updated.",
+    )
+
+    oracle_contract_parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="With --watch, seconds between checks for an update (default: 2).",
+    )
+
+    oracle_contract_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="With --watch, print each update as a JSON object (JSON Lines).",
+    )
+
     oracle_contract_parser.add_argument(
         "--address",
         action="store_true",
         help="Print the oracle contract address.",
     )
 
+    oracle_contract_parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Print the oracle feed updates stored locally, after indexing the "
+        "new ones from Kupo (ogmios connection).",
+    )
+
+    oracle_contract_parser.add_argument(
+        "--since",
+        type=int,
+        default=None,
+        metavar="SLOT",
+        help="With --history, only the updates from this slot on.",
+    )
+
+    oracle_contract_parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="With --history, print at most this many of the latest updates "
+        "(default: 20).",
+    )
+
     # Odv request
     send_odv_request_parser = subparser.add_parser(
         "send-odv-request",
@@ -372,107 +358,172 @@ def create_parser():
         dest="fundstosend",
         help="Minimum C3 payment amount for the generation of an oracle-feed.",
     )
-    return parser
 
+    # Daemon mode
+    serve_parser = subparser.add_parser(
+        "serve",
+        help="Run a long-lived JSON-RPC server over HTTP.",
+        description="Keep the chain context, wallet keys and scripts loaded and "
+        "serve quote, trade, liquidity, feed and ODV-request calls over a local "
+        "JSON-RPC 2.0 endpoint (POST /rpc).",
+    )
+    serve_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Interface to bind to (default: 127.0.0.1).",
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to listen on (default: 8765).",
+    )
+    serve_parser.add_argument(
+        "--consolidate-every",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Consolidate the wallet's UTxOs at this interval (default: never).",
+    )
+    serve_parser.add_argument(
+        "--index-activity-every",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Index the swap contract's new trades at this interval "
+        "(default: only when swap_activity is called).",
+    )
 
-# Parser command-line arguments
-async def display(args, context):
-    configyaml = load_config()
+    # Bulk trades
+    trade_batch_parser = subparser.add_parser(
+        "trade-batch",
+        help="Execute a file of trades through a pipelined runner.",
+        description="Read trades from a CSV (asset,amount[,id] header) or JSONL "
+        "file and submit them back to back, chaining each trade on the swap "
+        "output of the previous one while earlier trades are confirmed.",
+    )
+    trade_batch_parser.add_argument(
+        "orders",
+        metavar="ORDERS_FILE",
+        help="CSV or .jsonl file with one trade (asset, amount, optional id) per row.",
+    )
+    trade_batch_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of submitted, unconfirmed trades (default: 4).",
+    )
+    trade_batch_parser.add_argument(
+        "--report",
+        metavar="FILE",
+        default=None,
+        help="Write one JSON record per trade to this file.",
+    )
+    return parser
 
-    # NFT configuration
-    (
-        oracle_address,
-        swap_address,
-        dynamic_payment_oracle_addr,
-        dynamic_payment_oracle_nft,
-    ) = load_contracts_addresses(configyaml)
-    swap_nft, token_a = load_swap_config_tokens(configyaml)
-    (
-        aggstate_nft,
-        oracle_nft,
-        c3_token_hash,
-        c3_token_name,
-    ) = load_odv_oracle_config_tokens(configyaml)
-
-    # Load user payment key from wallet file
-    extended_payment_skey = user_wallet_extended_signing_key(configyaml)
-    spend_vk, stake_vk = user_wallet_credentials(configyaml)
-
-    # User address wallet
-    user_address = user_wallet_address(configyaml, args)
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    swap_script_path = os.path.join(current_dir, "utils", "scripts", "swap.plutus")
-    with open(swap_script_path, "r") as f:
-        script_hex = f.read()
-        swap_script = PlutusV2Script(cbor2.loads(bytes.fromhex(script_hex)))
-
-    swap = Swap(swap_nft, token_a)
-    swapInstance = SwapContract(context, oracle_nft, oracle_address, swap_address, swap)
 
+# Parser command-line arguments
+async def display(args, runtime: "Runtime"):
     if args.subparser == "trade" and args.subparser_trade_subparser == "tADA":
-        await swapInstance.swap_B(
+        await runtime.swap_contract.swap_B(
             args.amount,
-            user_address,
-            swap_address,
-            swap_script,
-            extended_payment_skey,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.swap_script,
+            runtime.extended_payment_skey,
         )
 
     elif args.subparser == "trade" and args.subparser_trade_subparser == "tUSDT":
-        await swapInstance.swap_A(
+        await runtime.swap_contract.swap_A(
             args.amount,
-            user_address,
-            swap_address,
-            swap_script,
-            extended_payment_skey,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.swap_script,
+            runtime.extended_payment_skey,
         )
 
+    elif args.subparser == "quote":
+        from .lib.quotes import print_ladder
+
+        amounts = list(args.amounts)
+        if args.range:
+            amounts.extend(range(*args.range))
+        ladder = await runtime.quote_engine.ladder(args.asset, amounts)
+        if args.json:
+            import json
+
+            print(json.dumps(ladder.to_dict()))
+        else:
+            print_ladder(ladder)
+
     elif args.subparser == "user" and args.liquidity:
-        tlovelace = await swapInstance.available_user_tlovelace(user_address)
-        tUSDT = await swapInstance.available_user_tusdt(user_address)
+        balances = await runtime.swap_contract.user_balances(runtime.user_address)
+        tlovelace = balances.lovelace
+        tUSDT = balances.quantity(*runtime.swap_contract.coin_a_ids())
         print("User wallet's liquidity:")
         print(f"- {tlovelace // 1000000} tADA ({tlovelace} tlovelace)")
         print(f"- {tUSDT} tUSDT")
+        print(
+            f"  {balances.pure_lovelace} tlovelace in pure-ADA UTxOs, "
+            f"{balances.locked_lovelace} alongside tokens, "
+            f"{balances.collateral_lovelace} usable as collateral"
+        )
     elif args.subparser == "user" and args.address:
-        print(f"User's wallet address (Mnemonic): {user_address}")
+        print(f"User's wallet address (Mnemonic): {runtime.user_address}")
+
+    elif args.subparser == "user" and args.consolidate:
+        from .lib.consolidation import print_rounds
+
+        print_rounds(await runtime.consolidator.run(dry_run=args.dry_run))
 
     elif args.subparser == "swap-contract" and args.liquidity:
-        swap_utxo = await swapInstance.get_swap_utxo()
+        swap_utxo = await runtime.swap_contract.get_swap_utxo()
         tlovelace = swap_utxo.output.amount.coin
-        tUSDT = await swapInstance.add_asset_swap_amount(0)
+        tUSDT = await runtime.swap_contract.add_asset_swap_amount(0)
         print("Swap contract liquidity:")
         print(f"- {tlovelace // 1000000} tADA ({tlovelace} tlovelace)")
         print(f"- {tUSDT} tUSDT")
 
     elif args.subparser == "swap-contract" and args.address:
-        print(f"Swap contract's address: {swap_address}")
+        print(f"Swap contract's address: {runtime.swap_address}")
+
+    elif args.subparser == "swap-contract" and args.activity:
+        from .lib.swap_activity import PERIODS, print_activity
+
+        await runtime.swap_activity_indexer.sync()
+        print_activity(runtime.swap_activity, PERIODS[args.period])
 
     elif args.subparser == "swap-contract" and args.addliquidity:
-        await swapInstance.add_liquidity(
+        await runtime.swap_contract.add_liquidity(
             args.addliquidity[0],
             args.addliquidity[1],
-            user_address,
-            swap_address,
-            swap_script,
-            extended_payment_skey,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.swap_script,
+            runtime.extended_payment_skey,
         )
     elif args.subparser == "swap-contract" and args.soracle:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        mint_script_path = os.path.join(
-            current_dir, "utils", "scripts", "mint_script.plutus"
-        )
-        with open(mint_script_path, "r") as f:
-            script_hex = f.read()
-            plutus_script_v2 = PlutusV2Script(cbor2.loads(bytes.fromhex(script_hex)))
+        from .mint import Mint
 
         swap_utxo_nft = Mint(
-            context, extended_payment_skey, user_address, swap_address, plutus_script_v2
+            runtime.chain_query,
+            runtime.extended_payment_skey,
+            runtime.user_address,
+            runtime.swap_address,
+            runtime.mint_script,
+            policy_id=runtime.script_registry["mint_script"].hash,
         )
         await swap_utxo_nft.mint_nft_with_script()
 
+    elif args.subparser == "oracle-contract" and args.feed and args.watch:
+        from .lib.feed_watch import print_update
+
+        async for update in runtime.feed_watcher(args.interval).updates():
+            print_update(update, as_json=args.json)
+
     elif args.subparser == "oracle-contract" and args.feed:
         try:
-            exchange = await swapInstance.get_oracle_exchange_rate()
+            exchange = await runtime.swap_contract.get_oracle_exchange_rate()
 
             print("Charli3 - Oracle Feed")
             print(f"Last Price: {exchange / 1000000:.6f} tADA/tUSDt")
@@ -481,36 +532,14 @@ async def display(args, context):
             return f"An error occurred while fetching the oracle feed: {e}"
 
     elif args.subparser == "oracle-contract" and args.address:
-        print(f"Oracle contract's address: {oracle_address}")
+        print(f"Oracle contract's address: {runtime.oracle_address}")
+
+    elif args.subparser == "oracle-contract" and args.history:
+        await runtime.sync_price_history()
+        show_price_history(args, runtime.price_history)
 
     elif args.subparser == "send-odv-request":
-        load_script_input = configyaml.get("script_input_oracle")
-        tx_id_hex, index = load_script_input.split("#")
-        tx_id = TransactionId(bytes.fromhex(tx_id_hex))
-        index = int(index)
-        reference_script_input = TransactionInput(tx_id, index)
-
-        if args.environment == "mainnet":
-            network = Network.MAINNET
-        elif args.environment == "preprod":
-            network = Network.TESTNET
-        else:
-            network = None
-
-        oracle_user = OracleUser(
-            network,
-            context,
-            extended_payment_skey,
-            spend_vk,
-            stake_vk,
-            str(oracle_address),
-            aggstate_nft,
-            reference_script_input,
-            c3_token_hash,
-            c3_token_name,
-            dynamic_payment_oracle_addr,
-            dynamic_payment_oracle_nft,
-        )
+        oracle_user = runtime.oracle_user()
         if args.fundstosend:
             await oracle_user.send_odv_request(args.fundstosend)
         else:
@@ -518,13 +547,133 @@ async def display(args, context):
             print(f"Minimum quantity required {funds_to_add}")
             await oracle_user.send_odv_request(funds_to_add)
 
+    elif args.subparser == "serve":
+        from .server import serve
+
+        await serve(
+            runtime,
+            args.host,
+            args.port,
+            consolidate_every=args.consolidate_every,
+            index_activity_every=args.index_activity_every,
+        )
+
+    elif args.subparser == "trade-batch":
+        from .batch import TradeBatchRunner, read_orders
+
+        runner = TradeBatchRunner(
+            runtime, concurrency=args.concurrency, report_path=args.report
+        )
+        await runner.run(read_orders(args.orders))
+
+
+def contract_address_from_config(args, configyaml) -> str | None:
+    """Answer the contract address subcommands straight from the config.
+
+    Returns:
+        The line to print, or None when the subcommand needs the runtime.
+    """
+    if (
+        args.subparser == "swap-contract"
+        and args.address
+        and not args.liquidity
+        and configyaml.get("swap_contract_address")
+    ):
+        return f"Swap contract's address: {configyaml['swap_contract_address']}"
+    if (
+        args.subparser == "oracle-contract"
+        and args.address
+        and not args.feed
+        and args.connection not in ("simulator", "pool")
+        and configyaml.get("oracle_contract_address")
+    ):
+        return f"Oracle contract's address: {configyaml['oracle_contract_address']}"
+    return None
+
+
+def show_price_history(args, history) -> None:
+    """Print the stored oracle feed updates selected by ``--since``/``--limit``."""
+    from .lib.price_history import print_history
+
+    records = history.range(start_slot=args.since)
+    print_history(history, records[-args.limit :] if args.limit else records)
+
+
+def prepare(args) -> Callable[[], object]:
+    """Load the configuration and import only what the subcommand needs.
+
+    Args:
+        args: Parsed command-line arguments.
+
+    Returns:
+        A callable that runs the subcommand.
+    """
+    from .config import load_config
+
+    configyaml = load_config()
+
+    address = contract_address_from_config(args, configyaml)
+    if address is not None:
+        return lambda: print(address)
+
+    if (
+        args.subparser == "oracle-contract"
+        and args.history
+        and args.connection in ("blockfrost", "simulator")
+    ):
+        # Without Kupo there is nothing to index: read the file only.
+        from .lib.price_history import PriceHistory, history_path
+
+        history = PriceHistory(history_path(configyaml))
+        return lambda: show_price_history(args, history)
+
+    import asyncio
+
+    from .runtime import Runtime
+
+    runtime = Runtime(args, configyaml)
+
+    def run():
+        try:
+            asyncio.run(display(args, runtime))
+        except KeyboardInterrupt:
+            # How --watch and serve are stopped.
+            pass
+        finally:
+            report_metrics(args)
+
+    return run
+
+
+def report_metrics(args) -> None:
+    """Export the metrics recorded by the command, as requested by the flags."""
+    if not (args.metrics or args.timings):
+        return
+    from .lib.metrics import metrics
+
+    if args.metrics:
+        with open(args.metrics, "w", encoding="UTF-8") as f:
+            f.write(metrics.to_prometheus())
+    if args.timings:
+        print(metrics.summary(), file=sys.stderr)
+
 
 def main():
     """main execution program"""
     parser = create_parser()
     args = parser.parse_args(None if sys.argv[1:] else ["-h"])
-    ctx = context(args)
-    asyncio.run(display(args, ctx))
+    if args.verbose:
+        import logging
+
+        logging.basicConfig(
+            level=logging.DEBUG, format="%(asctime)s %(name)s %(message)s"
+        )
+    if args.profile:
+        from .lib.profiler import profile_call
+
+        profile_call(lambda: prepare(args)(), args.profile, top=args.profile_top)
+    else:
+        prepare(args)()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 """offchain code containing mint class"""
 
 from dataclasses import dataclass
+from typing import Optional
 
 from pycardano import (
     Address,
@@ -12,6 +13,7 @@ from pycardano import (
     PlutusData,
     PlutusV2Script,
     Redeemer,
+    ScriptHash,
     TransactionBuilder,
     TransactionOutput,
     Unit,
@@ -20,6 +22,8 @@ from pycardano import (
 )
 
 from swap_demo_contract.lib.chain_query import ChainQuery
+from swap_demo_contract.lib.metrics import metrics
+from swap_demo_contract.lib.ratelimit import budgeted
 
 
 @dataclass
@@ -35,16 +39,20 @@ class Mint:
         user_address: Address,
         swap_address: Address,
         plutus_v2_mint_script: PlutusV2Script,
+        policy_id: Optional[ScriptHash] = None,
     ) -> None:
         self.chain_query = chain_query
         self.signing_key = signing_key
         self.user_address = user_address
         self.swap_address = swap_address
         self.minting_script_plutus_v2 = plutus_v2_mint_script
+        self.policy_id = policy_id
 
+    @metrics.timed("mint.mint_nft_with_script")
+    @budgeted("mint")
     async def mint_nft_with_script(self):
         """mint tokens with plutus v2 script"""
-        policy_id = plutus_script_hash(self.minting_script_plutus_v2)
+        policy_id = self.policy_id or plutus_script_hash(self.minting_script_plutus_v2)
         asset_name = "SWAP"
         nft_swap = MultiAsset.from_primitive(
             {
@@ -0,0 +1,642 @@
+"""Configuration loading and long-lived state shared by the CLI and the daemon"""
+
+import atexit
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+from blockfrost import ApiUrls
+from pycardano import (
+    Address,
+    Asset,
+    AssetName,
+    BlockFrostChainContext,
+    ExtendedSigningKey,
+    MultiAsset,
+    Network,
+    OgmiosV6ChainContext,
+    PaymentSigningKey,
+    PlutusV2Script,
+    ScriptHash,
+    TransactionId,
+    TransactionInput,
+)
+
+from swap_demo_contract.lib.backends import (
+    BackendPool,
+    blockfrost_backend,
+    ogmios_backend,
+    simulator_backend,
+)
+from swap_demo_contract.lib.build_pool import BuildExecutor
+from swap_demo_contract.lib.cassette import Cassette, CassetteServer
+from swap_demo_contract.lib.chain_query import ChainQuery
+from swap_demo_contract.lib.coin_selection import CoinSelector
+from swap_demo_contract.lib.consolidation import ConsolidationPolicy, Consolidator
+from swap_demo_contract.lib.contention import ContentionPolicy
+from swap_demo_contract.lib.feed_watch import (
+    BlockfrostFeedSource,
+    FeedWatcher,
+    KupoFeedSource,
+    SimulatorFeedSource,
+)
+from swap_demo_contract.lib.kupo import KupoContext
+from swap_demo_contract.lib.price_history import (
+    PriceHistory,
+    PriceHistoryIndexer,
+    history_path,
+)
+from swap_demo_contract.lib.quotes import QuoteEngine
+from swap_demo_contract.lib.ratelimit import RateLimitedBlockFrostApi, TokenBucket
+from swap_demo_contract.lib.scripts import ScriptRegistry, default_registry
+from swap_demo_contract.lib.simulator import LedgerSimulator, seed_demo_state
+from swap_demo_contract.lib.swap_activity import (
+    BlockfrostSwapSource,
+    KupoSwapSource,
+    SimulatorSwapSource,
+    SwapActivityIndexer,
+    SwapActivityStore,
+    activity_path,
+)
+from swap_demo_contract.lib.wallet import WalletKeyStore
+
+from .config import load_config, validate_config
+from .lib.oracle_user import OracleUser
+from .swap import Swap, SwapContract
+
+
+def load_contracts_addresses(configyaml):
+    """Loads the contract addresses"""
+
+    # Fetch necessary config values
+    minting_policy = configyaml.get("dynamic_payment_oracle_minting_policy")
+    asset_name = configyaml.get("dynamic_payment_oracle_asset_name")
+    oracle_rate_address = configyaml.get("dynamic_payment_oracle_addr")
+    oracle_contract_address = configyaml.get("oracle_contract_address")
+    swap_contract_address = configyaml.get("swap_contract_address")
+
+    # Convert minting policy to ScriptHash if available
+    oracle_rate_nft_hash = (
+        ScriptHash.from_primitive(minting_policy) if minting_policy else None
+    )
+
+    if oracle_rate_nft_hash and asset_name and oracle_rate_address:
+        return (
+            Address.from_primitive(oracle_contract_address),
+            Address.from_primitive(swap_contract_address),
+            Address.from_primitive(oracle_rate_address),
+            create_c3_oracle_rate_nft(oracle_rate_nft_hash, asset_name),
+        )
+    else:
+        return (
+            Address.from_primitive(oracle_contract_address),
+            Address.from_primitive(swap_contract_address),
+            None,
+            None,
+        )
+
+
+def create_c3_oracle_rate_nft(minting_policy, token_name) -> MultiAsset | None:
+    """Create C3 oracle rate NFT."""
+    if token_name and minting_policy:
+        return MultiAsset.from_primitive(
+            {minting_policy.payload: {token_name.encode(): 1}}
+        )
+    else:
+        return None
+
+
+def load_swap_config_tokens(configyaml):
+    swap_minting_policy = ScriptHash.from_primitive(
+        configyaml.get("swap_minting_policy")
+    )
+    swap_asset_name = AssetName(configyaml.get("swap_asset_name").encode())
+    swap_nft = MultiAsset({swap_minting_policy: Asset({swap_asset_name: 1})})
+
+    token_a_minting_policy = ScriptHash.from_primitive(
+        configyaml.get("token_a_minting_policy")
+    )
+    token_a_asset_name = AssetName(configyaml.get("token_a_asset_name").encode())
+    token_a = MultiAsset({token_a_minting_policy: Asset({token_a_asset_name: 1})})
+    return (swap_nft, token_a)
+
+
+def load_odv_oracle_config_tokens(configyaml):
+    aggstate_minting_policy = ScriptHash.from_primitive(
+        configyaml.get("aggstate_minting_policy")
+    )
+    aggstate_asset_name = AssetName(configyaml.get("aggstate_asset_name").encode())
+    aggstate_nft = MultiAsset(
+        {aggstate_minting_policy: Asset({aggstate_asset_name: 1})}
+    )
+
+    oracle_nft_minting_policy = ScriptHash.from_primitive(
+        configyaml.get("oracle_nft_minting_policy")
+    )
+    oracle_nft_asset_name = AssetName(configyaml.get("oracle_nft_asset_name").encode())
+    oracle_nft = MultiAsset(
+        {oracle_nft_minting_policy: Asset({oracle_nft_asset_name: 1})}
+    )
+
+    c3_token_hash = ScriptHash.from_primitive(configyaml.get("c3_token_hash"))
+
+    c3_token_name = AssetName(configyaml.get("c3_token_name").encode())
+
+    return (aggstate_nft, oracle_nft, c3_token_hash, c3_token_name)
+
+
+def network_from_environment(environment: str) -> Network | None:
+    """Map the CLI environment name to a pycardano network."""
+    if environment == "mainnet":
+        return Network.MAINNET
+    if environment == "preprod":
+        return Network.TESTNET
+    return None
+
+
+def simulated_oracle_address(
+    network: Network | None, script_registry: Optional[ScriptRegistry] = None
+) -> Address:
+    """Oracle contract address on the simulated chain.
+
+    The oracle script deployed at ``oracle_contract_address`` is not shipped
+    with the demo, so the simulated oracle lives at the address of the bundled
+    ``oracle.plutus`` instead, which lets its reference script validate.
+    """
+    registry = script_registry or default_registry()
+    return registry["oracle"].address(network)
+
+
+def simulated_ledger(args, configyaml, script_registry=None) -> LedgerSimulator:
+    """Ledger simulator seeded with the oracle, swap and wallet state.
+
+    Reads the optional ``simulator`` section of the configuration
+    (``block_time``, ``price``).
+    """
+    settings = configyaml.get("simulator") or {}
+    network = network_from_environment(args.environment)
+    ledger = LedgerSimulator(
+        network=network, block_time=float(settings.get("block_time") or 0)
+    )
+
+    registry = script_registry or default_registry()
+    swap_nft, token_a = load_swap_config_tokens(configyaml)
+    aggstate_nft, oracle_nft, c3_token_hash, c3_token_name = (
+        load_odv_oracle_config_tokens(configyaml)
+    )
+    tx_id_hex, index = configyaml.get("script_input_oracle").split("#")
+    seed_demo_state(
+        ledger,
+        user_address=user_wallet_address(configyaml, args),
+        oracle_address=simulated_oracle_address(network, registry),
+        swap_address=Address.from_primitive(configyaml.get("swap_contract_address")),
+        oracle_nft=oracle_nft,
+        aggstate_nft=aggstate_nft,
+        swap_nft=swap_nft,
+        token_a=token_a,
+        c3_token_hash=c3_token_hash,
+        c3_token_name=c3_token_name,
+        reference_script_input=TransactionInput(
+            TransactionId(bytes.fromhex(tx_id_hex)), int(index)
+        ),
+        oracle_script=registry["oracle"].script,
+        price=int(settings.get("price") or 2500000),
+    )
+    return ledger
+
+
+def cassette_server(args, services: List[str]) -> Optional[CassetteServer]:
+    """Local stand-in recording or replaying the Kupo and Blockfrost traffic.
+
+    ``--record FILE`` forwards Blockfrost requests through the stand-in and
+    saves every Kupo and Blockfrost interaction to FILE when the process
+    exits. ``--replay FILE`` serves both services from FILE, waiting
+    ``--replay-latency`` before each response.
+    """
+    record = getattr(args, "record", None)
+    replay = getattr(args, "replay", None)
+    if replay:
+        server = CassetteServer(
+            Cassette.load(replay), latency=getattr(args, "replay_latency", 0.0)
+        )
+    elif record:
+        upstreams = {}
+        if "blockfrost" in services:
+            upstreams["blockfrost"] = ApiUrls.preprod.value
+        cassette = Cassette()
+        server = CassetteServer(cassette, upstreams=upstreams)
+        atexit.register(cassette.save, record)
+    else:
+        return None
+    server.start()
+    return server
+
+
+def pool_services(configyaml) -> List[str]:
+    """Backends of the ``pool`` connection, from the ``backend_pool`` section.
+
+    Defaults to every service configured among Blockfrost and Ogmios.
+    """
+    settings = configyaml.get("backend_pool") or {}
+    services = settings.get("backends") or [
+        name for name in ("blockfrost", "ogmios") if configyaml.get(name)
+    ]
+    unknown = set(services) - {"blockfrost", "ogmios", "simulator"}
+    if unknown:
+        raise ValueError(f"Unknown backends in backend_pool: {', '.join(unknown)}")
+    return services
+
+
+def context(args, configyaml=None, script_registry=None) -> ChainQuery:
+    """Connection context"""
+    blockfrost_context = None
+    ogmios_context = None
+    kupo_context = None
+    simulator_context = None
+    backend_pool = None
+
+    if configyaml is None:
+        configyaml = load_config()
+
+    network = network_from_environment(args.environment)
+    if args.connection == "pool":
+        services = pool_services(configyaml)
+    else:
+        services = [args.connection]
+    cassette = cassette_server(args, services)
+
+    if "blockfrost" in services:
+        required_keys = ["project_id"]
+        validate_config(configyaml, "blockfrost", required_keys)
+
+        blockfrost_context = BlockFrostChainContext(
+            project_id=configyaml["blockfrost"].get("project_id", ""),
+            base_url=f"{cassette.url}/blockfrost" if cassette else None,
+        )
+        settings = configyaml["blockfrost"]
+        blockfrost_context.api = RateLimitedBlockFrostApi(
+            blockfrost_context.api,
+            TokenBucket(
+                rate=float(settings.get("rate_limit", 10)),
+                burst=int(settings.get("burst", 500)),
+            ),
+            budgets=settings.get("request_budgets"),
+            cache_ttl=float(settings.get("utxo_cache_ttl", 2)),
+        )
+    if "ogmios" in services:
+        required_keys = ["kupo_url", "ws_url"]
+        validate_config(configyaml, "ogmios", required_keys)
+
+        ogmios_ws_url = configyaml["ogmios"]["ws_url"]
+        kupo_url = configyaml["ogmios"]["kupo_url"]
+
+        _, ws_string = ogmios_ws_url.split("ws://")
+        ws_url, port = ws_string.split(":")
+        ogmios_context = OgmiosV6ChainContext(
+            host=ws_url, port=int(port), network=network
+        )
+
+        if cassette and getattr(args, "replay", None):
+            kupo_url = f"{cassette.url}/kupo"
+        kupo_context = KupoContext(kupo_url, script_registry=script_registry)
+        if cassette and getattr(args, "record", None):
+            kupo_context.cassette = cassette.cassette
+    if "simulator" in services:
+        simulator_context = simulated_ledger(args, configyaml, script_registry)
+
+    if args.connection == "pool":
+        backends = {
+            "blockfrost": lambda: blockfrost_backend(blockfrost_context),
+            "ogmios": lambda: ogmios_backend(ogmios_context, kupo_context),
+            "simulator": lambda: simulator_backend(simulator_context),
+        }
+        settings = configyaml.get("backend_pool") or {}
+        backend_pool = BackendPool(
+            [backends[name]() for name in services],
+            hedge_after=float(settings.get("hedge_after_ms", 500)) / 1000,
+            cooldown=float(settings.get("cooldown", 30)),
+        )
+
+    return ChainQuery(
+        blockfrost_context=blockfrost_context,
+        ogmios_context=ogmios_context,
+        kupo_context=kupo_context,
+        script_registry=script_registry,
+        simulator_context=simulator_context,
+        backend_pool=backend_pool,
+        coin_selector=coin_selector(configyaml),
+        build_executor=build_executor(configyaml),
+    )
+
+
+def coin_selector(configyaml) -> Optional[CoinSelector]:
+    """Coin selector from the optional ``coin_selection`` settings.
+
+    Without the section, or with the strategy ``pycardano``, balancing is
+    left to pycardano's selectors.
+    """
+    settings = configyaml.get("coin_selection")
+    if settings is None:
+        return None
+    strategy = settings.get("strategy", "random-improve")
+    if strategy == "pycardano":
+        return None
+    return CoinSelector(
+        strategy=strategy,
+        goal=settings.get("goal", "min-fee"),
+        margin=int(settings.get("margin", 5000000)),
+        max_inputs=int(settings.get("max_inputs", 100)),
+    )
+
+
+def build_executor(configyaml) -> Optional[BuildExecutor]:
+    """Build-and-sign pool from the optional ``build_pool`` settings.
+
+    Without the section, transactions are built with ``asyncio.to_thread``.
+    The pool is shut down when the process exits.
+    """
+    settings = configyaml.get("build_pool")
+    if not settings:
+        return None
+    executor = BuildExecutor(
+        mode=settings.get("mode", "process"),
+        max_workers=int(settings["workers"]) if settings.get("workers") else None,
+    )
+    atexit.register(executor.shutdown)
+    return executor
+
+
+_keystores: Dict[Tuple[str, Optional[str]], WalletKeyStore] = {}
+
+
+def wallet_keystore(configyaml) -> WalletKeyStore:
+    """Shared key store for the configured mnemonic.
+
+    The optional ``wallet_key_cache`` setting names a file where derived keys
+    are kept encrypted between runs.
+    """
+    mnemonic_24 = configyaml.get("MNEMONIC_24")
+    cache_path = configyaml.get("wallet_key_cache")
+    key = (mnemonic_24, cache_path)
+    if key not in _keystores:
+        _keystores[key] = WalletKeyStore(mnemonic_24, cache_path=cache_path)
+    return _keystores[key]
+
+
+def wallet_account(configyaml) -> Tuple[int, int]:
+    """The (account, address index) pair used by the demo wallet."""
+    return (
+        int(configyaml.get("wallet_account") or 0),
+        int(configyaml.get("wallet_address_index") or 0),
+    )
+
+
+def user_wallet_extended_signing_key(configyaml) -> PaymentSigningKey:
+    keystore = wallet_keystore(configyaml)
+    extended_signing_key = keystore.signing_key(*wallet_account(configyaml))
+    keystore.save_cache()
+    return extended_signing_key
+
+
+def user_wallet_credentials(configyaml) -> Address:
+    keystore = wallet_keystore(configyaml)
+    spend_vk, stake_vk = keystore.credentials(*wallet_account(configyaml))
+    keystore.save_cache()
+    return spend_vk, stake_vk
+
+
+def user_wallet_address(configyaml, args):
+    network = network_from_environment(args.environment)
+    keystore = wallet_keystore(configyaml)
+    address = keystore.address(network, *wallet_account(configyaml))
+    keystore.save_cache()
+    return address
+
+
+def load_plutus_script(file_name: str) -> PlutusV2Script:
+    """Load a hex encoded Plutus V2 script from utils/scripts."""
+    return default_registry()[file_name[: -len(".plutus")]].script
+
+
+class Runtime:
+    """Lazily built state for one connection and environment.
+
+    Every attribute is computed on first use and kept for the lifetime of the
+    object, so a long-running process (see ``odv-demo serve``) pays for config
+    parsing, key derivation, script decoding and chain context creation once.
+
+    Attributes:
+        args: Parsed command-line arguments (connection and environment).
+        configyaml: The loaded configuration file.
+    """
+
+    def __init__(self, args, configyaml=None) -> None:
+        self.args = args
+        self.configyaml = load_config() if configyaml is None else configyaml
+
+    @cached_property
+    def network(self) -> Network | None:
+        return network_from_environment(self.args.environment)
+
+    @cached_property
+    def chain_query(self) -> ChainQuery:
+        return context(self.args, self.configyaml, self.script_registry)
+
+    @cached_property
+    def simulated(self) -> bool:
+        """Whether the chain is, or includes, the in-process simulator."""
+        if self.args.connection == "pool":
+            return "simulator" in pool_services(self.configyaml)
+        return self.args.connection == "simulator"
+
+    @cached_property
+    def contracts_addresses(self):
+        addresses = load_contracts_addresses(self.configyaml)
+        if self.simulated:
+            oracle_address = simulated_oracle_address(
+                self.network, self.script_registry
+            )
+            addresses = (oracle_address, *addresses[1:])
+        return addresses
+
+    @property
+    def oracle_address(self) -> Address:
+        return self.contracts_addresses[0]
+
+    @property
+    def swap_address(self) -> Address:
+        return self.contracts_addresses[1]
+
+    @cached_property
+    def swap_config_tokens(self):
+        return load_swap_config_tokens(self.configyaml)
+
+    @cached_property
+    def odv_oracle_config_tokens(self):
+        return load_odv_oracle_config_tokens(self.configyaml)
+
+    @cached_property
+    def extended_payment_skey(self) -> ExtendedSigningKey:
+        return user_wallet_extended_signing_key(self.configyaml)
+
+    @cached_property
+    def user_credentials(self):
+        return user_wallet_credentials(self.configyaml)
+
+    @cached_property
+    def user_address(self) -> Address:
+        return user_wallet_address(self.configyaml, self.args)
+
+    @cached_property
+    def script_registry(self) -> ScriptRegistry:
+        registry = default_registry()
+        for problem in registry.validate(self.configyaml, self.network):
+            print(f"Warning: {problem}")
+        return registry
+
+    @property
+    def swap_script(self) -> PlutusV2Script:
+        return self.script_registry["swap"].script
+
+    @property
+    def mint_script(self) -> PlutusV2Script:
+        return self.script_registry["mint_script"].script
+
+    @cached_property
+    def swap_contract(self) -> SwapContract:
+        swap_nft, token_a = self.swap_config_tokens
+        aggstate_nft, oracle_nft, _, _ = self.odv_oracle_config_tokens
+        swap = Swap(swap_nft, token_a)
+        return SwapContract(
+            self.chain_query,
+            oracle_nft,
+            self.oracle_address,
+            self.swap_address,
+            swap,
+            ContentionPolicy.from_config(self.configyaml.get("contention")),
+        )
+
+    @cached_property
+    def quote_engine(self) -> QuoteEngine:
+        """Quotes over the feed and swap state, cached per the ``quotes`` settings."""
+        settings = self.configyaml.get("quotes") or {}
+        return QuoteEngine(self.swap_contract, float(settings.get("ttl", 5.0)))
+
+    @cached_property
+    def price_history(self) -> PriceHistory:
+        """Oracle feed updates stored in the ``price_history`` file."""
+        return PriceHistory(history_path(self.configyaml))
+
+    async def sync_price_history(self) -> Optional[int]:
+        """Index the feed updates since the last run.
+
+        Returns:
+            Optional[int]: Updates appended, None without a Kupo connection.
+        """
+        kupo = self.chain_query.kupo_context
+        if kupo is None:
+            return None
+        _, oracle_nft, _, _ = self.odv_oracle_config_tokens
+        indexer = PriceHistoryIndexer(
+            kupo, str(self.oracle_address), oracle_nft, self.price_history
+        )
+        return await indexer.sync()
+
+    def feed_watcher(self, interval: float = 2.0) -> FeedWatcher:
+        """Watcher of the oracle feed, polling every ``interval`` seconds."""
+        chain_query = self.chain_query
+        if chain_query.simulator_context is not None:
+            source = SimulatorFeedSource(
+                chain_query.simulator_context, self.swap_contract
+            )
+        elif chain_query.kupo_context is not None:
+            _, oracle_nft, _, _ = self.odv_oracle_config_tokens
+            source = KupoFeedSource(
+                chain_query.kupo_context,
+                str(self.oracle_address),
+                oracle_nft,
+                self.network,
+            )
+        else:
+            source = BlockfrostFeedSource(
+                chain_query.blockfrost_context.api, self.swap_contract, self.network
+            )
+        return FeedWatcher(source, interval)
+
+    @cached_property
+    def swap_activity(self) -> SwapActivityStore:
+        """Swap events stored in the ``swap_activity`` database.
+
+        Kept in memory for the simulator, whose chain starts over every run.
+        """
+        if self.simulated:
+            return SwapActivityStore(":memory:")
+        return SwapActivityStore(activity_path(self.configyaml))
+
+    @cached_property
+    def swap_activity_indexer(self) -> SwapActivityIndexer:
+        """Indexer reading the swap events from the best source available."""
+        swap_nft, token_a = self.swap_config_tokens
+        address = str(self.swap_address)
+        chain_query = self.chain_query
+        if chain_query.simulator_context is not None:
+            source = SimulatorSwapSource(
+                chain_query.simulator_context, address, swap_nft, token_a
+            )
+        elif chain_query.blockfrost_context is not None:
+            source = BlockfrostSwapSource(
+                chain_query.blockfrost_context.api,
+                address,
+                swap_nft,
+                token_a,
+                self.network,
+            )
+        else:
+            source = KupoSwapSource(
+                chain_query.kupo_context, address, swap_nft, token_a, self.network
+            )
+        return SwapActivityIndexer(source, self.swap_activity)
+
+    @cached_property
+    def reference_script_input(self) -> TransactionInput:
+        load_script_input = self.configyaml.get("script_input_oracle")
+        tx_id_hex, index = load_script_input.split("#")
+        return TransactionInput(TransactionId(bytes.fromhex(tx_id_hex)), int(index))
+
+    @cached_property
+    def consolidator(self) -> Consolidator:
+        """Wallet consolidation per the ``consolidation`` settings."""
+        return Consolidator(
+            self.chain_query,
+            self.user_address,
+            self.extended_payment_skey,
+            ConsolidationPolicy.from_config(self.configyaml.get("consolidation")),
+        )
+
+    def oracle_user(self) -> OracleUser:
+        """Build an ODV request client.
+
+        Not cached: the dynamic payment rate is read when the client is
+        created, so each request gets a fresh one.
+        """
+        (
+            _,
+            _,
+            dynamic_payment_oracle_addr,
+            dynamic_payment_oracle_nft,
+        ) = self.contracts_addresses
+        aggstate_nft, _, c3_token_hash, c3_token_name = self.odv_oracle_config_tokens
+        spend_vk, stake_vk = self.user_credentials
+        return OracleUser(
+            self.network,
+            self.chain_query,
+            self.extended_payment_skey,
+            spend_vk,
+            stake_vk,
+            str(self.oracle_address),
+            aggstate_nft,
+            self.reference_script_input,
+            c3_token_hash,
+            c3_token_name,
+            dynamic_payment_oracle_addr,
+            dynamic_payment_oracle_nft,
+        )
@@ -0,0 +1,387 @@
+"""Long-running JSON-RPC daemon for the swap demo"""
+
+import asyncio
+import inspect
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from .lib.datums import GenericData
+from .lib.metrics import metrics
+from .lib.swap_activity import PERIODS
+from .runtime import Runtime
+
+logger = logging.getLogger("server")
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+def _is_integer(value: Any) -> bool:
+    # JSON booleans decode to bool, a subclass of int.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class RpcError(Exception):
+    """Error reported back to the caller as a JSON-RPC error object."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class DemoServer:
+    """JSON-RPC 2.0 server that keeps a Runtime warm between calls.
+
+    Read-only calls (quotes, liquidity, feed) run concurrently. Calls that
+    submit a transaction share the wallet and the swap UTxO, so they are
+    serialized behind a single lock.
+
+    Attributes:
+        runtime: Shared chain context, keys, scripts and contract clients.
+    """
+
+    def __init__(self, runtime: Runtime) -> None:
+        self.runtime = runtime
+        self._tx_lock = asyncio.Lock()
+        self.methods = {
+            "addresses": self.addresses,
+            "quote": self.quote,
+            "ladder": self.ladder,
+            "trade": self.trade,
+            "swap_liquidity": self.swap_liquidity,
+            "user_liquidity": self.user_liquidity,
+            "add_liquidity": self.add_liquidity,
+            "feed": self.feed,
+            "odv_request": self.odv_request,
+            "consolidate": self.consolidate,
+            "swap_activity": self.swap_activity,
+        }
+
+    def make_app(self) -> web.Application:
+        """Create the aiohttp application with the RPC and health routes."""
+        app = web.Application()
+        app.router.add_post("/rpc", self.handle_rpc)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+    async def handle_health(self, _: web.Request) -> web.Response:
+        health = {"status": "ok"}
+        pool = self.runtime.chain_query.backend_pool
+        if pool is not None:
+            health["backends"] = pool.health()
+        return web.json_response(health)
+
+    async def handle_metrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            text=metrics.to_prometheus(), content_type="text/plain", charset="utf-8"
+        )
+
+    async def handle_rpc(self, request: web.Request) -> web.Response:
+        """Entry point for single and batch JSON-RPC requests."""
+        try:
+            payload = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response(
+                self._error(None, PARSE_ERROR, "Parse error"), status=400
+            )
+
+        if isinstance(payload, list):
+            if not payload:
+                return web.json_response(
+                    self._error(None, INVALID_REQUEST, "Empty batch"), status=400
+                )
+            responses = await asyncio.gather(*(self.dispatch(p) for p in payload))
+            responses = [r for r in responses if r is not None]
+            return web.json_response(responses)
+
+        response = await self.dispatch(payload)
+        if response is None:
+            return web.Response(status=204)
+        return web.json_response(response)
+
+    async def dispatch(self, payload: Any) -> Optional[Dict[str, Any]]:
+        """Run one JSON-RPC call.
+
+        Args:
+            payload: The decoded request object.
+
+        Returns:
+            The response object, or None for notifications (no ``id``).
+        """
+        if not isinstance(payload, dict) or payload.get("jsonrpc") != "2.0":
+            return self._error(None, INVALID_REQUEST, "Invalid request")
+
+        request_id = payload.get("id")
+        method = self.methods.get(payload.get("method"))
+        params = payload.get("params") or {}
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, "Method not found")
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, "params must be an object")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as err:
+                raise RpcError(INVALID_PARAMS, str(err)) from err
+            result = await method(**params)
+        except RpcError as err:
+            response = self._error(request_id, err.code, err.message)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.exception("RPC method %s failed", payload.get("method"))
+            response = self._error(request_id, SERVER_ERROR, str(err))
+        else:
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+        if "id" not in payload:
+            return None
+        return response
+
+    @staticmethod
+    def _error(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": code, "message": message},
+        }
+
+    @staticmethod
+    def _check_asset(asset: str) -> None:
+        if asset not in ("tADA", "tUSDT"):
+            raise RpcError(INVALID_PARAMS, "asset must be 'tADA' or 'tUSDT'")
+
+    @staticmethod
+    def _check_amount(name: str, amount: Any, allow_zero: bool = False) -> None:
+        """Reject an ``amount`` that is not a positive integer.
+
+        Zero is accepted too with ``allow_zero``.
+        """
+        if not _is_integer(amount):
+            raise RpcError(INVALID_PARAMS, f"{name} must be an integer")
+        if amount < 0:
+            raise RpcError(INVALID_PARAMS, f"{name} must not be negative")
+        if amount == 0 and not allow_zero:
+            raise RpcError(INVALID_PARAMS, f"{name} must be positive")
+
+    @staticmethod
+    def _tx_result(result) -> Dict[str, Any]:
+        if result is None:
+            raise RpcError(
+                SERVER_ERROR,
+                "Transaction rejected before submission, see the daemon log.",
+            )
+        status, tx = result
+        return {"status": status, "tx_id": str(tx.id)}
+
+    async def addresses(self) -> Dict[str, str]:
+        return {
+            "user": str(self.runtime.user_address),
+            "swap_contract": str(self.runtime.swap_address),
+            "oracle_contract": str(self.runtime.oracle_address),
+        }
+
+    async def quote(self, asset: str, amount: int) -> Dict[str, Any]:
+        """Price ``amount`` of ``asset`` against the cached oracle feed."""
+        self._check_asset(asset)
+        self._check_amount("amount", amount, allow_zero=True)
+        try:
+            ladder = await self.runtime.quote_engine.ladder(asset, [amount])
+        except ValueError as err:
+            raise RpcError(INVALID_PARAMS, str(err)) from err
+        return {
+            "asset_out": ladder.asset_out,
+            "amount_out": int(ladder.amounts_out[0]),
+            "fillable": bool(ladder.fillable[0]),
+        }
+
+    async def ladder(self, asset: str, amounts: List[int]) -> Dict[str, Any]:
+        """Price every size in ``amounts`` of ``asset`` in one call."""
+        self._check_asset(asset)
+        if not isinstance(amounts, list) or not all(map(_is_integer, amounts)):
+            raise RpcError(INVALID_PARAMS, "amounts must be a list of integers")
+        try:
+            ladder = await self.runtime.quote_engine.ladder(asset, amounts)
+        except ValueError as err:
+            raise RpcError(INVALID_PARAMS, str(err)) from err
+        return ladder.to_dict()
+
+    async def trade(self, asset: str, amount: int) -> Dict[str, Any]:
+        """Sell ``amount`` of ``asset`` to the swap contract."""
+        self._check_asset(asset)
+        self._check_amount("amount", amount)
+        runtime = self.runtime
+        swap_fn = (
+            runtime.swap_contract.swap_B
+            if asset == "tADA"
+            else runtime.swap_contract.swap_A
+        )
+        async with self._tx_lock:
+            result = await swap_fn(
+                amount,
+                runtime.user_address,
+                runtime.swap_address,
+                runtime.swap_script,
+                runtime.extended_payment_skey,
+            )
+        return self._tx_result(result)
+
+    async def swap_liquidity(self) -> Dict[str, int]:
+        swap_contract = self.runtime.swap_contract
+        swap_utxo = await swap_contract.get_swap_utxo()
+        return {
+            "tlovelace": swap_utxo.output.amount.coin,
+            "tUSDT": await swap_contract.add_asset_swap_amount(0),
+        }
+
+    async def user_liquidity(self) -> Dict[str, int]:
+        swap_contract = self.runtime.swap_contract
+        user_address = self.runtime.user_address
+        balances = await swap_contract.user_balances(user_address)
+        return {
+            "tlovelace": balances.lovelace,
+            "tUSDT": balances.quantity(*swap_contract.coin_a_ids()),
+            "pure_tlovelace": balances.pure_lovelace,
+            "collateral_tlovelace": balances.collateral_lovelace,
+        }
+
+    async def add_liquidity(self, tusdt: int, tada: int) -> Dict[str, Any]:
+        self._check_amount("tusdt", tusdt, allow_zero=True)
+        self._check_amount("tada", tada, allow_zero=True)
+        if tusdt == tada == 0:
+            raise RpcError(INVALID_PARAMS, "tusdt or tada must be positive")
+        runtime = self.runtime
+        async with self._tx_lock:
+            result = await runtime.swap_contract.add_liquidity(
+                tusdt,
+                tada,
+                runtime.user_address,
+                runtime.swap_address,
+                runtime.swap_script,
+                runtime.extended_payment_skey,
+            )
+        return self._tx_result(result)
+
+    async def feed(self) -> Dict[str, Any]:
+        """Current oracle feed, decoded from a single UTxO lookup."""
+        oracle_utxo = await self.runtime.swap_contract.get_oracle_utxo()
+        price_data = GenericData.from_cbor(oracle_utxo.output.datum.cbor).price_data
+        return {
+            "price": price_data.get_price(),
+            "timestamp": price_data.get_timestamp(),
+            "expiry": price_data.get_expiry(),
+        }
+
+    async def odv_request(self, funds: Optional[int] = None) -> Dict[str, Any]:
+        if funds is not None:
+            self._check_amount("funds", funds)
+        oracle_user = await asyncio.to_thread(self.runtime.oracle_user)
+        if funds is None:
+            funds = await oracle_user.calc_recommended_funds_amount()
+        async with self._tx_lock:
+            result = await oracle_user.send_odv_request(funds)
+        response = {"funds": funds}
+        if result is not None:
+            response.update(self._tx_result(result))
+        return response
+
+    async def consolidate(self, dry_run: bool = False) -> Dict[str, Any]:
+        if dry_run:
+            rounds = await self.runtime.consolidator.run(dry_run=True)
+        else:
+            async with self._tx_lock:
+                rounds = await self.runtime.consolidator.run()
+        return {"rounds": rounds}
+
+    async def swap_activity(
+        self, period: str = "day", limit: int = 10, sync: bool = True
+    ) -> Dict[str, Any]:
+        """Trading volume, liquidity per ``period`` and the most active users.
+
+        The new trades are indexed first unless ``sync`` is false, e.g. when
+        the daemon indexes them periodically.
+        """
+        if period not in PERIODS:
+            raise RpcError(INVALID_PARAMS, f"period must be one of {list(PERIODS)}")
+        if sync:
+            await self.runtime.swap_activity_indexer.sync()
+        store = self.runtime.swap_activity
+        seconds = PERIODS[period]
+        return {
+            "events": len(store),
+            "volume": store.volume(seconds),
+            "liquidity": store.liquidity_curve(seconds),
+            "users": store.trades_per_user(limit),
+        }
+
+    async def consolidate_periodically(self, interval: float) -> None:
+        """Consolidate the wallet every ``interval`` seconds, between trades."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.consolidate()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Scheduled consolidation failed")
+                continue
+            for summary in result["rounds"]:
+                if summary["transactions"]:
+                    logger.info("Consolidated wallet: %s", summary)
+
+
+async def serve(
+    runtime: Runtime,
+    host: str,
+    port: int,
+    consolidate_every: float = 0,
+    index_activity_every: float = 0,
+) -> None:
+    """Warm up the runtime and serve JSON-RPC requests until cancelled.
+
+    Args:
+        runtime: The runtime to keep loaded.
+        host: Interface to bind to.
+        port: TCP port to listen on.
+        consolidate_every: Seconds between wallet consolidations, 0 for none.
+        index_activity_every: Seconds between indexing runs of the swap
+            activity, 0 for none.
+    """
+    # Pay for key derivation, script decoding and context creation up front
+    # instead of on the first request.
+    _ = (
+        runtime.chain_query,
+        runtime.user_address,
+        runtime.extended_payment_skey,
+        runtime.swap_script,
+        runtime.swap_contract,
+    )
+
+    server = DemoServer(runtime)
+    app_runner = web.AppRunner(server.make_app())
+    await app_runner.setup()
+    site = web.TCPSite(app_runner, host, port)
+    await site.start()
+    print(f"odv-demo daemon listening on http://{host}:{port}/rpc")
+    consolidation = (
+        asyncio.create_task(server.consolidate_periodically(consolidate_every))
+        if consolidate_every > 0
+        else None
+    )
+    indexing = (
+        asyncio.create_task(runtime.swap_activity_indexer.follow(index_activity_every))
+        if index_activity_every > 0
+        else None
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for task in (consolidation, indexing):
+            if task is not None:
+                task.cancel()
+        await app_runner.cleanup()
@@ -1,10 +1,24 @@
 """Swap Contract"""
 
+from copy import deepcopy
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 
 import pycardano as pyc
 
+from swap_demo_contract.lib.balances import BalanceIndex
 from swap_demo_contract.lib.chain_query import ChainQuery
+from swap_demo_contract.lib.contention import (
+    ContentionPolicy,
+    SlippageExceeded,
+    check_slippage,
+    is_contention_error,
+    names_utxo,
+    replacement,
+)
+from swap_demo_contract.lib.metrics import metrics
+from swap_demo_contract.lib.ratelimit import budgeted
+from swap_demo_contract.lib.tx_templates import ScriptSpendTemplate, TemplatedBuilder
 
 from .lib.datums import GenericData
 from .lib.redeemers import AddLiquidity, SwapA, SwapB
@@ -36,6 +50,8 @@ class SwapContract:
         oracle_nft: The NFT identifier of the oracle feed utxo
         oracle_addr: Address of the oracle contract
         swap_addr: Address of the swap contract
+        contention: How trades are retried when another trade spends the
+            swap UTxO first
     """
 
     def __init__(
@@ -45,6 +61,7 @@ class SwapContract:
         oracle_addr: pyc.Address,
         swap_addr: pyc.Address,
         swap: Swap,
+        contention: Optional[ContentionPolicy] = None,
     ) -> None:
         self.chain_query = chain_query
         self.oracle_addr = oracle_addr
@@ -52,7 +69,11 @@ class SwapContract:
         self.coin_precision = 1000000
         self.swap = swap
         self.oracle_nft = oracle_nft
+        self.contention = contention or ContentionPolicy()
+        self._templates: Dict[bytes, ScriptSpendTemplate] = {}
 
+    @metrics.timed("swap.add_liquidity")
+    @budgeted("add_liquidity")
     async def add_liquidity(
         self,
         amountA: int,
@@ -64,10 +85,9 @@ class SwapContract:
     ):
 
         swap_utxo = await self.get_swap_utxo()
-        available_user_tADA = (
-            await self.available_user_tlovelace(user_address) // 1000000
-        )
-        available_user_tUSDT = await self.available_user_tusdt(user_address)
+        balances = await self.user_balances(user_address)
+        available_user_tADA = balances.lovelace // 1000000
+        available_user_tUSDT = balances.quantity(*self.coin_a_ids())
         if available_user_tADA < amountB or available_user_tUSDT < amountA:
             print(
                 f"""Error! The user's wallet  doesn't have enough liquidity!
@@ -104,14 +124,17 @@ class SwapContract:
                 .add_output(updated_swap_utxo)
             )
 
-            await self.chain_query.submit_tx_builder(builder, sk, user_address)
+            result = await self.chain_query.submit_tx_builder(builder, sk, user_address)
 
             print("Updated swap contract liquidity:")
             print(
                 f"- {updated_amountB_for_swap_utxo // 1000000} tADA ({updated_amountB_for_swap_utxo} tlovelaces)"
             )
             print(f"- {updated_swap_total_amount} tUSDT.")
+            return result
 
+    @metrics.timed("swap.swap_A")
+    @budgeted("trade")
     async def swap_A(
         self,
         amountA: int,
@@ -123,8 +146,9 @@ class SwapContract:
         """Exchange of asset A  with B"""
         oracle_feed_utxo = await self.get_oracle_utxo()
         swap_utxo = await self.get_swap_utxo()
-        amountB = await self.swap_a_with_b(amountA)
-        amountB_precision = amountB * self.coin_precision
+        price = self.oracle_price(oracle_feed_utxo)
+        self.print_exchange_rate(price)
+        amountB = self.a_to_b(amountA, price)
 
         swap_amountB_tADA = swap_utxo.output.amount.coin // 1000000
         user_amountB_tUSDT = await self.available_user_tusdt(user_address)
@@ -141,48 +165,21 @@ class SwapContract:
             print(f"Error! The user's wallet doesn't have enough liquidity!")
             print(f"Available: {user_amountB_tUSDT} tUSDT.")
         else:
-            swap_redeemer = pyc.Redeemer(SwapA(amountA))
-
-            amount_for_the_user = pyc.transaction.Value(coin=amountB_precision)
-
-            new_output_utxo_user = pyc.TransactionOutput(
-                address=user_address, amount=amount_for_the_user
-            )
-
-            # swap utxo
-            # TODO change units to ada instead of lovelace
-            updated_amountB_for_swap_utxo = swap_utxo.output.amount.coin - amountB
-
-            updated_swap_multi_asset, updated_swap_total_amount = (
-                await self.add_asset_swap(amountA)
-            )
-            amount_swap = pyc.transaction.Value(
-                coin=updated_amountB_for_swap_utxo,
-                multi_asset=updated_swap_multi_asset,
-            )
-
-            new_output_swap = pyc.TransactionOutput(
-                address=swap_address, amount=amount_swap, datum=pyc.Unit()
-            )
-
-            builder = pyc.TransactionBuilder(self.chain_query.context)
-            (
-                builder.add_script_input(
-                    utxo=swap_utxo, script=script, redeemer=swap_redeemer
-                )
-                .add_input_address(user_address)
-                .add_output(new_output_utxo_user)
-                .add_output(new_output_swap)
-                .reference_inputs.add(oracle_feed_utxo.input)
-            )
-
             print(f"Exchanging {amountA} lovelace for {amountB} tADA.")
-            await self.chain_query.submit_tx_builder(builder, sk, user_address)
-
-            print("Updated swap contract liquidity:")
-            print(f"- {updated_amountB_for_swap_utxo} tlovelaces.")
-            print(f"- {updated_swap_total_amount} tUSDT.")
+            return await self.execute_trade(
+                "A",
+                amountA,
+                amountB,
+                swap_utxo,
+                oracle_feed_utxo,
+                user_address,
+                swap_address,
+                script,
+                sk,
+            )
 
+    @metrics.timed("swap.swap_B")
+    @budgeted("trade")
     async def swap_B(
         self,
         amountB: int,
@@ -194,12 +191,14 @@ class SwapContract:
         """Exchange of asset B  with A"""
         oracle_feed_utxo = await self.get_oracle_utxo()
         swap_utxo = await self.get_swap_utxo()
-        amountA = await self.swap_b_with_a(amountB)
+        price = self.oracle_price(oracle_feed_utxo)
+        self.print_exchange_rate(price)
+        amountA = self.b_to_a(amountB, price)
         available_user_tADA = (
             await self.available_user_tlovelace(user_address) // 1000000
         )
 
-        available_swap_tusdt = await self.decrease_asset_swap_amount(0)
+        available_swap_tusdt = self.swap_token_amount(swap_utxo)
         if amountA < 1:
             print(
                 f"The minimum sale quantity of tUSDT is 1. Current value {amountA} tUSDT."
@@ -215,75 +214,307 @@ class SwapContract:
             Available: {available_swap_tusdt} tUSDT."""
             )
         else:
-            swap_redeemer = pyc.Redeemer(SwapB(amountB))
+            print(f"Exchanging {amountB} tADA for {amountA} tUSDT.")
+            return await self.execute_trade(
+                "B",
+                amountB,
+                amountA,
+                swap_utxo,
+                oracle_feed_utxo,
+                user_address,
+                swap_address,
+                script,
+                sk,
+            )
 
-            multi_asset_for_the_user = await self.take_multi_asset_user(amountA)
+    async def execute_trade(
+        self,
+        side: str,
+        amount_in: int,
+        amount_out: int,
+        swap_utxo: pyc.UTxO,
+        oracle_feed_utxo: pyc.UTxO,
+        user_address: pyc.Address,
+        swap_address: pyc.Address,
+        script: bytes,
+        sk: pyc.PaymentSigningKey,
+    ) -> Optional[Tuple[str, pyc.Transaction]]:
+        """Build, submit and confirm a trade, retrying if it loses the swap UTxO.
+
+        When the node rejects the transaction because an input is gone,
+        only the UTxOs named by the error are refreshed: the swap UTxO is
+        polled until the trade that spent it shows up, and the trade is
+        rebuilt against it. The quote is kept, since the price comes from
+        the oracle feed, unless the feed itself was replaced, in which case
+        the trade is re-quoted within ``contention.slippage`` of the first
+        quote. At most ``contention.max_retries`` rebuilds are made.
+
+        Args:
+            side (str): ``A`` to sell tUSDT (``build_swap_a_tx``), ``B`` to
+        sell tADA (``build_swap_b_tx``)
+            amount_in (int): amount sold
+            amount_out (int): amount bought, as quoted
+            swap_utxo (pyc.UTxO): the swap UTxO the trade was quoted against
+            oracle_feed_utxo (pyc.UTxO): the oracle feed the price came from
+            user_address (pyc.Address): trader's address
+            swap_address (pyc.Address): swap contract address
+            script (bytes): swap contract script
+            sk (pyc.PaymentSigningKey): trader's signing key
 
-            # Add the minimum lovelace amount to the user value
-            amount_for_the_user = pyc.transaction.Value(
-                coin=2000000, multi_asset=multi_asset_for_the_user
+        Returns:
+            Optional[Tuple[str, pyc.Transaction]]: The status of the
+            transaction and the transaction, None if no transaction could
+            be submitted.
+        """
+        policy = self.contention
+        quoted = amount_out
+        build = self.build_swap_a_tx if side == "A" else self.build_swap_b_tx
+        for attempt in range(policy.max_retries + 1):
+            tx = None
+            builder = build(
+                amount_in,
+                amount_out,
+                swap_utxo,
+                oracle_feed_utxo,
+                user_address,
+                swap_address,
+                script,
             )
+            try:
+                tx = await self.chain_query.build_tx(builder, sk, user_address)
+                await self.chain_query.submit_tx(tx)
+                break
+            except Exception as err:  # pylint: disable=broad-except
+                if not is_contention_error(err):
+                    if tx is None:
+                        raise
+                    print(f"Error submitting transaction: {str(err)}")
+                    return "collateral error", tx
+                if attempt == policy.max_retries:
+                    print(f"Error! Swap UTxO still contended: {str(err)}")
+                    return None if tx is None else ("contention", tx)
+                metrics.inc("trade_retries", side=side)
+                print(
+                    "The swap UTxO was spent by another trade, retrying "
+                    f"({attempt + 1}/{policy.max_retries})."
+                )
 
-            # Add the value to the user UTXO
-            new_output_utxo_user = pyc.TransactionOutput(
-                address=user_address, amount=amount_for_the_user
-            )
+                oracle_spent = names_utxo(err, oracle_feed_utxo)
+                if names_utxo(err, swap_utxo):
+                    fresh = await replacement(self.get_swap_utxo, swap_utxo, policy)
+                    if fresh is None:
+                        # Still unspent after all: refresh the wallet.
+                        self.chain_query.drop_indexes()
+                    else:
+                        swap_utxo = fresh
+                elif not oracle_spent:
+                    # A wallet input went stale.
+                    self.chain_query.drop_indexes()
+                    swap_utxo = await self.get_swap_utxo()
+
+                if oracle_spent:
+                    oracle_feed_utxo = await self.get_oracle_utxo()
+                    price = self.oracle_price(oracle_feed_utxo)
+                    self.print_exchange_rate(price)
+                    amount_out = self.quote(side, amount_in, price)
+                    try:
+                        check_slippage(quoted, amount_out, policy.slippage)
+                    except SlippageExceeded as exc:
+                        print(f"Error! {str(exc)}")
+                        return None
+
+                available = self.swap_liquidity(side, swap_utxo)
+                if amount_out > available:
+                    print(
+                        f"""Error! The swap contract doesn't have enough liquidity!
+            Available: {available} {'tADA' if side == 'A' else 'tUSDT'}."""
+                    )
+                    return None
 
-            amountB_at_swap_utxo = swap_utxo.output.amount.coin
-            updated_amountB_for_swap_utxo = amountB_at_swap_utxo + (amountB * 1000000)
+        try:
+            status, _ = await self.chain_query.wait_for_tx(str(tx.id))
+        finally:
+            self.chain_query.release_inputs(tx)
+
+        updated_swap_utxo = self.find_swap_output(tx)
+        updated_lovelace = updated_swap_utxo.output.amount.coin
+        print("Updated swap contract liquidity:")
+        print(f"- {updated_lovelace // 1000000} tADA ({updated_lovelace} tlovelaces).")
+        print(f"- {self.swap_token_amount(updated_swap_utxo)} tUSDT.")
+        return status, tx
+
+    def quote(self, side: str, amount_in: int, price: int) -> int:
+        """Amount bought selling ``amount_in`` on ``side`` at oracle ``price``."""
+        if side == "A":
+            return self.a_to_b(amount_in, price)
+        return self.b_to_a(amount_in, price)
+
+    def swap_liquidity(self, side: str, swap_utxo: pyc.UTxO) -> int:
+        """Most ``swap_utxo`` pays out to a trade selling on ``side``."""
+        if side == "A":
+            return swap_utxo.output.amount.coin // 1000000
+        return self.swap_token_amount(swap_utxo)
+
+    def build_swap_a_tx(
+        self,
+        amountA: int,
+        amountB: int,
+        swap_utxo: pyc.UTxO,
+        oracle_feed_utxo: pyc.UTxO,
+        user_address: pyc.Address,
+        swap_address: pyc.Address,
+        script: bytes,
+        ex_units: Optional[pyc.ExecutionUnits] = None,
+    ) -> TemplatedBuilder:
+        """Transaction selling ``amountA`` tUSDT for ``amountB`` tADA.
 
-            updated_masset_for_swap_utxo = await self.decrease_asset_swap(amountA)
-            updated_masset_amount_for_swap_utxo = await self.decrease_asset_swap_amount(
-                amountA
-            )
+        No chain queries are made, so the swap UTxO may come from a transaction
+        that is not confirmed yet. In that case ``ex_units`` must be given,
+        since the script cannot be evaluated against the chain.
+        """
+        amount_for_the_user = pyc.transaction.Value(coin=amountB * self.coin_precision)
 
-            amount_swap = pyc.transaction.Value(
-                coin=updated_amountB_for_swap_utxo,
-                multi_asset=updated_masset_for_swap_utxo,
-            )
+        new_output_utxo_user = pyc.TransactionOutput(
+            address=user_address, amount=amount_for_the_user
+        )
 
-            new_output_swap = pyc.TransactionOutput(
-                address=swap_address, amount=amount_swap, datum=pyc.Unit()
-            )
+        # swap utxo
+        # TODO change units to ada instead of lovelace
+        amount_swap = pyc.transaction.Value(
+            coin=swap_utxo.output.amount.coin - amountB,
+            multi_asset=self.with_swap_token_delta(swap_utxo, amountA),
+        )
 
-            builder = pyc.TransactionBuilder(self.chain_query.context)
-            (
-                builder.add_script_input(
-                    utxo=swap_utxo,
-                    script=script,
-                    redeemer=swap_redeemer,
-                )
-                .add_input_address(user_address)
-                .add_output(new_output_utxo_user)
-                .add_output(new_output_swap)
-                .reference_inputs.add(oracle_feed_utxo.input)
+        new_output_swap = pyc.TransactionOutput(
+            address=swap_address, amount=amount_swap, datum=pyc.Unit()
+        )
+
+        return (
+            self.swap_template(script)
+            .builder(
+                self.chain_query.context,
+                swap_utxo,
+                SwapA(amountA),
+                [new_output_utxo_user, new_output_swap],
+                reference_inputs=[oracle_feed_utxo.input],
+                ex_units=ex_units,
             )
+            .add_input_address(user_address)
+        )
 
-            print(f"Exchanging {amountB} tADA for {amountA} tUSDT.")
-            await self.chain_query.submit_tx_builder(builder, sk, user_address)
-            # await self.submit_tx_builder(builder, sk, user_address)
-            print("Updated swap contract liquidity:")
-            print(
-                f"- {updated_amountB_for_swap_utxo // 1000000 } tADA ({updated_amountB_for_swap_utxo} tlovelaces)."
+    def build_swap_b_tx(
+        self,
+        amountB: int,
+        amountA: int,
+        swap_utxo: pyc.UTxO,
+        oracle_feed_utxo: pyc.UTxO,
+        user_address: pyc.Address,
+        swap_address: pyc.Address,
+        script: bytes,
+        ex_units: Optional[pyc.ExecutionUnits] = None,
+    ) -> TemplatedBuilder:
+        """Transaction selling ``amountB`` tADA for ``amountA`` tUSDT.
+
+        See ``build_swap_a_tx`` for when ``ex_units`` is needed.
+        """
+        policy_id, asset_name = self.coin_a_ids()
+        multi_asset_for_the_user = pyc.MultiAsset(
+            {policy_id: pyc.Asset({asset_name: amountA})}
+        )
+
+        # Add the minimum lovelace amount to the user value
+        amount_for_the_user = pyc.transaction.Value(
+            coin=2000000, multi_asset=multi_asset_for_the_user
+        )
+
+        # Add the value to the user UTXO
+        new_output_utxo_user = pyc.TransactionOutput(
+            address=user_address, amount=amount_for_the_user
+        )
+
+        amount_swap = pyc.transaction.Value(
+            coin=swap_utxo.output.amount.coin + (amountB * 1000000),
+            multi_asset=self.with_swap_token_delta(swap_utxo, -amountA),
+        )
+
+        new_output_swap = pyc.TransactionOutput(
+            address=swap_address, amount=amount_swap, datum=pyc.Unit()
+        )
+
+        return (
+            self.swap_template(script)
+            .builder(
+                self.chain_query.context,
+                swap_utxo,
+                SwapB(amountB),
+                [new_output_utxo_user, new_output_swap],
+                reference_inputs=[oracle_feed_utxo.input],
+                ex_units=ex_units,
             )
-            print(f"- {updated_masset_amount_for_swap_utxo} tUSDT.")
+            .add_input_address(user_address)
+        )
+
+    def swap_template(self, script: pyc.PlutusV2Script) -> ScriptSpendTemplate:
+        """Template of the swap transactions spending with ``script``.
+
+        Shared by every trade, so the script witness, cost models and
+        collateral amount are worked out once.
+        """
+        template = self._templates.get(script)
+        if template is None:
+            template = self._templates[script] = ScriptSpendTemplate(script)
+        return template
+
+    def coin_a_ids(self) -> Tuple[pyc.ScriptHash, pyc.AssetName]:
+        """Policy id and asset name of asset A (tUSDT)."""
+        ((policy_id, assets),) = self.swap.coinA.items()
+        ((asset_name, _),) = assets.items()
+        return policy_id, asset_name
+
+    def swap_token_amount(self, swap_utxo: pyc.UTxO) -> int:
+        """Amount of asset A held by ``swap_utxo``."""
+        policy_id, asset_name = self.coin_a_ids()
+        return swap_utxo.output.amount.multi_asset.get(policy_id, {}).get(asset_name, 0)
+
+    def with_swap_token_delta(self, swap_utxo: pyc.UTxO, delta: int) -> pyc.MultiAsset:
+        """Copy of the swap UTxO assets with asset A changed by ``delta``."""
+        policy_id, asset_name = self.coin_a_ids()
+        multi_asset = deepcopy(swap_utxo.output.amount.multi_asset)
+        assets = multi_asset.setdefault(policy_id, pyc.Asset())
+        assets[asset_name] = assets.get(asset_name, 0) + delta
+        return multi_asset
+
+    def find_swap_output(self, tx: pyc.Transaction) -> Optional[pyc.UTxO]:
+        """The swap NFT output created by ``tx``, usable before confirmation."""
+        for index, output in enumerate(tx.transaction_body.outputs):
+            if output.amount.multi_asset >= self.swap.swap_nft:
+                return pyc.UTxO(pyc.TransactionInput(tx.id, index), output)
+        return None
+
+    def a_to_b(self, amount_a: int, price: int) -> int:
+        """tADA received for ``amount_a`` tUSDT at oracle ``price``."""
+        return (amount_a * price) // self.coin_precision
+
+    def b_to_a(self, amount_b: int, price: int) -> int:
+        """tUSDT received for ``amount_b`` tADA at oracle ``price``."""
+        return (amount_b * self.coin_precision) // price
+
+    def print_exchange_rate(self, price: int) -> None:
+        """Print the oracle exchange rate ``price``."""
+        print(f"Oracle exchange rate: {price / self.coin_precision} tUSDT/tADA (A/B)")
 
     async def swap_b_with_a(self, amount_b: int) -> int:
         """Operation for swaping coin B with A"""
         exchange_rate_price = await self.get_oracle_exchange_rate()
         print(exchange_rate_price)
-        print(
-            f"Oracle exchange rate: {exchange_rate_price / self.coin_precision} tUSDT/tADA (A/B)"
-        )
-        return (amount_b * self.coin_precision) // exchange_rate_price
+        self.print_exchange_rate(exchange_rate_price)
+        return self.b_to_a(amount_b, exchange_rate_price)
 
     async def swap_a_with_b(self, amount_a: int) -> int:
         """Operation for swaping coin A with B"""
         exchange_rate_price = await self.get_oracle_exchange_rate()
-        print(
-            f"Oracle exchange rate: {exchange_rate_price / self.coin_precision} tUSDT/tADA (A/B)"
-        )
-        return (amount_a * exchange_rate_price) // self.coin_precision
+        self.print_exchange_rate(exchange_rate_price)
+        return self.a_to_b(amount_a, exchange_rate_price)
 
     def format_timestamp(self, timestamp):
         """Convert epoch to humnan"""
@@ -296,9 +527,12 @@ class SwapContract:
         Returns:
             A tuple containing the exchange rate and the UTxO object, or None if not available.
         """
-        price = 0
         oracle_feed_utxo = await self.get_oracle_utxo()
+        return self.oracle_price(oracle_feed_utxo)
 
+    def oracle_price(self, oracle_feed_utxo: pyc.UTxO) -> int:
+        """Decode the exchange rate from an oracle feed UTxO (0 if absent)."""
+        price = 0
         if oracle_feed_utxo.output.datum and not isinstance(
             oracle_feed_utxo.output.datum, GenericData
         ):
@@ -326,28 +560,31 @@ class SwapContract:
         )
         return oracle_inline_datum.price_data.get_expiry()
 
+    @metrics.timed("swap.get_oracle_utxo")
     async def get_oracle_utxo(self) -> pyc.UTxO:
         """Retrieve the oracle's feed UTXO using the NFT identifier."""
-        oracle_utxos = await self.chain_query.get_utxos(str(self.oracle_addr))
-        oracle_utxo_nft = next(
-            utxo
-            for utxo in oracle_utxos
-            if utxo.output.amount.multi_asset == self.oracle_nft
+        oracle_utxo_nft = await self.chain_query.find_utxo(
+            str(self.oracle_addr),
+            lambda utxo: utxo.output.amount.multi_asset == self.oracle_nft,
+            reference_scripts=False,
+            holding=self.oracle_nft,
         )
+        if oracle_utxo_nft is None:
+            raise ValueError("No oracle feed UTxO found for the given NFT identifier")
         return oracle_utxo_nft
 
+    @metrics.timed("swap.get_swap_utxo")
     async def get_swap_utxo(self) -> pyc.UTxO:
         """Retrieve the UTxO for the swap using the NFT identifier"""
-        swap_utxos = await self.chain_query.get_utxos(str(self.swap_addr))
-        try:
-            swap_utxo_nft = next(
-                x
-                for x in swap_utxos
-                if x.output.amount.multi_asset >= self.swap.swap_nft
-            )
-            return swap_utxo_nft
-        except StopIteration:
+        swap_utxo_nft = await self.chain_query.find_utxo(
+            str(self.swap_addr),
+            lambda x: x.output.amount.multi_asset >= self.swap.swap_nft,
+            reference_scripts=False,
+            holding=self.swap.swap_nft,
+        )
+        if swap_utxo_nft is None:
             raise ValueError("No matching UTxO found for the given NFT identifier")
+        return swap_utxo_nft
 
     async def decrease_asset_swap(self, selling_amount: int) -> pyc.MultiAsset:
         """The updated swap asset to be decreased at the address"""
@@ -454,32 +691,19 @@ class SwapContract:
         new_multi_asset_dict[policy_id] = multi_asset_assets_names
         return new_multi_asset_dict
 
-    def available_user_pure_tlovelace(self, user_address: pyc.Address) -> int:
-        """Get the available user's pure lovelace amount"""
-        amount = 0
-        for utxo in self.chain_query.utxos(str(user_address)):
-            if not utxo.output.amount.multi_asset:
-                amount += utxo.output.amount.coin
-        return amount
+    async def user_balances(self, user_address: pyc.Address) -> BalanceIndex:
+        """Get the balance index of the user's wallet (one UTxO query)"""
+        return await self.chain_query.balance_index(user_address)
+
+    async def available_user_pure_tlovelace(self, user_address: pyc.Address) -> int:
+        """Get the available user's lovelace held in pure-ADA UTxOs"""
+        return (await self.user_balances(user_address)).pure_lovelace
 
     async def available_user_tlovelace(self, user_address: pyc.Address) -> int:
         """Get the available user's  lovelace amount"""
-        amount = 0
-        utxos = await self.chain_query.get_utxos(str(user_address))
-        for utxo in utxos:
-            amount += utxo.output.amount.coin
-        return amount
+        return (await self.user_balances(user_address)).lovelace
 
     async def available_user_tusdt(self, user_address: pyc.Address) -> int:
-        amount_asset = 0
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
-        utxos = await self.chain_query.get_utxos(str(user_address))
-        for utxo in utxos:
-            m_assets = utxo.output.amount.multi_asset.to_shallow_primitive()
-            for user_policy_id, assets in m_assets.items():
-                if user_policy_id == policy_id:
-                    for asset_name, amount in assets.items():
-                        if asset_name == asset:
-                            amount_asset += amount
-        return amount_asset
+        """Get the available user's tUSDT amount"""
+        balances = await self.user_balances(user_address)
+        return balances.quantity(*self.coin_a_ids())